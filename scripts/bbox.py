@@ -0,0 +1,43 @@
+"""World-space bounding boxes of many objects with NumPy.
+
+blender_script.py gathers the local bounding box corners (or vertices) and world
+matrices of all the meshes of a scene in bulk, and the functions here transform
+and reduce them with a few array operations instead of a Python loop over every
+corner of every object. They do not depend on bpy, so they can be checked
+against the per-corner implementation outside of Blender.
+"""
+
+from typing import Sequence, Tuple
+
+import numpy as np
+
+
+def corners_bounds(
+    corners: np.ndarray, matrices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the min and max of the transformed corners of every object.
+
+    corners has shape (num_objects, 8, 3) and matrices (num_objects, 4, 4).
+    """
+    points = np.einsum("oij,okj->oki", matrices[:, :3, :3], corners)
+    points += matrices[:, None, :3, 3]
+    points = points.reshape(-1, 3)
+    return points.min(axis=0), points.max(axis=0)
+
+
+def points_bounds(
+    points: Sequence[np.ndarray], matrices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the min and max of the transformed points of every object.
+
+    points[i] has shape (num_points_i, 3) and is transformed by matrices[i].
+    """
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    for object_points, matrix in zip(points, matrices):
+        if len(object_points) == 0:
+            continue
+        world = object_points @ matrix[:3, :3].T + matrix[:3, 3]
+        bbox_min = np.minimum(bbox_min, world.min(axis=0))
+        bbox_max = np.maximum(bbox_max, world.max(axis=0))
+    return bbox_min, bbox_max
@@ -0,0 +1,428 @@
+"""Offline throughput benchmark for distributed.py.
+
+Measures how fast the rendering pipeline gets through objects without a network
+connection, a GPU or Blender, so that scheduler and I/O changes can be
+regression tested on a CPU-only machine:
+
+- Synthetic GLB assets with a controlled number of triangles and texture size
+  are generated and served from a local HTTP server.
+- Blender is replaced by stub_blender.py, whose render latency and failure
+  distributions are configurable.
+- Uploads go to a local S3 stand-in that accepts every PUT after a configurable
+  latency.
+
+Every combination of the swept parameters is run as its own scenario, and the
+objects per second, the utilization of the download, render and upload stages
+and the tail latencies are reported from the spans that distributed.py records.
+
+Example usage:
+    python scripts/benchmark.py \
+        --num_gpus 1 2 \
+        --workers_per_gpu 1 4 \
+        --upload_latency 0 0.1
+
+Pass --blender_path to render the synthetic assets with the real
+blender_script.py instead, using EEVEE or Cycles on the CPU.
+"""
+
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+import tyro
+
+from spans import percentile, read_spans
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class Args:
+    num_objects: int = 200
+    """number of synthetic objects to render in each scenario"""
+
+    min_triangles: int = 100
+    """fewest triangles of a synthetic object"""
+
+    max_triangles: int = 100_000
+    """most triangles of a synthetic object. Counts are log-uniform in between"""
+
+    texture_size: int = 0
+    """width and height of the texture of each synthetic object. 0 means none"""
+
+    num_gpus: Tuple[int, ...] = (1,)
+    """numbers of gpus to sweep"""
+
+    workers_per_gpu: Tuple[int, ...] = (1, 2, 4)
+    """numbers of workers per gpu to sweep"""
+
+    prefetch_lookahead: Tuple[int, ...] = (32,)
+    """render queue sizes to sweep"""
+
+    upload_latency: Tuple[float, ...] = (0.0,)
+    """seconds the S3 stand-in takes to accept each file, to sweep"""
+
+    download_latency: float = 0.0
+    """seconds the asset server takes to start serving each object"""
+
+    download_workers: int = 8
+    """number of concurrent downloads"""
+
+    upload_workers: int = 16
+    """number of concurrent uploads"""
+
+    render_latency: float = 0.5
+    """mean seconds the stub takes to render an object"""
+
+    render_latency_sigma: float = 0.5
+    """spread of the log-normal render time of the stub"""
+
+    render_seconds_per_mb: float = 0.0
+    """extra seconds the stub takes to render each MB of an object"""
+
+    render_failure_rate: float = 0.0
+    """fraction of renders of the stub that fail"""
+
+    render_crash_rate: float = 0.0
+    """fraction of objects the stub always crashes on"""
+
+    blender_startup: float = 2.0
+    """seconds the stub takes to start, like Blender does"""
+
+    blender_path: Optional[str] = None
+    """render with this Blender executable and blender_script.py instead of the
+    stub"""
+
+    engine: Literal["CYCLES", "BLENDER_EEVEE"] = "BLENDER_EEVEE"
+    """render engine when rendering with Blender. Cycles renders on the CPU"""
+
+    output_path: str = "benchmark.jsonl"
+    """JSON lines file the results of each scenario are appended to"""
+
+    seed: int = 0
+    """random seed of the synthetic assets"""
+
+
+@dataclass
+class Scenario:
+    num_gpus: int
+    workers_per_gpu: int
+    prefetch_lookahead: int
+    upload_latency: float
+
+
+def make_png(size: int, rng: random.Random) -> bytes:
+    """Returns an RGB PNG of random noise, which barely compresses."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    row_bytes = size * 3
+    rows = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(size))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_glb(num_triangles: int, texture_size: int, rng: random.Random) -> bytes:
+    """Returns a GLB with a bumpy grid of about num_triangles triangles.
+
+    If texture_size is positive, the grid is textured with a PNG of that size.
+    """
+    k = max(2, math.ceil(math.sqrt(num_triangles / 2)) + 1)
+    positions = bytearray()
+    uvs = bytearray()
+    for y in range(k):
+        for x in range(k):
+            u, v = x / (k - 1), y / (k - 1)
+            positions += struct.pack("<3f", u - 0.5, v - 0.5, rng.random() * 0.05)
+            uvs += struct.pack("<2f", u, v)
+    indices = bytearray()
+    for y in range(k - 1):
+        for x in range(k - 1):
+            i = y * k + x
+            indices += struct.pack("<6I", i, i + 1, i + k, i + 1, i + k + 1, i + k)
+    num_vertices = k * k
+    num_indices = len(indices) // 4
+
+    buffer = bytearray()
+    buffer_views = []
+    for data in [positions, uvs, indices]:
+        buffer_views.append(
+            {"buffer": 0, "byteOffset": len(buffer), "byteLength": len(data)}
+        )
+        buffer += data
+    accessors = [
+        {
+            "bufferView": 0,
+            "componentType": 5126,
+            "count": num_vertices,
+            "type": "VEC3",
+            "min": [-0.5, -0.5, 0.0],
+            "max": [0.5, 0.5, 0.05],
+        },
+        {"bufferView": 1, "componentType": 5126, "count": num_vertices, "type": "VEC2"},
+        {"bufferView": 2, "componentType": 5125, "count": num_indices, "type": "SCALAR"},
+    ]
+    primitive = {"attributes": {"POSITION": 0, "TEXCOORD_0": 1}, "indices": 2}
+    gltf: Dict[str, Any] = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [primitive]}],
+    }
+    if texture_size > 0:
+        png = make_png(texture_size, rng)
+        buffer += b"\x00" * (-len(buffer) % 4)
+        buffer_views.append(
+            {"buffer": 0, "byteOffset": len(buffer), "byteLength": len(png)}
+        )
+        buffer += png
+        gltf["images"] = [{"bufferView": 3, "mimeType": "image/png"}]
+        gltf["textures"] = [{"source": 0}]
+        gltf["materials"] = [
+            {"pbrMetallicRoughness": {"baseColorTexture": {"index": 0}}}
+        ]
+        primitive["material"] = 0
+    buffer += b"\x00" * (-len(buffer) % 4)
+    gltf["buffers"] = [{"byteLength": len(buffer)}]
+    gltf["bufferViews"] = buffer_views
+    gltf["accessors"] = accessors
+
+    json_chunk = json.dumps(gltf).encode()
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    length = 12 + 8 + len(json_chunk) + 8 + len(buffer)
+    return (
+        struct.pack("<4sII", b"glTF", 2, length)
+        + struct.pack("<I4s", len(json_chunk), b"JSON")
+        + json_chunk
+        + struct.pack("<I4s", len(buffer), b"BIN\x00")
+        + bytes(buffer)
+    )
+
+
+def generate_assets(
+    asset_dir: str,
+    num_objects: int,
+    min_triangles: int,
+    max_triangles: int,
+    texture_size: int,
+    seed: int = 0,
+) -> List[str]:
+    """Writes synthetic GLBs named by random uids and returns their file names."""
+    rng = random.Random(seed)
+    os.makedirs(asset_dir, exist_ok=True)
+    file_names = []
+    for _ in range(num_objects):
+        # log-uniform, so that most objects are small and a few are huge
+        log_triangles = rng.uniform(math.log(min_triangles), math.log(max_triangles))
+        file_name = f"{rng.randbytes(16).hex()}.glb"
+        with open(os.path.join(asset_dir, file_name), "wb") as f:
+            f.write(make_glb(int(math.exp(log_triangles)), texture_size, rng))
+        file_names.append(file_name)
+    return file_names
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class AssetHandler(QuietHandler):
+    latency = 0.0
+
+    def do_GET(self) -> None:
+        time.sleep(self.latency)
+        super().do_GET()
+
+
+class FakeS3Handler(QuietHandler):
+    """Accepts every PUT like S3 would, after a fixed latency."""
+
+    latency = 0.0
+
+    def do_PUT(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("ETag", '"00000000000000000000000000000000"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_server(handler, latency: float, directory: Optional[str] = None):
+    """Starts an HTTP server on a free local port in a background thread."""
+    handler = type(handler.__name__, (handler,), {"latency": latency})
+    if directory is not None:
+        handler = partial(handler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def object_latencies(spans: List[Dict[str, Any]]) -> List[float]:
+    """Returns the time from the start of the download of each object until its
+    last stage finished."""
+    start = {}
+    end = {}
+    for span in spans:
+        if "uid" not in span:
+            continue
+        uid = span["uid"]
+        start[uid] = min(start.get(uid, math.inf), span["start"])
+        end[uid] = max(end.get(uid, -math.inf), span["start"] + span["duration"])
+    return [end[uid] - start[uid] for uid in start]
+
+
+def run_scenario(
+    args: Args, scenario: Scenario, urls: List[str], asset_dir: str
+) -> Dict[str, Any]:
+    s3_server = start_server(FakeS3Handler, scenario.upload_latency)
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        manifest_path = os.path.join(work_dir, "input_models_path.json")
+        with open(manifest_path, "w") as f:
+            json.dump(urls, f)
+        command = [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "distributed.py"),
+            "--input_models_path",
+            manifest_path,
+            "--num_gpus",
+            str(scenario.num_gpus),
+            "--workers_per_gpu",
+            str(scenario.workers_per_gpu),
+            "--prefetch_lookahead",
+            str(scenario.prefetch_lookahead),
+            "--download_workers",
+            str(args.download_workers),
+            "--upload_workers",
+            str(args.upload_workers),
+            "--upload_to_s3",
+            "--s3_endpoint_url",
+            f"http://127.0.0.1:{s3_server.server_port}",
+            "--s3_bucket",
+            "benchmark",
+            "--retry_backoff",
+            "0",
+            "--max_attempts",
+            "1",
+            "--blender_path",
+            args.blender_path or os.path.join(SCRIPTS_DIR, "stub_blender.py"),
+        ]
+        if args.blender_path is not None:
+            command += ["--engine", args.engine, "--cycles_device", "CPU"]
+        env = {
+            **os.environ,
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "STUB_BLENDER_STARTUP": str(args.blender_startup),
+            "STUB_BLENDER_LATENCY": str(args.render_latency),
+            "STUB_BLENDER_LATENCY_SIGMA": str(args.render_latency_sigma),
+            "STUB_BLENDER_SECONDS_PER_MB": str(args.render_seconds_per_mb),
+            "STUB_BLENDER_FAILURE_RATE": str(args.render_failure_rate),
+            "STUB_BLENDER_CRASH_RATE": str(args.render_crash_rate),
+        }
+        start = time.time()
+        subprocess.run(
+            command,
+            cwd=work_dir,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        wall_time = time.time() - start
+        spans = read_spans(os.path.join(work_dir, "spans.jsonl"))
+    finally:
+        s3_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    def busy(stage: str) -> float:
+        return sum(span["duration"] for span in spans if span["stage"] == stage)
+
+    num_workers = scenario.num_gpus * scenario.workers_per_gpu
+    rendered = [
+        span for span in spans if span["stage"] == "render_object" and span["success"]
+    ]
+    latencies = object_latencies(spans)
+    return {
+        **asdict(scenario),
+        "wall_seconds": wall_time,
+        "objects": len(rendered),
+        "objects_per_second": len(rendered) / wall_time,
+        "download_utilization": busy("download") / (wall_time * args.download_workers),
+        "render_utilization": busy("render_object") / (wall_time * num_workers),
+        "upload_utilization": busy("upload") / (wall_time * args.upload_workers),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+    }
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+
+    asset_dir = tempfile.mkdtemp(prefix="benchmark-assets-")
+    file_names = generate_assets(
+        asset_dir,
+        args.num_objects,
+        args.min_triangles,
+        args.max_triangles,
+        args.texture_size,
+        seed=args.seed,
+    )
+    asset_server = start_server(AssetHandler, args.download_latency, asset_dir)
+    urls = [
+        f"http://127.0.0.1:{asset_server.server_port}/{file_name}"
+        for file_name in file_names
+    ]
+
+    columns = [
+        "num_gpus",
+        "workers_per_gpu",
+        "prefetch_lookahead",
+        "upload_latency",
+        "objects_per_second",
+        "download_utilization",
+        "render_utilization",
+        "upload_utilization",
+        "latency_p50",
+        "latency_p95",
+        "latency_p99",
+    ]
+    widths = [max(len(c), 8) + 2 for c in columns]
+    print("".join(f"{c:>{w}}" for c, w in zip(columns, widths)))
+    try:
+        for values in itertools.product(
+            args.num_gpus,
+            args.workers_per_gpu,
+            args.prefetch_lookahead,
+            args.upload_latency,
+        ):
+            result = run_scenario(args, Scenario(*values), urls, asset_dir)
+            with open(args.output_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+            print("".join(f"{result[c]:>{w}.3f}" for c, w in zip(columns, widths)))
+    finally:
+        asset_server.shutdown()
+        shutil.rmtree(asset_dir, ignore_errors=True)
@@ -14,36 +14,272 @@ Example usage:
         --camera_dist 1.2
 
 Here, input_model_paths.json is a json file containing a list of paths to .glb.
+
+Passing --server_address instead of --object_path keeps Blender running and
+renders the objects sent over that socket (see render_server.py), resetting the
+scene between objects.
+
+With --output_format tar, the views and their camera poses are packed into a
+single {output_dir}/{uid}.tar record (see shards.py) instead of loose PNGs.
+
+With --render_mode animation, the camera positions are keyframed over frames
+0..num_images-1 and rendered with a single animation render, which only pays the
+per-render setup (scene sync, BVH and shader preparation) once. The file names
+and camera poses are the same as rendering each view separately, and
+--compare_render_modes renders the object both ways and prints their timings.
+
+With --time_budget, the views of an object are rendered under a render policy
+(engine, samples and resolution) that is lowered step by step whenever the views
+left to render project past the deadline of the object: first the samples are
+halved down to --min_samples, then the resolution is halved, and finally CYCLES
+falls back to EEVEE. The deadline and the policy are shared by all the render
+configurations and view check retries of the object. The policy applied to each
+view is saved with its camera pose and returned to the render server.
+
+With --max_triangles and --max_texture_size, oversized objects are decimated
+and their textures downsampled right after import, and the triangle and texture
+pixel counts before and after are recorded. --compare_simplify also renders the
+object without simplification, to a scratch directory, and records the render
+time saved.
+
+With --render_configs, the object is rendered once for each configuration in a
+JSON file, from a single loaded scene. A configuration sets the camera rig (an
+orbit of num_views views at each of several elevations, or num_views random
+points from sample_point_on_sphere), the resolution, and extra passes (depth,
+normal, mask) written next to the RGBA views by the compositor. Its files are
+prefixed with its name, and the intrinsics and extrinsics of every view are
+saved to cameras.json.
+
+With --scene_cache_dir, the objects of the imported, simplified and normalized
+scene are saved to a .blend keyed by the object hash and the import settings
+(see scene_cache.py), and later renders of the object append them from there
+instead of importing it again.
+
+With --check_views, the alpha channel of every view is checked for views that
+are empty, clipped by the border or where the object is too small (see
+view_quality.py). The views of a configuration with such problems are rendered
+again, up to --view_retries times, from a camera distance adjusted to the
+problem, or after normalizing empty scenes with the exact bounds of their
+vertices. The quality of every view is saved with its camera pose, and an object
+that still has empty views fails to render.
+
+The scene is normalized with the bounds of the bounding boxes of its meshes,
+gathered and transformed in bulk with NumPy (see bbox.py), or with
+--exact_bbox, the tighter bounds of their evaluated vertices.
+
+Every stage (download, import, normalize_scene, each render, ...) is timed as a
+span (see spans.py), and the spans are returned to the render server together
+with the object size, mesh and vertex counts, the peak RSS of Blender while
+rendering the object (peak_rss_mb) and since the process started
+(process_peak_rss_mb).
 """
 
 import argparse
+import json
 import math
 import os
 import random
+import resource
+import shutil
 import sys
 import time
 import urllib.request
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import bpy
+import numpy as np
 from mathutils import Vector
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bbox import corners_bounds, points_bounds
+from scene_cache import SceneCache
+from shards import pack_record
+from spans import SpanRecorder
+from view_quality import (
+    adjusted_camera_dist,
+    summarize_problems,
+    view_problems,
+    view_stats,
+)
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--object_path",
     type=str,
-    required=True,
     help="Path to the object file",
 )
+parser.add_argument(
+    "--server_address",
+    type=str,
+    help="Socket to serve render requests on instead of rendering --object_path",
+)
 parser.add_argument("--output_dir", type=str, default="./views")
 parser.add_argument(
     "--engine", type=str, default="BLENDER_EEVEE", choices=["CYCLES", "BLENDER_EEVEE"]
 )
 parser.add_argument("--num_images", type=int, default=12)
 parser.add_argument("--camera_dist", type=int, default=1.5)
+parser.add_argument(
+    "--output_format",
+    type=str,
+    default="png",
+    choices=["png", "tar"],
+    help="Save loose PNGs or pack them with the camera poses into one record",
+)
+parser.add_argument(
+    "--render_mode",
+    type=str,
+    default="per_view",
+    choices=["per_view", "animation"],
+    help="Render each view separately or all views as one camera animation",
+)
+parser.add_argument(
+    "--cycles_device", type=str, default="GPU", choices=["GPU", "CPU"]
+)
+parser.add_argument("--samples", type=int, default=32, help="Cycles samples")
+parser.add_argument(
+    "--noise_threshold",
+    type=float,
+    default=0.01,
+    help="Cycles adaptive sampling noise threshold. 0 disables adaptive sampling",
+)
+parser.add_argument(
+    "--time_budget",
+    type=float,
+    default=None,
+    help="Seconds to render all the views of an object in",
+)
+parser.add_argument(
+    "--min_samples",
+    type=int,
+    default=8,
+    help="Lowest number of samples the time budget lowers the samples to",
+)
+parser.add_argument(
+    "--exact_bbox",
+    action="store_true",
+    help="Normalize the scene with the bounds of its vertices instead of the "
+    "bounding boxes of its meshes",
+)
+parser.add_argument(
+    "--max_triangles",
+    type=int,
+    default=None,
+    help="Decimate the meshes of objects with more triangles than this",
+)
+parser.add_argument(
+    "--max_texture_size",
+    type=int,
+    default=None,
+    help="Downsample textures larger than this. About twice the render "
+    "resolution loses no visible detail",
+)
+parser.add_argument(
+    "--render_configs",
+    type=str,
+    default=None,
+    help="JSON file with a list of render configurations to render the object "
+    "with, instead of a single orbit of --num_images views",
+)
+parser.add_argument(
+    "--scene_cache_dir",
+    type=str,
+    default=None,
+    help="Cache the imported and normalized scenes of objects as .blend files here",
+)
+parser.add_argument(
+    "--max_scene_cache_gb",
+    type=float,
+    default=50,
+    help="Size of the scene cache before least recently used scenes are evicted",
+)
+parser.add_argument(
+    "--check_views",
+    action="store_true",
+    help="Check the alpha channel of the views and render again the views of "
+    "configurations that are empty, clipped or too small",
+)
+parser.add_argument(
+    "--view_retries",
+    type=int,
+    default=2,
+    help="Times to render the views of a configuration again with --check_views",
+)
+parser.add_argument(
+    "--min_view_coverage",
+    type=float,
+    default=0.001,
+    help="Fraction of the pixels below which a view is empty",
+)
+parser.add_argument(
+    "--max_edge_coverage",
+    type=float,
+    default=0.01,
+    help="Fraction of the border pixels above which a view is clipped",
+)
+parser.add_argument(
+    "--min_view_fill",
+    type=float,
+    default=0.2,
+    help="Fraction of the image side below which the object is too small",
+)
+parser.add_argument(
+    "--target_view_fill",
+    type=float,
+    default=0.7,
+    help="Fraction of the image side that small objects are moved closer to fill",
+)
+parser.add_argument(
+    "--compare_simplify",
+    action="store_true",
+    help="Also render the object without simplification and record the time "
+    "simplification saved",
+)
+parser.add_argument(
+    "--compare_render_modes",
+    action="store_true",
+    help="Render the object with both render modes and print their timings",
+)
 
 argv = sys.argv[sys.argv.index("--") + 1 :]
 args = parser.parse_args(argv)
+if (args.object_path is None) == (args.server_address is None):
+    parser.error("exactly one of --object_path and --server_address is required")
+if args.time_budget is not None and args.render_mode == "animation":
+    # an animation render can't change the render policy between views
+    parser.error("--time_budget is not supported with --render_mode animation")
+
+RENDER_PASSES = {"depth": "Depth", "normal": "Normal", "mask": "Alpha"}
+DEFAULT_RENDER_CONFIG = {
+    "name": "",
+    "rig": "orbit",
+    "num_views": args.num_images,
+    "elevations": [30],
+    "camera_dist": args.camera_dist,
+    "resolution": 512,
+    "passes": [],
+}
+
+
+def load_render_configs(path: Optional[str]) -> List[Dict[str, Any]]:
+    """Returns the render configurations in the file, completed with defaults."""
+    if path is None:
+        return [DEFAULT_RENDER_CONFIG]
+    with open(path, "r") as f:
+        configs = [{**DEFAULT_RENDER_CONFIG, **config} for config in json.load(f)]
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        parser.error("render configurations must have unique names")
+    for config in configs:
+        if config["rig"] not in {"orbit", "random"}:
+            parser.error(f"unknown camera rig {config['rig']}")
+        for render_pass in config["passes"]:
+            if render_pass not in RENDER_PASSES:
+                parser.error(f"unknown render pass {render_pass}")
+    return configs
+
+
+render_configs = load_render_configs(args.render_configs)
 
 context = bpy.context
 scene = context.scene
@@ -56,8 +292,10 @@ render.resolution_x = 512
 render.resolution_y = 512
 render.resolution_percentage = 100
 
-scene.cycles.device = "GPU"
-scene.cycles.samples = 32
+scene.cycles.device = args.cycles_device
+scene.cycles.samples = args.samples
+scene.cycles.use_adaptive_sampling = args.noise_threshold > 0
+scene.cycles.adaptive_threshold = args.noise_threshold
 scene.cycles.diffuse_bounces = 1
 scene.cycles.glossy_bounces = 1
 scene.cycles.transparent_max_bounces = 3
@@ -65,6 +303,15 @@ scene.cycles.transmission_bounces = 3
 scene.cycles.filter_width = 0.01
 scene.cycles.use_denoising = True
 scene.render.film_transparent = True
+EEVEE_SAMPLES = scene.eevee.taa_render_samples
+
+# bump when the way scenes are imported or normalized changes
+SCENE_CACHE_VERSION = 1
+scene_cache = None
+if args.scene_cache_dir is not None:
+    scene_cache = SceneCache(
+        args.scene_cache_dir, int(args.max_scene_cache_gb * 1024**3)
+    )
 
 
 def sample_point_on_sphere(radius: float) -> Tuple[float, float, float]:
@@ -79,8 +326,9 @@ def sample_point_on_sphere(radius: float) -> Tuple[float, float, float]:
 
 def add_lighting() -> None:
     # delete the default light
-    bpy.data.objects["Light"].select_set(True)
-    bpy.ops.object.delete()
+    if "Light" in bpy.data.objects:
+        bpy.data.objects["Light"].select_set(True)
+        bpy.ops.object.delete()
     # add a new light
     bpy.ops.object.light_add(type="AREA")
     light2 = bpy.data.lights["Area"]
@@ -93,10 +341,15 @@ def add_lighting() -> None:
 
 def reset_scene() -> None:
     """Resets the scene to a clean state."""
-    # delete everything that isn't part of a camera or a light
+    # delete everything that isn't part of a camera
     for obj in bpy.data.objects:
-        if obj.type not in {"CAMERA", "LIGHT"}:
+        if obj.type not in {"CAMERA"}:
             bpy.data.objects.remove(obj, do_unlink=True)
+    # delete all the meshes and lights
+    for mesh in bpy.data.meshes:
+        bpy.data.meshes.remove(mesh, do_unlink=True)
+    for light in bpy.data.lights:
+        bpy.data.lights.remove(light, do_unlink=True)
     # delete all the materials
     for material in bpy.data.materials:
         bpy.data.materials.remove(material, do_unlink=True)
@@ -119,21 +372,35 @@ def load_object(object_path: str) -> None:
         raise ValueError(f"Unsupported file type: {object_path}")
 
 
-def scene_bbox(single_obj=None, ignore_matrix=False):
-    bbox_min = (math.inf,) * 3
-    bbox_max = (-math.inf,) * 3
-    found = False
-    for obj in scene_meshes() if single_obj is None else [single_obj]:
-        found = True
-        for coord in obj.bound_box:
-            coord = Vector(coord)
-            if not ignore_matrix:
-                coord = obj.matrix_world @ coord
-            bbox_min = tuple(min(x, y) for x, y in zip(bbox_min, coord))
-            bbox_max = tuple(max(x, y) for x, y in zip(bbox_max, coord))
-    if not found:
+def mesh_vertices(mesh) -> np.ndarray:
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+    mesh.vertices.foreach_get("co", coords)
+    return coords.reshape(-1, 3)
+
+
+def scene_bbox(single_obj=None, ignore_matrix=False, exact=False):
+    """Returns the world-space bounds of the meshes of the scene.
+
+    With exact, the bounds of the evaluated vertices are returned instead of the
+    bounds of the bounding boxes of the meshes, which can be looser for rotated
+    meshes.
+    """
+    objs = list(scene_meshes()) if single_obj is None else [single_obj]
+    if not objs:
         raise RuntimeError("no objects in scene to compute bounding box for")
-    return Vector(bbox_min), Vector(bbox_max)
+    if ignore_matrix:
+        matrices = np.broadcast_to(np.eye(4), (len(objs), 4, 4))
+    else:
+        matrices = np.array([obj.matrix_world for obj in objs])
+    if exact:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        points = [mesh_vertices(obj.evaluated_get(depsgraph).data) for obj in objs]
+        bbox_min, bbox_max = points_bounds(points, matrices)
+        if np.isfinite(bbox_min).all():
+            return Vector(bbox_min.tolist()), Vector(bbox_max.tolist())
+    corners = np.array([obj.bound_box for obj in objs], dtype=np.float64)
+    bbox_min, bbox_max = corners_bounds(corners, matrices)
+    return Vector(bbox_min.tolist()), Vector(bbox_max.tolist())
 
 
 def scene_root_objects():
@@ -148,14 +415,14 @@ def scene_meshes():
             yield obj
 
 
-def normalize_scene():
-    bbox_min, bbox_max = scene_bbox()
+def normalize_scene(exact=False):
+    bbox_min, bbox_max = scene_bbox(exact=exact)
     scale = 1 / max(bbox_max - bbox_min)
     for obj in scene_root_objects():
         obj.scale = obj.scale * scale
     # Apply scale to matrix_world.
     bpy.context.view_layer.update()
-    bbox_min, bbox_max = scene_bbox()
+    bbox_min, bbox_max = scene_bbox(exact=exact)
     offset = -(bbox_min + bbox_max) / 2
     for obj in scene_root_objects():
         obj.matrix_world.translation += offset
@@ -167,40 +434,546 @@ def setup_camera():
     cam.location = (0, 1.2, 0)
     cam.data.lens = 35
     cam.data.sensor_width = 32
+    cam.constraints.clear()
+    cam.animation_data_clear()
     cam_constraint = cam.constraints.new(type="TRACK_TO")
     cam_constraint.track_axis = "TRACK_NEGATIVE_Z"
     cam_constraint.up_axis = "UP_Y"
     return cam, cam_constraint
 
 
-def save_images(object_file: str) -> None:
-    """Saves rendered images of the object in the scene."""
-    os.makedirs(args.output_dir, exist_ok=True)
-    reset_scene()
-    # load the object
-    load_object(object_file)
+def get_camera_metadata(cam) -> dict:
+    """Returns the intrinsics and world pose of the camera.
+
+    intrinsics is the pixel space camera matrix K, and world_to_camera the
+    inverse of matrix_world, in Blender's camera convention of looking down -Z
+    with +Y up.
+    """
+    bpy.context.view_layer.update()
+    width = render.resolution_x * render.resolution_percentage // 100
+    height = render.resolution_y * render.resolution_percentage // 100
+    # the sensor width spans the larger side of the image
+    focal = cam.data.lens / cam.data.sensor_width * max(width, height)
+    return {
+        "location": list(cam.location),
+        "matrix_world": [list(row) for row in cam.matrix_world],
+        "world_to_camera": [list(row) for row in cam.matrix_world.inverted()],
+        "lens": cam.data.lens,
+        "sensor_width": cam.data.sensor_width,
+        "resolution": [width, height],
+        "intrinsics": [[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]],
+    }
+
+
+def initial_render_policy() -> Dict[str, Any]:
+    """Returns the render settings every object starts with."""
+    if args.engine == "CYCLES":
+        samples = args.samples
+    else:
+        samples = EEVEE_SAMPLES
+    return {"engine": args.engine, "samples": samples, "resolution_percentage": 100}
+
+
+def apply_render_policy(policy: Dict[str, Any]) -> None:
+    render.engine = policy["engine"]
+    render.resolution_percentage = policy["resolution_percentage"]
+    if policy["engine"] == "CYCLES":
+        scene.cycles.samples = policy["samples"]
+    else:
+        scene.eevee.taa_render_samples = policy["samples"]
+
+
+def start_render_budget(num_views: int) -> Dict[str, Any]:
+    """Returns the render budget of an object about to be rendered.
+
+    The budget holds the deadline of the object, the render policy and the
+    number of views left to render. It is shared by every render configuration
+    and view check retry of the object, so that the policy keeps the steps it was
+    lowered by and the whole object is held to one deadline.
+    """
+    policy = initial_render_policy()
+    apply_render_policy(policy)
+    deadline = None
+    if args.time_budget is not None:
+        deadline = time.time() + args.time_budget
+    return {"deadline": deadline, "policy": policy, "views_left": num_views}
+
+
+def lower_render_policy(policy: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the next cheaper render policy, or None if there is none."""
+    if policy["samples"] > args.min_samples:
+        return {**policy, "samples": max(args.min_samples, policy["samples"] // 2)}
+    if policy["resolution_percentage"] > 50:
+        return {**policy, "resolution_percentage": 50}
+    if policy["engine"] == "CYCLES":
+        return {**policy, "engine": "BLENDER_EEVEE"}
+    return None
+
+
+def orbit_point(
+    i: int, num_views: int, elevation: float, camera_dist: float
+) -> Tuple[float, float, float]:
+    """Returns the camera position of the i-th view of an orbit."""
+    theta = (i / num_views) * math.pi * 2
+    phi = math.radians(90 - elevation)
+    return (
+        camera_dist * math.sin(phi) * math.cos(theta),
+        camera_dist * math.sin(phi) * math.sin(theta),
+        camera_dist * math.cos(phi),
+    )
+
+
+def rig_positions(
+    config: Dict[str, Any], object_uid: str
+) -> List[Tuple[float, float, float]]:
+    """Returns the camera positions of the rig of a render configuration.
+
+    An orbit has num_views views at each elevation. The random rig samples
+    num_views points on the sphere, seeded by the object and configuration so
+    that re-renders use the same cameras.
+    """
+    if config["rig"] == "random":
+        random.seed(f"{object_uid}/{config['name']}")
+        return [
+            sample_point_on_sphere(config["camera_dist"])
+            for _ in range(config["num_views"])
+        ]
+    return [
+        orbit_point(i, config["num_views"], elevation, config["camera_dist"])
+        for elevation in config["elevations"]
+        for i in range(config["num_views"])
+    ]
+
+
+def setup_passes(passes: List[str], views_dir: str, prefix: str) -> None:
+    """Writes the given passes of every render next to the RGBA views.
+
+    The passes are written by a compositor File Output node, as
+    {prefix}{frame:03d}_{pass}.exr, or .png for the alpha mask, so the frame
+    must be set to the view index before rendering.
+    """
+    view_layer = context.view_layer
+    view_layer.use_pass_z = "depth" in passes
+    view_layer.use_pass_normal = "normal" in passes
+    scene.use_nodes = bool(passes)
+    if not passes:
+        return
+    tree = scene.node_tree
+    tree.nodes.clear()
+    layers = tree.nodes.new("CompositorNodeRLayers")
+    composite = tree.nodes.new("CompositorNodeComposite")
+    composite.use_alpha = True
+    tree.links.new(layers.outputs["Image"], composite.inputs["Image"])
+    output = tree.nodes.new("CompositorNodeOutputFile")
+    output.base_path = views_dir
+    output.format.file_format = "OPEN_EXR"
+    output.format.color_depth = "32"
+    output.file_slots.clear()
+    for render_pass in passes:
+        slot = output.file_slots.new(f"{prefix}###_{render_pass}")
+        if render_pass == "mask":
+            slot.use_node_format = False
+            slot.format.file_format = "PNG"
+            slot.format.color_mode = "BW"
+        tree.links.new(layers.outputs[RENDER_PASSES[render_pass]], output.inputs[-1])
+
+
+def scene_cache_settings() -> Dict[str, Any]:
+    """Returns the settings that change the imported and normalized scene."""
+    return {
+        "version": SCENE_CACHE_VERSION,
+        "blender": bpy.app.version_string,
+        "merge_vertices": True,
+        "exact_bbox": args.exact_bbox,
+        "max_triangles": args.max_triangles,
+        "max_texture_size": args.max_texture_size,
+    }
+
+
+def write_scene(path: str) -> None:
+    """Writes the objects of the scene, and everything they use, to a .blend."""
+    for image in bpy.data.images:
+        # images must be packed for the .blend to be self-contained, and images
+        # that were downsampled are only in memory
+        if image.size[0] and (image.packed_file is None or image.is_dirty):
+            image.pack()
+    objects = {obj for obj in scene.objects if obj.type != "CAMERA"}
+    bpy.data.libraries.write(path, objects)
+
+
+def load_scene(path: str) -> None:
+    """Appends the objects of a .blend written by write_scene to the scene."""
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    for obj in data_to.objects:
+        if obj is not None:
+            scene.collection.objects.link(obj)
+
+
+def triangle_count(mesh) -> int:
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    return int((loop_totals - 2).sum())
+
+
+def simplify_scene(
+    max_triangles: Optional[int], max_texture_size: Optional[int]
+) -> Dict[str, int]:
+    """Decimates the meshes and downsamples the textures of oversized objects.
+
+    If the scene has more than max_triangles triangles, every mesh gets a
+    collapse decimate modifier with the same ratio, so that the scene has about
+    max_triangles, and the modifiers are applied: each mesh is replaced with its
+    evaluated mesh, so that the bounding box, the scene cache and the render all
+    use the decimated geometry. Objects that share a mesh and have no other
+    modifiers keep sharing the decimated one. Textures with a side larger than
+    max_texture_size are scaled down to it. Returns the triangle and texture
+    pixel counts before and after.
+    """
+    meshes = list(scene_meshes())
+    triangles = sum(triangle_count(obj.data) for obj in meshes)
+    stats = {"triangles_before": triangles, "triangles_after": triangles}
+    if max_triangles is not None and triangles > max_triangles:
+        for obj in meshes:
+            modifier = obj.modifiers.new("Simplify", "DECIMATE")
+            modifier.decimate_type = "COLLAPSE"
+            modifier.ratio = max_triangles / triangles
+            modifier.use_collapse_triangulate = True
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        # evaluate every mesh before replacing any, since replacing one
+        # invalidates the evaluated scene
+        decimated = {}
+        for obj in meshes:
+            shared = len(obj.modifiers) == 1
+            if not (shared and obj.data in decimated):
+                mesh = bpy.data.meshes.new_from_object(
+                    obj.evaluated_get(depsgraph),
+                    preserve_all_data_layers=True,
+                    depsgraph=depsgraph,
+                )
+                decimated[obj.data if shared else obj] = mesh
+        for obj in meshes:
+            original = obj.data
+            mesh = decimated.get(obj, decimated.get(original))
+            obj.modifiers.clear()
+            obj.data = mesh
+            if original.users == 0:
+                bpy.data.meshes.remove(original)
+        stats["triangles_after"] = sum(triangle_count(obj.data) for obj in meshes)
+
+    stats["texture_pixels_before"] = 0
+    stats["texture_pixels_after"] = 0
+    for image in bpy.data.images:
+        width, height = image.size
+        stats["texture_pixels_before"] += width * height
+        if max_texture_size is not None and max(width, height) > max_texture_size:
+            scale = max_texture_size / max(width, height)
+            width = max(round(width * scale), 1)
+            height = max(round(height * scale), 1)
+            image.scale(width, height)
+        stats["texture_pixels_after"] += width * height
+    return stats
+
+
+def scene_stats() -> Dict[str, int]:
+    """Returns the mesh, vertex and polygon counts of the scene."""
+    meshes = list(scene_meshes())
+    return {
+        "num_meshes": len(meshes),
+        "num_vertices": sum(len(obj.data.vertices) for obj in meshes),
+        "num_polygons": sum(len(obj.data.polygons) for obj in meshes),
+    }
+
+
+def render_views(
+    cam,
+    object_uid: str,
+    positions: List[Tuple[float, float, float]],
+    prefix: str,
+    budget: Dict[str, Any],
+    recorder: SpanRecorder,
+) -> List[dict]:
+    """Renders each view with its own render call.
+
+    If the budget has a deadline, the render policy is lowered by one step after
+    every view while the time of that view for each of the views left to render
+    projects past the deadline. The last view rather than the average is used,
+    so that the warm-up of the first view does not keep lowering the policy once
+    the renders have caught up.
+    """
+    cameras = []
+    policy = budget["policy"]
+    for i, position in enumerate(positions):
+        view_start = time.time()
+        # set the camera position
+        cam.location = position
+        # the frame numbers the files of the passes
+        scene.frame_current = i
+        # render the image
+        render_path = os.path.join(args.output_dir, object_uid, f"{prefix}{i:03d}.png")
+        scene.render.filepath = render_path
+        with recorder.span("render", view=i, **policy):
+            bpy.ops.render.render(write_still=True)
+        cameras.append(
+            {
+                "file": f"{prefix}{i:03d}.png",
+                "render_policy": policy,
+                **get_camera_metadata(cam),
+            }
+        )
+        budget["views_left"] = max(0, budget["views_left"] - 1)
+        if budget["deadline"] is None:
+            continue
+        view_seconds = time.time() - view_start
+        projected = time.time() + view_seconds * budget["views_left"]
+        if projected > budget["deadline"]:
+            lower_policy = lower_render_policy(policy)
+            if lower_policy is not None:
+                policy = lower_policy
+                apply_render_policy(policy)
+                budget["policy"] = policy
+    return cameras
+
+
+def render_camera_animation(
+    cam,
+    object_uid: str,
+    positions: List[Tuple[float, float, float]],
+    prefix: str,
+    budget: Dict[str, Any],
+    recorder: SpanRecorder,
+) -> List[dict]:
+    """Renders every view with a single animation render.
+
+    Frame i of the animation has the camera at the i-th view, and the output
+    path ends in ### so that Blender writes frame i to {prefix}{i:03d}.png.
+    """
+    cam.animation_data_clear()
+    for i, position in enumerate(positions):
+        cam.location = position
+        cam.keyframe_insert(data_path="location", frame=i)
+    for fcurve in cam.animation_data.action.fcurves:
+        for keyframe in fcurve.keyframe_points:
+            keyframe.interpolation = "CONSTANT"
+    scene.frame_start = 0
+    scene.frame_end = len(positions) - 1
+    scene.render.filepath = os.path.join(args.output_dir, object_uid, f"{prefix}###")
+    policy = budget["policy"]
+    with recorder.span("render_animation", num_views=len(positions), **policy):
+        bpy.ops.render.render(animation=True)
+    cameras = []
+    for i in range(len(positions)):
+        scene.frame_set(i)
+        cameras.append(
+            {
+                "file": f"{prefix}{i:03d}.png",
+                "render_policy": policy,
+                **get_camera_metadata(cam),
+            }
+        )
+    return cameras
+
+
+def read_alpha(path: str) -> np.ndarray:
+    """Returns the alpha channel of an image as a (height, width) array."""
+    image = bpy.data.images.load(path, check_existing=False)
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+    return pixels.reshape(height, width, 4)[:, :, 3]
+
+
+def render_config(
+    cam,
+    object_uid: str,
+    config: Dict[str, Any],
+    budget: Dict[str, Any],
+    recorder: SpanRecorder,
+) -> List[dict]:
+    """Renders the views and passes of a render configuration under the render
+    budget of the object.
+
+    The files of a named configuration are prefixed with its name, and its
+    views list the files of their passes. With --check_views, the views are
+    rendered again while they have problems and retries are left.
+    """
+    prefix = f"{config['name']}_" if config["name"] else ""
+    render.resolution_x = config["resolution"]
+    render.resolution_y = config["resolution"]
+    views_dir = os.path.join(args.output_dir, object_uid)
+    setup_passes(config["passes"], views_dir, prefix)
+    camera_dist = config["camera_dist"]
+    exact_bbox = args.exact_bbox
+    num_retries = args.view_retries if args.check_views else 0
+    for retry in range(num_retries + 1):
+        positions = rig_positions({**config, "camera_dist": camera_dist}, object_uid)
+        if retry > 0:
+            # the views rendered again were not counted in the budget
+            budget["views_left"] += len(positions)
+        if args.render_mode == "animation":
+            cameras = render_camera_animation(
+                cam, object_uid, positions, prefix, budget, recorder
+            )
+        else:
+            cameras = render_views(
+                cam, object_uid, positions, prefix, budget, recorder
+            )
+        if not args.check_views:
+            break
+        with recorder.span("check_views", retry=retry) as span:
+            alphas = [read_alpha(os.path.join(views_dir, c["file"])) for c in cameras]
+            stats = view_stats(alphas)
+            problems = view_problems(
+                stats,
+                args.min_view_coverage,
+                args.max_edge_coverage,
+                args.min_view_fill,
+            )
+            span.update(summarize_problems(problems))
+        for camera, view, found in zip(cameras, stats, problems):
+            camera["camera_dist"] = camera_dist
+            camera["quality"] = {**view, "problems": found, "retry": retry}
+        if not any(problems) or retry == num_retries:
+            break
+        if any("empty" in found for found in problems) and not exact_bbox:
+            # the bounding boxes of the meshes can be far off their vertices
+            with recorder.span("normalize_scene", exact=True):
+                normalize_scene(exact=True)
+            exact_bbox = True
+            continue
+        new_camera_dist = adjusted_camera_dist(
+            stats, problems, camera_dist, args.target_view_fill
+        )
+        if new_camera_dist == camera_dist:
+            break
+        camera_dist = new_camera_dist
+    if args.check_views:
+        num_empty = sum("empty" in c["quality"]["problems"] for c in cameras)
+        if num_empty > 0:
+            raise RuntimeError(f"{num_empty} views of {object_uid} are empty")
+    if args.render_configs is not None:
+        for i, camera in enumerate(cameras):
+            camera["config"] = config["name"]
+            camera["passes"] = {
+                render_pass: f"{prefix}{i:03d}_{render_pass}."
+                + ("png" if render_pass == "mask" else "exr")
+                for render_pass in config["passes"]
+            }
+    return cameras
+
+
+def reset_peak_rss() -> None:
+    """Resets the peak resident memory of this process reported by the kernel,
+    so that it only covers the object about to be rendered."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Returns the peak resident memory since the last reset_peak_rss, if the
+    kernel reports it."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def save_images(
+    object_file: str,
+    recorder: Optional[SpanRecorder] = None,
+    use_scene_cache: bool = True,
+) -> Dict[str, Any]:
+    """Saves rendered images of the object in the scene.
+
+    Returns the render policy that was applied to each view, the spans of the
+    stages and statistics about the object.
+    """
     object_uid = os.path.basename(object_file).split(".")[0]
-    normalize_scene()
+    if recorder is None:
+        recorder = SpanRecorder(uid=object_uid)
+    os.makedirs(args.output_dir, exist_ok=True)
+    reset_peak_rss()
+    with recorder.span("reset_scene"):
+        reset_scene()
+    cache = scene_cache if use_scene_cache else None
+    cached = None
+    if cache is not None:
+        with recorder.span("scene_cache_lookup") as span:
+            cache_key = cache.key(object_file, scene_cache_settings())
+            cached = cache.get(cache_key)
+            span["hit"] = cached is not None
+    if cached is not None:
+        blend_path, simplify_stats = cached
+        with recorder.span("load_cached_scene"):
+            load_scene(blend_path)
+    else:
+        # load the object
+        with recorder.span("import", size_bytes=os.path.getsize(object_file)) as span:
+            load_object(object_file)
+            span.update(scene_stats())
+        simplify_stats = {}
+        if args.max_triangles is not None or args.max_texture_size is not None:
+            with recorder.span("simplify") as span:
+                simplify_stats = simplify_scene(
+                    args.max_triangles, args.max_texture_size
+                )
+                span.update(simplify_stats)
+        with recorder.span("normalize_scene"):
+            normalize_scene(exact=args.exact_bbox)
+        if cache is not None:
+            with recorder.span("save_cached_scene"):
+                cache.put(cache_key, write_scene, simplify_stats)
     add_lighting()
     cam, cam_constraint = setup_camera()
     # create an empty object to track
     empty = bpy.data.objects.new("Empty", None)
     scene.collection.objects.link(empty)
     cam_constraint.target = empty
-    for i in range(args.num_images):
-        # set the camera position
-        theta = (i / args.num_images) * math.pi * 2
-        phi = math.radians(60)
-        point = (
-            args.camera_dist * math.sin(phi) * math.cos(theta),
-            args.camera_dist * math.sin(phi) * math.sin(theta),
-            args.camera_dist * math.cos(phi),
-        )
-        cam.location = point
-        # render the image
-        render_path = os.path.join(args.output_dir, object_uid, f"{i:03d}.png")
-        scene.render.filepath = render_path
-        bpy.ops.render.render(write_still=True)
+    num_views = sum(len(rig_positions(config, object_uid)) for config in render_configs)
+    budget = start_render_budget(num_views)
+    cameras = []
+    for config in render_configs:
+        cameras += render_config(cam, object_uid, config, budget, recorder)
+    views_dir = os.path.join(args.output_dir, object_uid)
+    if (
+        args.output_format == "tar"
+        or args.render_configs is not None
+        or args.check_views
+    ):
+        with open(os.path.join(views_dir, "cameras.json"), "w") as f:
+            json.dump({"uid": object_uid, "views": cameras}, f)
+    if args.output_format == "tar":
+        with recorder.span("pack_record"):
+            pack_record(views_dir)
+    quality = {}
+    if args.check_views:
+        quality = {
+            "view_quality": [camera["quality"] for camera in cameras],
+            "view_retries": max(camera["quality"]["retry"] for camera in cameras),
+        }
+    return {
+        "render_policy": [camera["render_policy"] for camera in cameras],
+        **quality,
+        "spans": recorder.spans,
+        "size_bytes": os.path.getsize(object_file),
+        **scene_stats(),
+        **simplify_stats,
+        "peak_rss_mb": peak_rss_mb(),
+        # ru_maxrss is in KB on Linux, and never resets
+        "process_peak_rss_mb": (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        ),
+    }
 
 
 def download_object(object_url: str) -> str:
@@ -218,19 +991,100 @@ def download_object(object_url: str) -> str:
     return local_path
 
 
-if __name__ == "__main__":
+def compare_render_modes(object_path: str) -> None:
+    """Renders the object per view and as one animation and prints the timings."""
+    output_dir = args.output_dir
+    timings = {}
+    for render_mode in ["per_view", "animation"]:
+        args.render_mode = render_mode
+        args.output_dir = os.path.join(output_dir, render_mode)
+        start = time.time()
+        save_images(object_path)
+        timings[render_mode] = time.time() - start
+    args.output_dir = output_dir
+    print(json.dumps({"object_path": object_path, "seconds": timings}))
+
+
+def compare_simplify(
+    object_path: str, recorder: Optional[SpanRecorder] = None
+) -> Dict[str, Any]:
+    """Renders the object without simplification to a scratch directory, then
+    with it as usual, and prints the timings.
+
+    The scratch directory is `{output_dir}/unsimplified/{uid}`, so that workers
+    sharing the output directory never remove each other's renders, and the
+    unsimplified scene is kept out of the scene cache.
+
+    Returns the information of the simplified render, with the render time
+    simplification saved.
+    """
+    object_uid = os.path.basename(object_path).split(".")[0]
+    if recorder is None:
+        recorder = SpanRecorder(uid=object_uid)
+    output_dir = args.output_dir
+    scratch_dir = os.path.join(output_dir, "unsimplified", object_uid)
+    limits = args.max_triangles, args.max_texture_size
+    args.max_triangles, args.max_texture_size = None, None
+    args.output_dir = scratch_dir
     try:
-        start_i = time.time()
-        if args.object_path.startswith("http"):
-            local_path = download_object(args.object_path)
+        start = time.time()
+        with recorder.span("render_unsimplified"):
+            save_images(object_path, use_scene_cache=False)
+        original_seconds = time.time() - start
+    finally:
+        args.max_triangles, args.max_texture_size = limits
+        args.output_dir = output_dir
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    start = time.time()
+    info = save_images(object_path, recorder)
+    simplified_seconds = time.time() - start
+    timings = {"original": original_seconds, "simplified": simplified_seconds}
+    print(json.dumps({"object_path": object_path, "seconds": timings}))
+    return {
+        **info,
+        "unsimplified_seconds": original_seconds,
+        "simplify_seconds_saved": original_seconds - simplified_seconds,
+    }
+
+
+def render_object(object_path: str) -> Optional[Dict[str, Any]]:
+    """Downloads the object if needed and renders it.
+
+    Returns information about how the object was rendered.
+    """
+    start_i = time.time()
+    recorder = SpanRecorder(uid=os.path.basename(object_path).split(".")[0])
+    if object_path.startswith("http"):
+        with recorder.span("download"):
+            local_path = download_object(object_path)
+    else:
+        local_path = object_path
+    info = None
+    try:
+        if args.compare_render_modes:
+            compare_render_modes(local_path)
+        elif args.compare_simplify:
+            info = compare_simplify(local_path, recorder)
         else:
-            local_path = args.object_path
-        save_images(local_path)
-        end_i = time.time()
-        print("Finished", local_path, "in", end_i - start_i, "seconds")
+            info = save_images(local_path, recorder)
+    finally:
         # delete the object if it was downloaded
-        if args.object_path.startswith("http"):
+        if object_path.startswith("http"):
             os.remove(local_path)
-    except Exception as e:
-        print("Failed to render", args.object_path)
-        print(e)
+    end_i = time.time()
+    print("Finished", local_path, "in", end_i - start_i, "seconds")
+    return info
+
+
+if __name__ == "__main__":
+    if args.server_address is not None:
+        from render_server import serve
+
+        serve(args.server_address, render_object)
+    else:
+        try:
+            render_object(args.object_path)
+        except Exception as e:
+            print("Failed to render", args.object_path)
+            print(e)
+            sys.exit(1)
@@ -0,0 +1,197 @@
+"""Adaptive number of render workers per GPU.
+
+A fixed `workers_per_gpu` is either too low while the workers mostly wait on
+imports and uploads, or too high for heavy objects that fill the GPU memory.
+The ConcurrencyController instead adjusts the number of workers of every GPU
+once per interval, within bounds:
+
+- it removes a worker when the GPU memory is nearly full or too many renders
+  failed during the interval,
+- it undoes the last added worker if the throughput of the GPU dropped since,
+- and otherwise adds a worker while the GPU is not fully utilized. When the
+  probe reports nothing for a GPU, its number of workers is held instead.
+
+After removing a worker it waits a few intervals before adding one again, so
+that it does not keep oscillating around the best number of workers.
+
+GPU memory and utilization are read by a probe, which is nvidia-smi in
+production and a FakeProbe when there is no GPU.
+"""
+
+import subprocess
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class GpuStats:
+    utilization: float
+    """percentage of the time the GPU was busy"""
+
+    memory_used_mb: float
+    memory_total_mb: float
+
+
+def detect_num_gpus() -> int:
+    """Returns the number of GPUs nvidia-smi lists, or 0 without nvidia-smi."""
+    try:
+        output = subprocess.check_output(
+            ["nvidia-smi", "--list-gpus"], text=True, timeout=30
+        )
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    return len([line for line in output.splitlines() if line.startswith("GPU ")])
+
+
+class NvidiaSmiProbe:
+    """Reads the utilization and memory of every GPU with nvidia-smi."""
+
+    def __call__(self) -> Dict[int, GpuStats]:
+        output = subprocess.check_output(
+            [
+                "nvidia-smi",
+                "--query-gpu=index,utilization.gpu,memory.used,memory.total",
+                "--format=csv,noheader,nounits",
+            ],
+            text=True,
+            timeout=30,
+        )
+        stats = {}
+        for line in output.strip().splitlines():
+            index, utilization, used, total = (v.strip() for v in line.split(","))
+            stats[int(index)] = GpuStats(float(utilization), float(used), float(total))
+        return stats
+
+
+class FakeProbe:
+    """Reports the same stats for every GPU, which can be changed at any time."""
+
+    def __init__(
+        self,
+        num_gpus: int,
+        utilization: float = 50,
+        memory_used_mb: float = 0,
+        memory_total_mb: float = 24_000,
+    ) -> None:
+        self.num_gpus = num_gpus
+        self.stats = GpuStats(utilization, memory_used_mb, memory_total_mb)
+
+    def __call__(self) -> Dict[int, GpuStats]:
+        return {gpu: self.stats for gpu in range(self.num_gpus)}
+
+
+class ConcurrencyController:
+    """Scales the number of workers of each GPU between min_workers and
+    max_workers.
+
+    `get_counts` returns the number of renders that succeeded and failed so far
+    on each GPU, and `set_workers(gpu, n)` starts or stops workers so that the
+    GPU has n of them.
+    """
+
+    def __init__(
+        self,
+        num_gpus: int,
+        initial_workers: int,
+        get_counts: Callable[[], Tuple[List[int], List[int]]],
+        set_workers: Callable[[int, int], None],
+        probe: Optional[Callable[[], Dict[int, GpuStats]]] = None,
+        min_workers: int = 1,
+        max_workers: int = 8,
+        interval: float = 60,
+        max_memory_fraction: float = 0.9,
+        max_utilization: float = 95,
+        max_failure_rate: float = 0.2,
+        throughput_tolerance: float = 0.05,
+        cooldown: int = 5,
+    ) -> None:
+        self.num_gpus = num_gpus
+        self.get_counts = get_counts
+        self.set_workers = set_workers
+        self.probe = NvidiaSmiProbe() if probe is None else probe
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.max_memory_fraction = max_memory_fraction
+        self.max_utilization = max_utilization
+        self.max_failure_rate = max_failure_rate
+        self.throughput_tolerance = throughput_tolerance
+        self.cooldown = cooldown
+        initial_workers = min(max(initial_workers, min_workers), max_workers)
+        self.workers = [initial_workers] * num_gpus
+        self.throughput = [0.0] * num_gpus
+        self.last_change = [0] * num_gpus
+        self.hold = [0] * num_gpus
+        self.counts = ([0] * num_gpus, [0] * num_gpus)
+        self._stop = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.counts = self.get_counts()
+        self.thread = threading.Thread(target=self._control_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _control_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                stats = self.probe()
+            except (OSError, subprocess.SubprocessError, ValueError) as e:
+                print("Failed to probe the GPUs:", e)
+                stats = {}
+            self.step(stats)
+
+    def step(self, stats: Dict[int, GpuStats]) -> None:
+        """Updates the number of workers of every GPU from the renders since the
+        last step and the given GPU stats."""
+        counts = self.get_counts()
+        for gpu in range(self.num_gpus):
+            succeeded = counts[0][gpu] - self.counts[0][gpu]
+            failed = counts[1][gpu] - self.counts[1][gpu]
+            throughput = succeeded / self.interval
+            target = self.target_workers(gpu, throughput, succeeded, failed, stats)
+            self.last_change[gpu] = target - self.workers[gpu]
+            self.throughput[gpu] = throughput
+            if target < self.workers[gpu]:
+                self.hold[gpu] = self.cooldown
+            else:
+                self.hold[gpu] = max(self.hold[gpu] - 1, 0)
+            if target != self.workers[gpu]:
+                print(f"Scaling GPU {gpu} from {self.workers[gpu]} to {target} workers")
+                self.workers[gpu] = target
+                self.set_workers(gpu, target)
+        self.counts = counts
+
+    def target_workers(
+        self,
+        gpu: int,
+        throughput: float,
+        succeeded: int,
+        failed: int,
+        stats: Dict[int, GpuStats],
+    ) -> int:
+        workers = self.workers[gpu]
+        gpu_stats = stats.get(gpu)
+        failure_rate = failed / max(succeeded + failed, 1)
+        memory_full = gpu_stats is not None and (
+            gpu_stats.memory_used_mb
+            > self.max_memory_fraction * gpu_stats.memory_total_mb
+        )
+        if memory_full or failure_rate > self.max_failure_rate:
+            return max(workers - 1, self.min_workers)
+        previous = self.throughput[gpu]
+        if self.last_change[gpu] > 0 and throughput < previous * (
+            1 - self.throughput_tolerance
+        ):
+            return max(workers - 1, self.min_workers)
+        if self.hold[gpu] > 0:
+            return workers
+        # without stats the GPU may well be saturated already
+        if gpu_stats is None or gpu_stats.utilization >= self.max_utilization:
+            return workers
+        return min(workers + 1, self.max_workers)
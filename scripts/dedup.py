@@ -0,0 +1,264 @@
+"""Persistent index of rendered object contents, to skip rendering duplicates.
+
+Objaverse has many byte-identical files under different uids. After an object
+is downloaded, its sha256 (and optionally a geometry fingerprint) is claimed in
+the index: the first uid to claim a key becomes the canonical uid of that
+content and is rendered, and every later uid with the same key is recorded as an
+alias of it and not rendered at all. Its views are those of the canonical uid.
+
+An alias is pending until its canonical object is done, i.e. uploaded, or
+rendered when nothing is uploaded. `complete` then returns the pending aliases,
+and an alias record, `{uid}/alias.json` naming the canonical uid, is written in
+place of the views of each of them, so that listings of the outputs and their
+readers can resolve duplicates. If the canonical object fails instead, `forget`
+makes its first pending alias the new canonical object, to be rendered in its
+place, and the other aliases wait for that one.
+
+The geometry fingerprint of a glTF binary is its total vertex count and the
+shape of its bounding box normalized to a longest side of 1, both read from the
+POSITION accessors of the GLB without importing it. It catches files that only
+differ in metadata or encoding, at the risk of matching different objects that
+happen to have the same vertex count and proportions.
+
+The index is a SQLite database in WAL mode like the ledger, so every download
+thread and render worker can use it, and it persists across runs. It also keeps
+the render time of every canonical uid, to report how much GPU time the aliases
+saved.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from object_cache import file_sha256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    key TEXT PRIMARY KEY,
+    uid TEXT NOT NULL,
+    render_seconds REAL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS contents_uid ON contents (uid);
+CREATE TABLE IF NOT EXISTS aliases (
+    uid TEXT PRIMARY KEY,
+    canonical_uid TEXT NOT NULL,
+    key TEXT NOT NULL,
+    object_path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS aliases_canonical ON aliases (canonical_uid, state);
+"""
+
+ALIAS_FILE = "alias.json"
+
+
+@dataclass
+class Alias:
+    uid: str
+    canonical_uid: str
+    key: str
+    object_path: str
+    """path or url of the object, to render it if the canonical object fails"""
+    pending: bool
+
+
+def write_alias_record(output_dir: str, alias: Alias) -> str:
+    """Writes `{output_dir}/{uid}/alias.json` and returns its path."""
+    alias_dir = os.path.join(output_dir, alias.uid)
+    os.makedirs(alias_dir, exist_ok=True)
+    path = os.path.join(alias_dir, ALIAS_FILE)
+    record = {"uid": alias.uid, "canonical_uid": alias.canonical_uid, "key": alias.key}
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f)
+    os.rename(path + ".tmp", path)
+    return path
+
+
+def glb_fingerprint(path: str, precision: int = 3) -> Optional[str]:
+    """Returns the geometry fingerprint of a GLB, or None if it is not a GLB or
+    has no positions with bounds."""
+    with open(path, "rb") as f:
+        header = f.read(20)
+        if len(header) < 20:
+            return None
+        magic, _, _, json_length, chunk_type = struct.unpack("<4sIIII", header)
+        if magic != b"glTF" or chunk_type != 0x4E4F534A:
+            return None
+        gltf = json.loads(f.read(json_length))
+    accessors = gltf.get("accessors", [])
+    num_vertices = 0
+    bbox_min = [float("inf")] * 3
+    bbox_max = [float("-inf")] * 3
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            index = primitive.get("attributes", {}).get("POSITION")
+            if index is None:
+                continue
+            accessor = accessors[index]
+            if "min" not in accessor or "max" not in accessor:
+                return None
+            num_vertices += accessor["count"]
+            bbox_min = [min(a, b) for a, b in zip(bbox_min, accessor["min"])]
+            bbox_max = [max(a, b) for a, b in zip(bbox_max, accessor["max"])]
+    if num_vertices == 0:
+        return None
+    extents = [b - a for a, b in zip(bbox_min, bbox_max)]
+    scale = max(extents) or 1
+    shape = ",".join(f"{extent / scale:.{precision}f}" for extent in extents)
+    return f"{num_vertices}:{shape}"
+
+
+class DedupIndex:
+    def __init__(self, path: str, use_geometry: bool = False) -> None:
+        self.path = path
+        self.use_geometry = use_geometry
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared across threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def keys(self, object_path: str) -> List[str]:
+        """Returns the content keys of an object file."""
+        keys = [f"sha256:{file_sha256(object_path)}"]
+        if self.use_geometry and object_path.endswith(".glb"):
+            fingerprint = glb_fingerprint(object_path)
+            if fingerprint is not None:
+                keys.append(f"geometry:{fingerprint}")
+        return keys
+
+    def claim(
+        self, uid: str, local_path: str, object_path: Optional[str] = None
+    ) -> Optional[Alias]:
+        """Claims the contents of an object for its uid.
+
+        Returns None if the object should be rendered, or the alias it is
+        recorded as if it is a duplicate. The alias is pending unless its
+        canonical object is already done. object_path is what to render if the
+        canonical object fails, and defaults to local_path.
+        """
+        keys = self.keys(local_path)
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key in keys:
+                row = conn.execute(
+                    "SELECT uid, done FROM contents WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] != uid:
+                    alias = Alias(
+                        uid, row[0], key, object_path or local_path, not row[1]
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO aliases (uid, canonical_uid, key,"
+                        " object_path, state, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            uid,
+                            alias.canonical_uid,
+                            key,
+                            alias.object_path,
+                            "pending" if alias.pending else "done",
+                            time.time(),
+                        ),
+                    )
+                    return alias
+            conn.executemany(
+                "INSERT OR IGNORE INTO contents (key, uid) VALUES (?, ?)",
+                ((key, uid) for key in keys),
+            )
+        return None
+
+    def record_render(self, uid: str, render_seconds: float) -> None:
+        """Records how long the canonical object took to render."""
+        self._connection().execute(
+            "UPDATE contents SET render_seconds = ? WHERE uid = ?",
+            (render_seconds, uid),
+        )
+
+    def _aliases(self, conn: sqlite3.Connection, canonical_uid: str) -> List[Alias]:
+        rows = conn.execute(
+            "SELECT uid, key, object_path FROM aliases"
+            " WHERE canonical_uid = ? AND state = 'pending' ORDER BY created_at",
+            (canonical_uid,),
+        ).fetchall()
+        return [Alias(uid, canonical_uid, key, path, True) for uid, key, path in rows]
+
+    def complete(self, uid: str) -> List[Alias]:
+        """Marks a canonical object as done, and returns its pending aliases,
+        which are done from now on too."""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE contents SET done = 1 WHERE uid = ?", (uid,))
+            aliases = self._aliases(conn, uid)
+            conn.execute(
+                "UPDATE aliases SET state = 'done'"
+                " WHERE canonical_uid = ? AND state = 'pending'",
+                (uid,),
+            )
+        for alias in aliases:
+            alias.pending = False
+        return aliases
+
+    def forget(self, uid: str) -> Optional[Alias]:
+        """Releases the contents of an object that could not be rendered or
+        uploaded.
+
+        If the object has pending aliases, the first one becomes the canonical
+        object of its contents and is returned, to be rendered instead, and the
+        others become its aliases.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            aliases = self._aliases(conn, uid)
+            if not aliases:
+                conn.execute("DELETE FROM contents WHERE uid = ?", (uid,))
+                return None
+            promoted = aliases[0]
+            conn.execute(
+                "UPDATE contents SET uid = ?, render_seconds = NULL, done = 0"
+                " WHERE uid = ?",
+                (promoted.uid, uid),
+            )
+            conn.execute("DELETE FROM aliases WHERE uid = ?", (promoted.uid,))
+            conn.execute(
+                "UPDATE aliases SET canonical_uid = ?"
+                " WHERE canonical_uid = ? AND state = 'pending'",
+                (promoted.uid, uid),
+            )
+        return promoted
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of done and pending aliases, and the render
+        seconds the done ones saved."""
+        num_aliases, num_pending, saved_seconds = (
+            self._connection()
+            .execute(
+                "SELECT COALESCE(SUM(a.state = 'done'), 0),"
+                " COALESCE(SUM(a.state = 'pending'), 0),"
+                " COALESCE(SUM(CASE WHEN a.state = 'done'"
+                " THEN c.render_seconds END), 0)"
+                " FROM aliases a LEFT JOIN contents c ON a.key = c.key"
+            )
+            .fetchone()
+        )
+        return {
+            "aliases": num_aliases,
+            "pending_aliases": num_pending,
+            "saved_render_seconds": saved_seconds,
+        }
@@ -1,15 +1,38 @@
-import glob
 import json
 import multiprocessing
+import os
+import queue as queue_lib
 import shutil
-import subprocess
+import socket
+import sys
+import threading
 import time
+import traceback
 from dataclasses import dataclass
-from typing import Optional
+from typing import Iterator, List, Literal, Optional, Set, Tuple
 
-import boto3
 import tyro
-import wandb
+
+from concurrency import (
+    ConcurrencyController,
+    FakeProbe,
+    NvidiaSmiProbe,
+    detect_num_gpus,
+)
+from dedup import ALIAS_FILE, Alias, DedupIndex, write_alias_record
+from ledger import Ledger
+from manifest import CountingIterator, iter_manifest
+from metrics import MetricsRegistry, MetricsServer, WandbExporter
+from object_cache import ObjectCache
+from prefetch import Prefetcher, fetch_object, get_uid
+from render_server import RenderServer
+from scheduling import estimate_costs, longest_first, makespan
+from shards import ShardWriter
+from spans import SpanWriter, format_summary, read_spans, summarize_spans
+from uploader import Uploader, make_s3_client
+from work_queue import Heartbeat, leased_items, open_work_queue
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 @dataclass
@@ -18,97 +41,829 @@ class Args:
     """number of workers per gpu"""
 
     input_models_path: str
-    """Path to a json file containing a list of 3D object files"""
+    """Path to a manifest of 3D object files: a JSON list, or JSON lines with one
+    path per line, optionally gzipped (.json, .jsonl, .json.gz, .jsonl.gz)"""
 
     upload_to_s3: bool = False
     """Whether to upload the rendered images to S3"""
 
+    s3_bucket: str = "objaverse-images"
+    """S3 bucket to upload the rendered images to"""
+
+    s3_endpoint_url: Optional[str] = None
+    """endpoint of an S3-compatible server to use instead of AWS"""
+
+    upload_workers: int = 16
+    """number of rendered objects to upload concurrently"""
+
+    max_upload_in_flight_mb: float = 256
+    """maximum number of MB of rendered images being uploaded at once"""
+
+    upload_retries: int = 5
+    """number of times to retry a failed upload"""
+
     log_to_wandb: bool = False
     """Whether to log the progress to wandb"""
 
+    metrics_port: Optional[int] = None
+    """port to serve the metrics of the run on in the Prometheus text format, at
+    http://localhost:{metrics_port}/metrics. None disables it"""
+
     num_gpus: int = -1
-    """number of gpus to use. -1 means all available gpus"""
+    """number of gpus to use. -1 means all the gpus nvidia-smi lists"""
+
+    max_objects_per_blender: int = 100
+    """number of objects a Blender process renders before it is restarted"""
+
+    max_blender_memory_mb: Optional[float] = None
+    """restart a Blender process once its resident memory exceeds this many MB"""
+
+    fake_renderer: bool = False
+    """use a fake renderer instead of Blender to test the pipeline"""
+
+    blender_path: str = "blender-3.2.2-linux-x64/blender"
+    """path to the Blender executable"""
+
+    download_dir: str = "tmp-objects"
+    """directory that objects are downloaded to before they are rendered"""
+
+    download_workers: int = 8
+    """number of objects to download concurrently"""
+
+    prefetch_lookahead: int = 32
+    """maximum number of downloaded objects waiting to be rendered"""
+
+    max_download_dir_gb: Optional[float] = None
+    """pause downloads while the download directory is larger than this"""
+
+    cache_dir: Optional[str] = None
+    """directory of a node-local object cache shared by all runs. None disables it"""
+
+    max_cache_gb: float = 100
+    """size of the object cache before least recently used objects are evicted"""
+
+    output_format: Literal["png", "tar"] = "png"
+    """save each view as a PNG, or pack the views and camera poses of each object
+    into one record and group the records into tar shards"""
+
+    render_mode: Literal["per_view", "animation"] = "per_view"
+    """render each view separately or all views of an object as one camera
+    animation (Blender only)"""
+
+    engine: Literal["CYCLES", "BLENDER_EEVEE"] = "BLENDER_EEVEE"
+    """render engine to use (Blender only)"""
+
+    cycles_device: Literal["GPU", "CPU"] = "GPU"
+    """device Cycles renders on (Blender only)"""
+
+    samples: int = 32
+    """Cycles samples (Blender only)"""
+
+    noise_threshold: float = 0.01
+    """Cycles adaptive sampling noise threshold. 0 disables adaptive sampling"""
+
+    exact_bbox: bool = False
+    """normalize objects by the bounds of their vertices rather than of the
+    bounding boxes of their meshes (Blender only)"""
+
+    max_triangles: Optional[int] = None
+    """decimate objects with more triangles than this before rendering them
+    (Blender only)"""
+
+    max_texture_size: Optional[int] = None
+    """downsample textures with a side larger than this before rendering
+    (Blender only)"""
+
+    compare_simplify: bool = False
+    """with max_triangles or max_texture_size, also render every object without
+    them to a scratch directory and record the render time they saved in the
+    ledger. Doubles the render time, so use it on a sample (Blender only)"""
+
+    render_configs: Optional[str] = None
+    """JSON file of render configurations (camera rigs, resolutions and passes)
+    to render every object with from a single scene load (Blender only)"""
+
+    scene_cache_dir: Optional[str] = None
+    """directory of a cache of imported and normalized scenes, so that objects
+    are only imported once across runs (Blender only)"""
+
+    max_scene_cache_gb: float = 50
+    """size of the scene cache before least recently used scenes are evicted"""
+
+    check_views: bool = False
+    """check the alpha channel of the views for empty, clipped or too small
+    objects, and render them again from an adjusted distance (Blender only).
+    Objects whose views stay empty fail"""
+
+    view_retries: int = 2
+    """times to render the views of an object again with check_views"""
+
+    dedup_path: Optional[str] = None
+    """SQLite file indexing the contents of rendered objects across runs. Objects
+    with the same sha256 as an object rendered before are recorded as aliases of
+    it and not rendered"""
+
+    dedup_geometry: bool = False
+    """with dedup_path, also treat GLBs with the same vertex count and normalized
+    bounding box as duplicates"""
+
+    time_budget: Optional[float] = None
+    """seconds to render an object in. Samples, resolution and finally the engine
+    are lowered while the views of an object project past it. Not supported with
+    the animation render mode"""
+
+    shard_dir: str = "shards"
+    """directory that tar shards are written to"""
+
+    max_shard_mb: float = 1024
+    """size a tar shard grows to before a new one is started"""
+
+    ledger_path: Optional[str] = None
+    """SQLite file recording the state of every object. If it already has objects,
+    only the unfinished ones are rendered and input_models_path is not read"""
+
+    render_timeout: Optional[float] = 600
+    """seconds a single object may take to render before Blender is killed"""
+
+    render_memory_limit_mb: Optional[float] = None
+    """kill Blender if its resident memory exceeds this many MB during a render"""
+
+    max_attempts: int = 3
+    """number of times to try rendering an object before quarantining it"""
+
+    retry_backoff: float = 5
+    """seconds to wait before the first retry, doubling with every retry"""
+
+    spans_path: Optional[str] = "spans.jsonl"
+    """JSON lines file that the timing of every stage of every object is appended
+    to. None disables it"""
+
+    quarantine_path: str = "quarantine.jsonl"
+    """file listing the objects that failed every attempt. They are skipped by
+    later runs"""
+
+    order: Literal["manifest", "longest_first"] = "manifest"
+    """render the objects in the order of the manifest, or the most expensive
+    first, estimating costs from the timings of earlier runs in spans_path and
+    the ledger"""
+
+    known_tail: float = 1.0
+    """with longest_first, the cheapest objects of known cost, adding up to this
+    many times the cost of the most expensive object per worker, are rendered
+    after every object whose cost is only guessed"""
+
+    adaptive_workers: bool = False
+    """adjust the number of workers of each GPU during the run, starting from
+    workers_per_gpu, based on throughput, failures and GPU memory and utilization"""
+
+    min_workers_per_gpu: int = 1
+    """fewest workers per gpu with adaptive_workers"""
+
+    max_workers_per_gpu: int = 8
+    """most workers per gpu with adaptive_workers"""
+
+    concurrency_interval: float = 60
+    """seconds between adjustments of the number of workers"""
+
+    gpu_probe: Literal["nvidia-smi", "fake"] = "nvidia-smi"
+    """how to read GPU memory and utilization with adaptive_workers"""
+
+    work_queue: Optional[str] = None
+    """URL of a work queue shared by the nodes of a multi-node run, either
+    sqlite:///path/to/queue.db or redis://host:port/db. Objects are leased from
+    it instead of being read from input_models_path"""
+
+    coordinator: bool = False
+    """add the objects of input_models_path to the work queue. Other nodes only
+    lease from it, and wait until the coordinator has added every object"""
+
+    node_id: Optional[str] = None
+    """name of this node in the work queue. Defaults to the hostname and pid"""
+
+    lease_batch: int = 16
+    """number of objects to lease from the work queue at a time"""
+
+    lease_seconds: float = 300
+    """seconds after the last heartbeat of a node that its leases expire"""
+
+    max_leases: int = 3
+    """number of times the lease of an object may expire before it is failed"""
+
+
+def load_quarantine(path: str) -> Set[str]:
+    """Returns the uids of the quarantined objects."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return {json.loads(line)["uid"] for line in f if line.strip()}
+
+
+def add_to_quarantine(path: str, uid: str, object_path: str, error: str) -> None:
+    # a single small append is atomic, so workers can share the file
+    record = {"uid": uid, "object_path": object_path, "error": error}
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def requeue_later(
+    queue: multiprocessing.JoinableQueue, item: Tuple[str, int], delay: float
+) -> None:
+    """Puts an item back on the queue once delay seconds have passed.
+
+    A timer thread waits out the delay instead of the worker, which goes on
+    rendering other objects, and the item is only marked done once it is back on
+    the queue so that queue.join() keeps waiting for it.
+    """
+
+    def requeue() -> None:
+        queue.put(item)
+        queue.task_done()
+
+    threading.Timer(delay, requeue).start()
+
+
+def finish_aliases(
+    aliases: List[Alias],
+    ledger: Optional[Ledger],
+    work_queue,
+    node_id: Optional[str],
+    count: multiprocessing.Value,
+    uploader: Optional[Uploader] = None,
+) -> None:
+    """Writes the alias records of duplicates whose canonical object is done,
+    uploads them under the uid of each duplicate, and marks the duplicates done.
+    """
+    for alias in aliases:
+        print("Skipping", alias.uid, "as a duplicate of", alias.canonical_uid)
+        success = True
+        error = f"duplicate of {alias.canonical_uid}"
+        record_path = write_alias_record("views", alias)
+        if uploader is not None:
+            try:
+                uploader.upload_files({record_path: f"{alias.uid}/{ALIAS_FILE}"})
+            except Exception as e:
+                print("Failed to upload the alias record of", alias.uid, e)
+                success, error = False, repr(e)
+            shutil.rmtree(os.path.dirname(record_path), ignore_errors=True)
+        if ledger is not None:
+            ledger.set_state(
+                alias.uid, "duplicate" if success else "failed", error=error
+            )
+        if work_queue is not None:
+            work_queue.complete(alias.uid, node_id, success=success)
+        with count.get_lock():
+            count.value += 1
 
 
 def worker(
     queue: multiprocessing.JoinableQueue,
     count: multiprocessing.Value,
     gpu: int,
-    s3: Optional[boto3.client],
+    worker_i: int,
+    output_queue: Optional[multiprocessing.Queue],
+    ledger: Optional[Ledger],
+    spans: Optional[SpanWriter],
+    render_counts: Tuple[multiprocessing.Array, multiprocessing.Array],
+    stop: multiprocessing.Event,
+    work_queue=None,
+    dedup: Optional[DedupIndex] = None,
+    metrics: Optional[MetricsRegistry] = None,
+    node_id: Optional[str] = None,
 ) -> None:
+    if args.fake_renderer:
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, "render_server.py")]
+    else:
+        command = [
+            args.blender_path,
+            "-b",
+            "-P",
+            os.path.join(SCRIPTS_DIR, "blender_script.py"),
+            "--",
+        ]
+    command += ["--output_format", args.output_format]
+    if not args.fake_renderer:
+        command += ["--render_mode", args.render_mode, "--engine", args.engine]
+        command += ["--cycles_device", args.cycles_device]
+        command += ["--samples", str(args.samples)]
+        command += ["--noise_threshold", str(args.noise_threshold)]
+        if args.time_budget is not None:
+            command += ["--time_budget", str(args.time_budget)]
+        if args.exact_bbox:
+            command += ["--exact_bbox"]
+        if args.render_configs is not None:
+            command += ["--render_configs", os.path.abspath(args.render_configs)]
+        if args.scene_cache_dir is not None:
+            command += ["--scene_cache_dir", args.scene_cache_dir]
+            command += ["--max_scene_cache_gb", str(args.max_scene_cache_gb)]
+        if args.check_views:
+            command += ["--check_views", "--view_retries", str(args.view_retries)]
+        if args.max_triangles is not None:
+            command += ["--max_triangles", str(args.max_triangles)]
+        if args.max_texture_size is not None:
+            command += ["--max_texture_size", str(args.max_texture_size)]
+        if args.compare_simplify:
+            command += ["--compare_simplify"]
+    # shared with the prefetcher through the cache directory
+    cache = None
+    if args.cache_dir is not None:
+        cache = ObjectCache(args.cache_dir, int(args.max_cache_gb * 1024**3))
+    render_server = RenderServer(
+        command,
+        env={**os.environ, "DISPLAY": f":0.{gpu}"},
+        max_objects=args.max_objects_per_blender,
+        max_memory_mb=args.max_blender_memory_mb,
+        timeout=args.render_timeout,
+        kill_memory_mb=args.render_memory_limit_mb,
+    )
+
     while True:
-        item = queue.get()
+        # a worker that is scaled down stops before taking its next object
+        if stop.is_set():
+            render_server.close()
+            break
+        try:
+            item = queue.get(timeout=1)
+        except queue_lib.Empty:
+            continue
         if item is None:
+            render_server.close()
             break
 
-        # Perform some operation on the item
-        print(item, gpu)
-        command = (
-            f"export DISPLAY=:0.{gpu} &&"
-            f" blender-3.2.2-linux-x64/blender -b -P scripts/blender_script.py --"
-            f" --object_path {item}"
-        )
-        subprocess.run(command, shell=True)
-
-        if args.upload_to_s3:
-            if item.startswith("http"):
-                uid = item.split("/")[-1].split(".")[0]
-                for f in glob.glob(f"views/{uid}/*"):
-                    s3.upload_file(
-                        f, "objaverse-images", f"{uid}/{f.split('/')[-1]}"
+        # retries come back on the queue with their attempt number
+        item, attempt = item if isinstance(item, tuple) else (item, 0)
+        retrying = False
+        requeued = False
+        try:
+            print(item, gpu)
+            uid = get_uid(item)
+            if ledger is not None:
+                ledger.set_state(uid, "rendering")
+            start = time.time()
+            # failing to start Blender is a failed attempt like any other
+            result = render_server.render(item)
+            # keep the spans out of the ledger
+            result["info"] = dict(result["info"] or {})
+            object_spans = result["info"].pop("spans", [])
+            if spans is not None:
+                object_stats = {
+                    k: v
+                    for k, v in result["info"].items()
+                    if k not in ("render_policy", "view_quality")
+                }
+                object_spans.append(
+                    {
+                        "uid": uid,
+                        "stage": "render_object",
+                        "start": start,
+                        "duration": time.time() - start,
+                        "attempt": attempt,
+                        "success": result["success"],
+                        **object_stats,
+                    }
+                )
+                spans.write(object_spans, gpu=gpu, worker=worker_i)
+            counts = render_counts[0 if result["success"] else 1]
+            with counts.get_lock():
+                counts[gpu] += 1
+            if metrics is not None:
+                status = "success" if result["success"] else "failed"
+                metrics.inc("render_attempts_total", gpu=gpu, status=status)
+                metrics.observe("render_seconds", time.time() - start, gpu=gpu)
+                if attempt > 0:
+                    metrics.inc("render_retries_total", gpu=gpu)
+            if not result["success"]:
+                print("Failed to render", item, result["error"])
+                # remove the views of the failed attempt
+                shutil.rmtree(os.path.join("views", uid), ignore_errors=True)
+                if attempt + 1 < args.max_attempts:
+                    requeue_later(
+                        queue, (item, attempt + 1), args.retry_backoff * 2**attempt
                     )
-            # remove the views/uid directory
-            shutil.rmtree(f"views/{uid}")
+                    retrying = requeued = True
+                    continue
+                add_to_quarantine(args.quarantine_path, uid, item, result["error"])
+            if metrics is not None:
+                if result["success"]:
+                    metrics.inc("objects_rendered_total", gpu=gpu, worker=worker_i)
+                else:
+                    metrics.inc("objects_quarantined_total", gpu=gpu)
+            if ledger is not None:
+                ledger.set_state(
+                    uid,
+                    "rendered" if result["success"] else "quarantined",
+                    error=result["error"],
+                    render_info=result["info"],
+                    render_seconds=result["duration"],
+                )
+            if work_queue is not None and not work_queue.complete(
+                uid, node_id, success=result["success"]
+            ):
+                print("Lost the lease of", uid, "to another node")
+            if dedup is not None:
+                if result["success"]:
+                    dedup.record_render(uid, result["duration"])
+                    # with uploads, the duplicates wait for the upload instead
+                    if not args.upload_to_s3:
+                        aliases = dedup.complete(uid)
+                        finish_aliases(aliases, ledger, work_queue, node_id, count)
+                else:
+                    # render a duplicate of the object instead, which takes the
+                    # place of this object on the queue. Its download was removed
+                    # when it was found to be a duplicate, so it is fetched again
+                    promoted = dedup.forget(uid)
+                    while promoted is not None:
+                        print("Rendering", promoted.uid, "in place of", uid)
+                        try:
+                            local_path = fetch_object(
+                                promoted.object_path,
+                                args.download_dir,
+                                cache,
+                                ledger,
+                                spans,
+                                metrics,
+                            )
+                        except Exception as e:
+                            print("Failed to download", promoted.object_path, e)
+                            if work_queue is not None:
+                                work_queue.complete(promoted.uid, node_id, False)
+                            with count.get_lock():
+                                count.value += 1
+                            promoted = dedup.forget(promoted.uid)
+                            continue
+                        requeue_later(queue, local_path, 0)
+                        requeued = True
+                        break
+            # delete the object if it was downloaded by the prefetcher
+            if os.path.dirname(item) == os.path.abspath(args.download_dir):
+                os.remove(item)
 
-        with count.get_lock():
-            count.value += 1
-
-        queue.task_done()
+            # hand the rendered images to the uploader or the shard writer
+            if output_queue is not None and result["success"]:
+                if args.output_format == "tar":
+                    output_queue.put(os.path.join("views", f"{uid}.tar"))
+                else:
+                    output_queue.put(os.path.join("views", uid))
+        except Exception:
+            # keep the worker alive for the next objects
+            traceback.print_exc()
+        finally:
+            # a retried object is only done once its retry is back on the queue
+            if not retrying:
+                with count.get_lock():
+                    count.value += 1
+            if not requeued:
+                queue.task_done()
 
 
 if __name__ == "__main__":
     args = tyro.cli(Args)
+    if args.time_budget is not None and args.render_mode == "animation":
+        raise ValueError("time_budget is not supported with render_mode animation")
+    if args.num_gpus == -1:
+        args.num_gpus = detect_num_gpus()
+        if args.num_gpus == 0:
+            raise ValueError("No GPUs were detected, set num_gpus explicitly")
 
-    s3 = boto3.client("s3") if args.upload_to_s3 else None
-    queue = multiprocessing.JoinableQueue()
+    queue = multiprocessing.JoinableQueue(maxsize=args.prefetch_lookahead)
     count = multiprocessing.Value("i", 0)
 
     if args.log_to_wandb:
+        import wandb
+
         wandb.init(project="objaverse-rendering", entity="prior-ai2")
 
+    # Collect the metrics of the workers and every stage in this process
+    metrics = MetricsRegistry()
+    metrics.counter("objects_rendered_total", "Objects rendered by each worker")
+    metrics.counter("objects_quarantined_total", "Objects that failed every attempt")
+    metrics.counter("render_attempts_total", "Render attempts by outcome")
+    metrics.counter("render_retries_total", "Render attempts after a failure")
+    metrics.histogram("render_seconds", "Time to render an object once")
+    metrics.gauge(
+        "queue_depth", "Objects waiting for each stage", queue.qsize, stage="render"
+    )
+    metrics.start()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, args.metrics_port)
+        metrics_server.start()
+        print(f"Serving metrics at http://localhost:{metrics_server.port}/metrics")
+
+    # Resume from the ledger if it already has objects
+    ledger = None if args.ledger_path is None else Ledger(args.ledger_path)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    spans = None
+    if args.spans_path is not None:
+        spans = SpanWriter(args.spans_path, run=run_id)
+    dedup = None
+    if args.dedup_path is not None:
+        dedup = DedupIndex(args.dedup_path, use_geometry=args.dedup_geometry)
+    work_queue = None
+    if args.work_queue is not None:
+        work_queue = open_work_queue(args.work_queue, max_leases=args.max_leases)
+    if work_queue is not None and not args.coordinator:
+        model_paths = []
+    elif ledger is not None and not ledger.is_empty():
+        model_paths = ledger.pending(
+            finished_state="uploaded" if args.upload_to_s3 else "rendered"
+        )
+        print(f"Resuming {len(model_paths)} unfinished objects from the ledger")
+    else:
+        # stream the manifest instead of loading it, so that the first objects
+        # are rendered right away
+        quarantined_uids = load_quarantine(args.quarantine_path)
+
+        def manifest_paths() -> Iterator[str]:
+            for object_path in iter_manifest(args.input_models_path):
+                if get_uid(object_path) not in quarantined_uids:
+                    yield object_path
+
+        # the whole manifest is in the ledger before rendering starts, so that
+        # a resumed run does not miss the objects that had not been read yet
+        if ledger is not None:
+            ledger.add(manifest_paths())
+        model_paths = manifest_paths()
+
+    # Start the most expensive objects first so that none of them starts last
+    if args.order == "longest_first":
+        model_paths = list(model_paths)
+        num_workers = max(args.num_gpus * args.workers_per_gpu, 1)
+        costs, known = estimate_costs(model_paths, args.spans_path, ledger)
+        naive_makespan = makespan(costs, num_workers)
+        print(f"Estimated makespan in manifest order: {naive_makespan:.1f}s")
+        order = longest_first(costs, known, num_workers, args.known_tail)
+        model_paths = [model_paths[i] for i in order]
+        ordered_makespan = makespan([costs[i] for i in order], num_workers)
+        print(f"Estimated makespan longest first: {ordered_makespan:.1f}s")
+    start_time = time.time()
+
+    # Lease the objects from the queue shared with the other nodes instead
+    node_id = None
+    if work_queue is not None:
+        if args.coordinator:
+            work_queue.add(model_paths)
+            work_queue.mark_seeded()
+        node_id = args.node_id or f"{socket.gethostname()}-{os.getpid()}"
+        heartbeat = Heartbeat(work_queue, node_id, args.lease_seconds)
+        heartbeat.start()
+
+        def lease_objects():
+            for object_path in leased_items(
+                work_queue, node_id, args.lease_batch, args.lease_seconds
+            ):
+                if ledger is not None:
+                    ledger.add([object_path])
+                yield object_path
+
+        model_paths = lease_objects()
+    model_paths = CountingIterator(model_paths)
+
+    # Upload the rendered images in the background
+    upload_queue = None
+    if args.upload_to_s3:
+        upload_queue = multiprocessing.Queue()
+
+        def on_upload(uid: str, success: bool) -> None:
+            """Finishes the duplicates of an uploaded object."""
+            if dedup is None:
+                return
+            if success:
+                aliases = dedup.complete(uid)
+                finish_aliases(aliases, ledger, work_queue, node_id, count, uploader)
+                return
+            promoted = dedup.forget(uid)
+            if promoted is not None:
+                # the render workers may be gone by the time an upload fails
+                print(promoted.uid, "will be rendered in place of", uid, "next run")
+
+        uploader = Uploader(
+            make_s3_client(args.upload_workers, args.s3_endpoint_url),
+            args.s3_bucket,
+            num_workers=args.upload_workers,
+            max_in_flight_bytes=int(args.max_upload_in_flight_mb * 1024**2),
+            max_retries=args.upload_retries,
+            ledger=ledger,
+            spans=spans,
+            metrics=metrics,
+            on_upload=on_upload,
+        )
+        uploader.start(upload_queue)
+        metrics.gauge(
+            "queue_depth",
+            "Objects waiting for each stage",
+            upload_queue.qsize,
+            stage="upload",
+        )
+
+    # Pack the rendered objects into shards in the background
+    output_queue = upload_queue
+    if args.output_format == "tar":
+        output_queue = multiprocessing.Queue()
+        shard_writer = ShardWriter(
+            args.shard_dir,
+            int(args.max_shard_mb * 1024**2),
+            on_shard=uploader.upload_shard if args.upload_to_s3 else None,
+        )
+        shard_writer.start(output_queue)
+        metrics.gauge(
+            "queue_depth",
+            "Objects waiting for each stage",
+            output_queue.qsize,
+            stage="pack",
+        )
+
     # Start worker processes on each of the GPUs
-    for gpu_i in range(args.num_gpus):
-        for worker_i in range(args.workers_per_gpu):
-            worker_i = gpu_i * args.workers_per_gpu + worker_i
+    render_counts = (
+        multiprocessing.Array("i", args.num_gpus),
+        multiprocessing.Array("i", args.num_gpus),
+    )
+    processes = []
+    gpu_workers = {gpu_i: [] for gpu_i in range(args.num_gpus)}
+
+    def set_workers(gpu_i: int, num_workers: int) -> None:
+        """Starts or stops workers on a GPU until it has num_workers running."""
+        running = [w for w in gpu_workers[gpu_i] if not w[1].is_set()]
+        for process, stop in running[num_workers:]:
+            stop.set()
+        for _ in range(num_workers - len(running)):
+            stop = multiprocessing.Event()
             process = multiprocessing.Process(
-                target=worker, args=(queue, count, gpu_i, s3)
+                target=worker,
+                args=(
+                    queue,
+                    count,
+                    gpu_i,
+                    len(processes),
+                    output_queue,
+                    ledger,
+                    spans,
+                    render_counts,
+                    stop,
+                    work_queue,
+                    dedup,
+                    metrics,
+                    node_id,
+                ),
             )
             process.daemon = True
             process.start()
+            processes.append(process)
+            gpu_workers[gpu_i].append((process, stop))
 
-    # Add items to the queue
-    with open(args.input_models_path, "r") as f:
-        model_paths = json.load(f)
-    for item in model_paths:
-        queue.put(item)
+    for gpu_i in range(args.num_gpus):
+        metrics.gauge(
+            "workers",
+            "Running render workers of each GPU",
+            lambda gpu_i=gpu_i: sum(not s.is_set() for _, s in gpu_workers[gpu_i]),
+            gpu=gpu_i,
+        )
 
-    # update the wandb count
-    if args.log_to_wandb:
-        while True:
-            time.sleep(5)
-            wandb.log(
-                {
-                    "count": count.value,
-                    "total": len(model_paths),
-                    "progress": count.value / len(model_paths),
-                }
+    initial_workers = args.workers_per_gpu
+    controller = None
+    if args.adaptive_workers:
+        controller = ConcurrencyController(
+            args.num_gpus,
+            args.workers_per_gpu,
+            get_counts=lambda: (render_counts[0][:], render_counts[1][:]),
+            set_workers=set_workers,
+            probe=(
+                FakeProbe(args.num_gpus)
+                if args.gpu_probe == "fake"
+                else NvidiaSmiProbe()
+            ),
+            min_workers=args.min_workers_per_gpu,
+            max_workers=args.max_workers_per_gpu,
+            interval=args.concurrency_interval,
+        )
+        initial_workers = controller.workers[0]
+    for gpu_i in range(args.num_gpus):
+        set_workers(gpu_i, initial_workers)
+    if controller is not None:
+        controller.start()
+
+    def on_download_error(item: str, e: Exception) -> None:
+        print("Failed to download", item, e)
+        if work_queue is not None:
+            work_queue.complete(get_uid(item), node_id, success=False)
+        with count.get_lock():
+            count.value += 1
+
+    def on_duplicate(alias: Alias) -> None:
+        if alias.pending:
+            print(alias.uid, "is waiting for its duplicate", alias.canonical_uid)
+        else:
+            finish_aliases(
+                [alias],
+                ledger,
+                work_queue,
+                node_id,
+                count,
+                uploader if args.upload_to_s3 else None,
             )
-            if count.value == len(model_paths):
-                break
+
+    # Download the items ahead of the workers and add them to the queue
+    prefetcher = Prefetcher(
+        queue,
+        download_dir=args.download_dir,
+        num_workers=args.download_workers,
+        max_disk_bytes=(
+            None
+            if args.max_download_dir_gb is None
+            else int(args.max_download_dir_gb * 1024**3)
+        ),
+        on_error=on_download_error,
+        cache=(
+            None
+            if args.cache_dir is None
+            else ObjectCache(args.cache_dir, int(args.max_cache_gb * 1024**3))
+        ),
+        ledger=ledger,
+        spans=spans,
+        dedup=dedup,
+        on_duplicate=on_duplicate,
+        metrics=metrics,
+    )
+    prefetcher.start(model_paths)
+
+    def progress() -> Tuple[int, int]:
+        """Returns the number of finished objects and the total, of all nodes
+        when they share a work queue."""
+        if work_queue is None:
+            return count.value, model_paths.count
+        counts = work_queue.counts()
+        return counts.get("done", 0) + counts.get("failed", 0), sum(counts.values())
+
+    metrics.gauge("objects_finished", "Objects that are done", lambda: progress()[0])
+    metrics.gauge("objects_total", "Objects read so far", lambda: progress()[1])
+
+    # log the metrics to wandb until the run is over, however many objects were
+    # lost along the way
+    wandb_exporter = None
+    if args.log_to_wandb:
+        wandb_exporter = WandbExporter(metrics)
+        wandb_exporter.start()
 
     # Wait for all tasks to be completed
+    prefetcher.join()
     queue.join()
+    if work_queue is not None:
+        heartbeat.stop()
+        print("Work queue states:", work_queue.counts())
+
+    if prefetcher.cache is not None:
+        print("Object cache stats:", prefetcher.cache.stats())
+
+    # Wait for the workers stopped by the controller first, since one that is
+    # still waiting on the queue could otherwise take a sentinel meant for a
+    # running worker
+    if controller is not None:
+        controller.stop()
+    running = []
+    for workers in gpu_workers.values():
+        for process, stop in workers:
+            if stop.is_set():
+                process.join()
+            else:
+                running.append(process)
 
-    # Add sentinels to the queue to stop the worker processes
-    for i in range(args.num_gpus * args.workers_per_gpu):
+    # Add sentinels to the queue to stop the running worker processes, and wait
+    # for them to shut down their Blender processes
+    for _ in running:
         queue.put(None)
+    for process in running:
+        process.join()
+
+    # Close the last shard
+    if args.output_format == "tar":
+        output_queue.put(None)
+        shard_writer.join()
+
+    # Wait for the remaining uploads to finish
+    if args.upload_to_s3:
+        upload_queue.put(None)
+        uploader.join()
+        print(f"Uploaded {uploader.num_uploaded} objects")
+        if uploader.failed:
+            print("Failed to upload:", uploader.failed)
+
+    metrics.stop()
+    if wandb_exporter is not None:
+        wandb_exporter.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+
+    if ledger is not None:
+        print("Ledger states:", ledger.counts())
+
+    if dedup is not None:
+        stats = dedup.stats()
+        print(
+            f"Skipped {stats['aliases']} duplicates in total, saving"
+            f" {stats['saved_render_seconds']:.1f} GPU seconds of rendering."
+            f" {stats['pending_aliases']} duplicates are waiting for a later run"
+        )
+
+    print(f"Makespan: {time.time() - start_time:.1f}s")
+
+    if spans is not None and os.path.exists(args.spans_path):
+        print(format_summary(summarize_spans(read_spans(args.spans_path, run_id))))
@@ -1,13 +1,21 @@
 import argparse
+import itertools
 import json
-import random
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import Dict, Optional, Set
 
 import boto3
 import objaverse
 import tyro
 from tqdm import tqdm
 
+from dedup import ALIAS_FILE
+from manifest import write_manifest
+from object_index import ObjectIndex, build_index
+
 
 @dataclass
 class Args:
@@ -20,45 +28,162 @@ class Args:
     skip_completed: bool = False
     """whether to skip the files that have already been downloaded"""
 
+    num_views: int = 12
+    """number of rendered images an object needs to count as completed"""
 
-def get_completed_uids():
-    # get all the files in the objaverse-images bucket
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket("objaverse-images")
-    bucket_files = [obj.key for obj in tqdm(bucket.objects.all())]
+    bucket: str = "objaverse-images"
+    """bucket the rendered images are uploaded to"""
 
-    dir_counts = {}
-    for file in bucket_files:
-        d = file.split("/")[0]
-        dir_counts[d] = dir_counts.get(d, 0) + 1
+    s3_endpoint_url: Optional[str] = None
+    """endpoint of an S3-compatible server to use instead of AWS"""
 
-    # get the directories with 12 files
-    dirs = [d for d, c in dir_counts.items() if c == 12]
-    return set(dirs)
+    snapshot_path: str = "completed_snapshot.json"
+    """file caching the image counts of the bucket between runs"""
 
+    listing_workers: int = 32
+    """number of prefixes of the bucket to list concurrently"""
 
-# set the random seed to 42
-if __name__ == "__main__":
-    args = tyro.cli(Args)
+    index_path: str = "object-index.bin"
+    """index of the shuffled object paths, built from objaverse on the first run"""
+
+    output_path: str = "input_models_path.json"
+    """manifest to write. Its extension sets the format: .json, .jsonl, .json.gz
+    or .jsonl.gz"""
+
+
+HEX_DIGITS = "0123456789abcdef"
+
+# most keys a single list_objects_v2 request returns
+LIST_PAGE_SIZE = 1000
 
-    random.seed(42)
+# file count of a uid directory that holds the alias record of a duplicate,
+# which is complete since its views are those of another uid
+ALIASED = -1
 
-    uids = objaverse.load_uids()
 
-    random.shuffle(uids)
+def count_keys(s3, bucket: str, prefix: str) -> Dict[str, int]:
+    """Counts the files in each uid directory under the prefix."""
+    dir_counts = {}
+    aliased = set()
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            d, _, name = obj["Key"].partition("/")
+            dir_counts[d] = dir_counts.get(d, 0) + 1
+            if name == ALIAS_FILE:
+                aliased.add(d)
+    dir_counts.update({d: ALIASED for d in aliased})
+    return dir_counts
+
+
+def list_dirs(s3, bucket: str, prefix: str) -> Set[str]:
+    """Lists the uid directories under the prefix without listing their files."""
+    dirs = set()
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            dirs.add(common_prefix["Prefix"].rstrip("/"))
+    return dirs
+
+
+def refresh_prefix(
+    s3, bucket: str, prefix: str, known: Dict[str, int], num_views: int
+) -> Dict[str, int]:
+    """Returns the up to date file counts of the uid directories under the prefix.
+
+    `known` holds the snapshot's counts of the directories under the prefix.
+    Directories that were already complete are not listed again, so a refresh
+    mostly lists one entry per directory instead of one per file. When so many
+    directories are new or incomplete that listing each of them takes more
+    requests than listing every file under the prefix, the prefix is listed whole.
+    """
+    if not known:
+        return count_keys(s3, bucket, prefix)
+    dirs = list_dirs(s3, bucket, prefix)
+    unknown = {d for d in dirs if known.get(d) not in (num_views, ALIASED)}
+    whole_prefix_requests = math.ceil(len(dirs) * num_views / LIST_PAGE_SIZE)
+    if len(unknown) > whole_prefix_requests:
+        return count_keys(s3, bucket, prefix)
+    dir_counts = {d: known[d] for d in dirs if d not in unknown}
+    for d in unknown:
+        dir_counts.update(count_keys(s3, bucket, f"{d}/"))
+    return dir_counts
+
+
+def group_by_prefix(dir_counts: Dict[str, int]) -> Dict[str, Dict[str, int]]:
+    """Splits the file counts by the two hex digit prefix of their uid."""
+    groups: Dict[str, Dict[str, int]] = {}
+    for d, c in dir_counts.items():
+        groups.setdefault(d[:2], {})[d] = c
+    return groups
+
+
+def get_completed_uids(
+    num_views: int = 12,
+    bucket: str = "objaverse-images",
+    endpoint_url: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+    num_workers: int = 32,
+) -> Set[str]:
+    """Returns the uids that have num_views images in the bucket, or the alias
+    record of a duplicate.
+
+    The bucket is listed in parallel by two hex digit uid prefixes. The file
+    counts are saved to snapshot_path, and later calls only list the
+    directories that were not complete in the snapshot.
+    """
+    s3 = boto3.client("s3", endpoint_url=endpoint_url)
+    snapshot = {}
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        with open(snapshot_path, "r") as f:
+            snapshot = json.load(f)
+
+    prefixes = ["".join(p) for p in itertools.product(HEX_DIGITS, repeat=2)]
+    known = group_by_prefix(snapshot)
+    dir_counts = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                refresh_prefix, s3, bucket, p, known.get(p, {}), num_views
+            )
+            for p in prefixes
+        ]
+        for future in tqdm(futures):
+            dir_counts.update(future.result())
+
+    if snapshot_path is not None:
+        with open(snapshot_path + ".tmp", "w") as f:
+            json.dump(dir_counts, f)
+        os.rename(snapshot_path + ".tmp", snapshot_path)
+
+    # get the directories with num_views files or an alias record
+    return {d for d, c in dir_counts.items() if c in (num_views, ALIASED)}
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
 
-    object_paths = objaverse._load_object_paths()
-    uids = uids[args.start_i : args.end_i]
+    # the index keeps the uids in the order of random.seed(42); random.shuffle
+    if not os.path.exists(args.index_path):
+        print("Building the object index")
+        build_index(args.index_path, objaverse._load_object_paths(), seed=42)
+    object_paths = dict(ObjectIndex(args.index_path).slice(args.start_i, args.end_i))
+    uids = list(object_paths)
 
     # get the uids that have already been downloaded
     if args.skip_completed:
-        completed_uids = get_completed_uids()
+        completed_uids = get_completed_uids(
+            num_views=args.num_views,
+            bucket=args.bucket,
+            endpoint_url=args.s3_endpoint_url,
+            snapshot_path=args.snapshot_path,
+            num_workers=args.listing_workers,
+        )
         uids = [uid for uid in uids if uid not in completed_uids]
 
-    uid_object_paths = [
+    uid_object_paths = (
         f"https://huggingface.co/datasets/allenai/objaverse/resolve/main/{object_paths[uid]}"
         for uid in uids
-    ]
+    )
 
-    with open("input_models_path.json", "w") as f:
-        json.dump(uid_object_paths, f, indent=2)
+    write_manifest(args.output_path, uid_object_paths)
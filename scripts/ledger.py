@@ -0,0 +1,152 @@
+"""Crash-safe record of the state of every object in a render run.
+
+The ledger is a SQLite database in WAL mode, so the main process, its download
+and upload threads and every render worker can write to it concurrently, and a
+crash or preemption loses at most the transaction in progress. Each object moves
+through the states
+
+    queued -> downloading -> rendering -> rendered -> uploaded
+
+or ends up as failed, as quarantined once it has failed too many times to be
+retried, or as duplicate when its contents were already rendered under another
+uid. The ledger also keeps each object's number of render attempts, the time
+spent downloading, rendering and uploading it, and the render policy the renderer
+applied to it. Objects stay in the downloading state from the start of their
+download until a worker picks them up. On restart, only the objects that have
+not reached the finished state and are not quarantined are run again, and since
+the state column is indexed they are found in time proportional to the number of
+pending objects.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from prefetch import get_uid
+
+STATES = (
+    "queued",
+    "downloading",
+    "rendering",
+    "rendered",
+    "uploaded",
+    "failed",
+    "quarantined",
+    "duplicate",
+)
+TIMING_COLUMNS = ("download_seconds", "render_seconds", "upload_seconds")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    uid TEXT PRIMARY KEY,
+    object_path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at REAL,
+    updated_at REAL,
+    download_seconds REAL,
+    render_seconds REAL,
+    upload_seconds REAL,
+    render_info TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+# columns added after the first version of the schema, for older ledgers
+ADDED_COLUMNS = {"render_info": "TEXT"}
+
+
+class Ledger:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared across threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def is_empty(self) -> bool:
+        cursor = self._connection().execute("SELECT 1 FROM jobs LIMIT 1")
+        return cursor.fetchone() is None
+
+    def add(self, object_paths: Iterable[str]) -> None:
+        """Adds objects in the queued state, leaving existing ones untouched."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs"
+                " (uid, object_path, state, queued_at, updated_at)"
+                " VALUES (?, ?, 'queued', ?, ?)",
+                ((get_uid(p), p, now, now) for p in object_paths),
+            )
+
+    def pending(self, finished_state: str = "uploaded") -> List[str]:
+        """Returns the object paths of every object that has not finished."""
+        unfinished = STATES[: STATES.index(finished_state)] + ("failed",)
+        placeholders = ", ".join("?" for _ in unfinished)
+        cursor = self._connection().execute(
+            f"SELECT object_path FROM jobs WHERE state IN ({placeholders})", unfinished
+        )
+        return [object_path for (object_path,) in cursor]
+
+    def render_seconds(self) -> Dict[str, float]:
+        """Returns the recorded render time of every object that has one."""
+        cursor = self._connection().execute(
+            "SELECT uid, render_seconds FROM jobs WHERE render_seconds IS NOT NULL"
+        )
+        return dict(cursor.fetchall())
+
+    def set_state(
+        self,
+        uid: str,
+        state: str,
+        error: Optional[str] = None,
+        render_info: Optional[Any] = None,
+        **seconds: float,
+    ) -> None:
+        """Moves an object to a new state.
+
+        Entering the rendering state counts as an attempt. Stage timings can be
+        recorded at the same time, e.g. `render_seconds=12.3`, and so can the
+        information the renderer returned about the object.
+        """
+        assert state in STATES, state
+        columns = ["state = ?", "error = ?", "updated_at = ?"]
+        values = [state, error, time.time()]
+        if state == "rendering":
+            columns.append("attempts = attempts + 1")
+        if render_info is not None:
+            columns.append("render_info = ?")
+            values.append(json.dumps(render_info))
+        for column, value in seconds.items():
+            assert column in TIMING_COLUMNS, column
+            columns.append(f"{column} = ?")
+            values.append(value)
+        self._connection().execute(
+            f"UPDATE jobs SET {', '.join(columns)} WHERE uid = ?", values + [uid]
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of objects in each state."""
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+        )
+        return dict(rows.fetchall())
@@ -0,0 +1,150 @@
+"""Reading and writing manifests of object paths without holding them in memory.
+
+A manifest is a list of object paths or URLs, stored as any of:
+
+- a JSON array (`.json`), as written by download_objaverse.py,
+- JSON lines (`.jsonl`), with one path per line, either as a JSON string or
+  as-is,
+- either of the above compressed with gzip (`.json.gz`, `.jsonl.gz`).
+
+Both formats are read incrementally, so the first objects can be rendered
+while the rest of the manifest has not been read yet, and memory use does not
+grow with the size of the manifest.
+"""
+
+import gzip
+import json
+import os
+import re
+from typing import IO, Any, Iterable, Iterator, Optional
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+COMMA = re.compile(r"[ \t\n\r]*,[ \t\n\r]*")
+NUMBER_START = "-0123456789"
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+def _open(path: str, mode: str, compressed: Optional[bool] = None) -> IO[str]:
+    if compressed is None:
+        compressed = path.endswith(".gz")
+    if compressed:
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def _is_jsonl(path: str) -> bool:
+    return path.removesuffix(".gz").endswith(".jsonl")
+
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator:
+    """Yields the values of a JSON array one at a time, reading f in chunks.
+
+    The values are decoded in place from an offset into the buffer, which is
+    only compacted once most of it has been consumed. A value that ends at the
+    end of the buffer, or a number followed by what could still be part of it, is
+    decoded again once the next chunk has been read, since a number there may
+    continue in that chunk.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    # what comes next: "[" opens the array, "first" is its first value or "]",
+    # "value" a value after a comma and "," a comma or "]"
+    expect = "["
+
+    def refill() -> None:
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        if pos > len(buffer) // 2:
+            buffer, pos = buffer[pos:], 0
+        buffer += chunk
+
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise json.JSONDecodeError("Unterminated array", buffer, pos)
+            refill()
+            continue
+        char = buffer[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("The manifest is not a JSON array")
+            pos += 1
+            expect = "first"
+            continue
+        if char == "]" and expect in ("first", ","):
+            return
+        if expect == ",":
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            pos += 1
+            expect = "value"
+            continue
+        # decode the values that are already in the buffer one after the other
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if eof:
+                    raise
+                refill()
+                break
+            # a number cut off by the end of the buffer decodes as a shorter one
+            cut = end == len(buffer) or (
+                buffer[pos] in NUMBER_START and buffer[end] in NUMBER_CHARS
+            )
+            if cut and not eof:
+                refill()
+                break
+            yield value
+            match = COMMA.match(buffer, end)
+            if match is None or match.end() == len(buffer):
+                pos = end
+                expect = ","
+                break
+            pos = match.end()
+            expect = "value"
+
+
+def iter_manifest(path: str) -> Iterator[str]:
+    """Yields the object paths of a manifest one at a time."""
+    with _open(path, "r") as f:
+        if not _is_jsonl(path):
+            yield from iter_json_array(f)
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line) if line.startswith('"') else line
+
+
+def write_manifest(path: str, object_paths: Iterable[str]) -> None:
+    """Writes a manifest in the format given by the extension of path."""
+    tmp_path = path + ".tmp"
+    with _open(tmp_path, "w", compressed=path.endswith(".gz")) as f:
+        if _is_jsonl(path):
+            for object_path in object_paths:
+                f.write(json.dumps(object_path) + "\n")
+        else:
+            json.dump(list(object_paths), f, indent=2)
+    os.rename(tmp_path, path)
+
+
+class CountingIterator:
+    """Counts the items that have been taken from an iterable so far."""
+
+    def __init__(self, items: Iterable[Any]) -> None:
+        self.items = items
+        self.count = 0
+        self.exhausted = False
+
+    def __iter__(self) -> Iterator[Any]:
+        for item in self.items:
+            self.count += 1
+            yield item
+        self.exhausted = True
@@ -0,0 +1,307 @@
+"""In-process metrics of a render run, served in the Prometheus text format.
+
+The MetricsRegistry holds counters, gauges and histograms, each with any number
+of label combinations, e.g. `render_attempts_total{gpu="0",status="failed"}`.
+The download and upload threads update it directly. The render workers are
+forked processes, so the registry remembers the pid it was created in and any
+update made in another process is sent to it over a multiprocessing queue, and
+applied by a thread in the main process. Gauges such as queue depths can also be
+given as functions, which are read every time the metrics are collected.
+
+MetricsServer serves the registry at `http://host:port/metrics` for Prometheus
+or curl, and WandbExporter logs it to wandb at an interval, along with the rate
+of every counter. Neither depends on anything outside of the standard library,
+except for wandb itself, which is only imported by the exporter.
+"""
+
+import bisect
+import http.server
+import math
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# seconds, from a cache hit to a render that times out
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ""
+    escaped = (
+        key + '="' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped).replace("\n", "\\n") + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.types: Dict[str, str] = {}
+        self.help: Dict[str, str] = {}
+        self.buckets: Dict[str, Sequence[float]] = {}
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.functions: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+        # updates from the forked render workers
+        self.remote: multiprocessing.Queue = multiprocessing.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def _declare(self, name: str, metric_type: str, help: str) -> None:
+        self.types[name] = metric_type
+        self.help[name] = help
+
+    def counter(self, name: str, help: str) -> None:
+        self._declare(name, "counter", help)
+        self.values[name] = {}
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        function: Optional[Callable[[], float]] = None,
+        **labels: object,
+    ) -> None:
+        """Declares a gauge, optionally with a function that returns its value
+        for the labels. A gauge can have several functions with different labels.
+        """
+        if name not in self.types:
+            self._declare(name, "gauge", help)
+            self.values[name] = {}
+            self.functions[name] = {}
+        if function is not None:
+            self.functions[name][_labels(labels)] = function
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self._declare(name, "histogram", help)
+        self.buckets[name] = buckets
+        self.histograms[name] = {}
+
+    def start(self) -> None:
+        """Starts applying the updates made by other processes."""
+        self.thread = threading.Thread(target=self._apply_remote, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Applies the remaining updates of other processes and stops."""
+        self.remote.put(None)
+        self.thread.join()
+
+    def _apply_remote(self) -> None:
+        while True:
+            update = self.remote.get()
+            if update is None:
+                break
+            self._apply(*update)
+
+    def _update(self, op: str, name: str, value: float, labels: Labels) -> None:
+        if os.getpid() == self.pid:
+            self._apply(op, name, value, labels)
+        else:
+            self.remote.put((op, name, value, labels))
+
+    def _apply(self, op: str, name: str, value: float, labels: Labels) -> None:
+        with self.lock:
+            if op == "observe":
+                histograms = self.histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(self.buckets[name])
+                histograms[labels].observe(value)
+            elif op == "inc":
+                self.values[name][labels] = self.values[name].get(labels, 0) + value
+            else:
+                self.values[name][labels] = value
+
+    def inc(self, name: str, value: float = 1, **labels: object) -> None:
+        self._update("inc", name, value, _labels(labels))
+
+    def set(self, name: str, value: float, **labels: object) -> None:
+        self._update("set", name, value, _labels(labels))
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        self._update("observe", name, value, _labels(labels))
+
+    def _gauge_values(self, name: str) -> Dict[Labels, float]:
+        values = dict(self.values[name])
+        for labels, function in self.functions[name].items():
+            try:
+                values[labels] = function()
+            except Exception:
+                # e.g. queue sizes are not available on every platform
+                pass
+        return values
+
+    def collect(self) -> Dict[str, Dict[str, float]]:
+        """Returns the current value of every sample, by metric and labels.
+
+        Histograms are reduced to their count and sum.
+        """
+        samples: Dict[str, Dict[str, float]] = {}
+        with self.lock:
+            for name, metric_type in self.types.items():
+                if metric_type == "histogram":
+                    for suffix in ("count", "sum"):
+                        samples[f"{name}_{suffix}"] = {
+                            _format_labels(labels): getattr(histogram, suffix)
+                            for labels, histogram in self.histograms[name].items()
+                        }
+                else:
+                    values = (
+                        self._gauge_values(name)
+                        if metric_type == "gauge"
+                        else self.values[name]
+                    )
+                    samples[name] = {
+                        _format_labels(labels): value
+                        for labels, value in values.items()
+                    }
+        return samples
+
+    def exposition(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self.lock:
+            for name, metric_type in self.types.items():
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if metric_type != "histogram":
+                    values = (
+                        self._gauge_values(name)
+                        if metric_type == "gauge"
+                        else self.values[name]
+                    )
+                    for labels, value in sorted(values.items()):
+                        lines.append(
+                            f"{name}{_format_labels(labels)} {_format_value(value)}"
+                        )
+                    continue
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    bounds = histogram.buckets + [math.inf]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        le = _format_labels(labels, ("le", _format_value(bound)))
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    formatted = _format_labels(labels)
+                    lines.append(f"{name}_sum{formatted} {histogram.sum!r}")
+                    lines.append(f"{name}_count{formatted} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves a registry over HTTP from a background thread."""
+
+    def __init__(
+        self, registry: MetricsRegistry, port: int, host: str = "0.0.0.0"
+    ) -> None:
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class WandbExporter:
+    """Logs every sample of a registry to wandb at an interval.
+
+    A sample is logged as `name/labels`, and every counter also as
+    `name/labels/rate`, its increase per second since the previous log.
+    """
+
+    def __init__(self, registry: MetricsRegistry, interval: float = 5) -> None:
+        self.registry = registry
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.previous: Dict[str, float] = {}
+        self.previous_time = time.time()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._log_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Logs the metrics one last time and stops."""
+        self.stopped.set()
+        self.thread.join()
+
+    def _log_loop(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.log()
+        self.log()
+
+    def log(self) -> None:
+        import wandb
+
+        now = time.time()
+        elapsed = max(now - self.previous_time, 1e-9)
+        data: Dict[str, float] = {}
+        for name, samples in self.registry.collect().items():
+            for labels, value in samples.items():
+                key = name
+                if labels:
+                    key += "/" + labels[1:-1].replace('"', "")
+                data[key] = value
+                if self.registry.types.get(name) == "counter":
+                    rate = (value - self.previous.get(key, 0)) / elapsed
+                    data[f"{key}/rate"] = rate
+                    self.previous[key] = value
+        self.previous_time = now
+        wandb.log(data)
@@ -0,0 +1,171 @@
+"""Node-local cache of downloaded objects shared by every process on the machine.
+
+Objects are stored by the sha256 of their contents in `blobs/`, and `uids/{uid}`
+records which blob a uid resolves to, so uids with byte-identical files share a
+single blob. Every change to the cache happens under an exclusive `flock` on
+`cache.lock` and every file is written to a temporary name and then renamed into
+place, so concurrent processes never see partial files. Striped per-uid locks keep
+two processes from downloading the same object at the same time.
+
+When the blobs grow past `max_bytes`, the least recently used ones are evicted.
+Objects are handed out as hard links, so evicting a blob never breaks a render
+that is already using it.
+
+Hit, miss and eviction counts are kept in `stats.json` across all processes.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zlib
+from typing import Callable, Dict, Iterator, Optional
+
+NUM_UID_LOCKS = 256
+
+
+def file_sha256(path: str) -> str:
+    """Returns the sha256 hex digest of a file's contents."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard links src to dst, copying it if they are on different filesystems."""
+    tmp_dst = dst + ".tmp"
+    if os.path.exists(tmp_dst):
+        os.remove(tmp_dst)
+    try:
+        os.link(src, tmp_dst)
+    except OSError:
+        shutil.copyfile(src, tmp_dst)
+    os.rename(tmp_dst, dst)
+
+
+class ObjectCache:
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        for d in ["blobs", "uids", "locks", "tmp"]:
+            os.makedirs(os.path.join(cache_dir, d), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self, name: str = "cache") -> Iterator[None]:
+        if name == "cache":
+            lock_path = os.path.join(self.cache_dir, "cache.lock")
+        else:
+            lock_path = os.path.join(self.cache_dir, "locks", f"{name}.lock")
+        with open(lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path: str, data: str) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def _update_stats(self, **increments: int) -> None:
+        # must be called with the cache lock held
+        stats = self.stats()
+        for key, value in increments.items():
+            stats[key] = stats.get(key, 0) + value
+        stats_path = os.path.join(self.cache_dir, "stats.json")
+        self._write_atomic(stats_path, json.dumps(stats))
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counts of the cache."""
+        try:
+            with open(os.path.join(self.cache_dir, "stats.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+
+    def _lookup(self, uid: str) -> Optional[str]:
+        # must be called with the cache lock held
+        entry_path = os.path.join(self.cache_dir, "uids", uid)
+        try:
+            with open(entry_path, "r") as f:
+                blob_path = os.path.join(self.cache_dir, "blobs", f.read().strip())
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(blob_path):
+            # the blob was evicted
+            os.remove(entry_path)
+            return None
+        # mark the blob as recently used
+        os.utime(blob_path)
+        return blob_path
+
+    def _evict(self, keep: str) -> None:
+        # must be called with the cache lock held
+        blobs_dir = os.path.join(self.cache_dir, "blobs")
+        blobs = []
+        total = 0
+        for entry in os.scandir(blobs_dir):
+            stat = entry.stat()
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        evictions = 0
+        evicted_bytes = 0
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            evictions += 1
+            evicted_bytes += size
+        if evictions:
+            self._update_stats(evictions=evictions, evicted_bytes=evicted_bytes)
+
+    def fetch(
+        self, uid: str, extension: str, download_fn: Callable[[str], None], dst: str
+    ) -> bool:
+        """Puts the object with the given uid at dst, downloading it on a miss.
+
+        download_fn is called with the path the object should be written to.
+        Returns whether the object was already in the cache.
+        """
+        with self._lock(f"uid-{zlib.crc32(uid.encode()) % NUM_UID_LOCKS}"):
+            with self._lock():
+                blob_path = self._lookup(uid)
+                if blob_path is not None:
+                    link_or_copy(blob_path, dst)
+                    self._update_stats(hits=1)
+                    return True
+
+            tmp_path = os.path.join(
+                self.cache_dir, "tmp", f"{uid}.{os.getpid()}.{threading.get_ident()}"
+            )
+            try:
+                download_fn(tmp_path)
+                blob_name = file_sha256(tmp_path) + extension
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            with self._lock():
+                blob_path = os.path.join(self.cache_dir, "blobs", blob_name)
+                if os.path.exists(blob_path):
+                    # another uid has the same contents
+                    os.remove(tmp_path)
+                    os.utime(blob_path)
+                else:
+                    os.rename(tmp_path, blob_path)
+                self._write_atomic(os.path.join(self.cache_dir, "uids", uid), blob_name)
+                link_or_copy(blob_path, dst)
+                self._update_stats(misses=1)
+                self._evict(keep=blob_path)
+            return False
@@ -0,0 +1,98 @@
+"""Compact, memory-mapped index of the Objaverse object paths.
+
+`objaverse._load_object_paths()` parses an 800k entry JSON file into a dict on
+every call, only for download_objaverse.py to take a slice of the shuffled uids.
+The index is built from that dict once and stores the uids in the order of
+`random.seed(42); random.shuffle(uids)`, so the same `start_i:end_i` slice
+selects exactly the same objects as before. Opening the index maps the file,
+and reading a slice only touches the records in the slice.
+
+The file is laid out as
+
+    header    magic, seed and number of objects n
+    uids      n fixed-width uids, in shuffled order
+    offsets   n + 1 uint64 offsets of the paths in the path blob, in shuffled order
+    sorted    n uint32 positions of the uids, in sorted uid order
+    paths     the UTF-8 encoded paths, back to back
+
+and the sorted positions allow looking up the path of a uid by binary search.
+"""
+
+import mmap
+import os
+import random
+import struct
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = b"OBJIDX01"
+HEADER = struct.Struct("<8sqQI")
+UID_BYTES = 32
+
+
+def build_index(path: str, object_paths: Dict[str, str], seed: int = 42) -> None:
+    """Writes the index of object_paths, shuffling the uids with the seed."""
+    uids = list(object_paths.keys())
+    random.Random(seed).shuffle(uids)
+    encoded_uids = [uid.encode() for uid in uids]
+    if any(len(uid) != UID_BYTES for uid in encoded_uids):
+        raise ValueError(f"Every uid must be {UID_BYTES} characters long")
+    encoded_paths = [object_paths[uid].encode() for uid in uids]
+    offsets = [0]
+    for encoded_path in encoded_paths:
+        offsets.append(offsets[-1] + len(encoded_path))
+    sorted_positions = sorted(range(len(uids)), key=lambda i: uids[i])
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, seed, len(uids), UID_BYTES))
+        f.write(b"".join(encoded_uids))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(struct.pack(f"<{len(sorted_positions)}I", *sorted_positions))
+        f.write(b"".join(encoded_paths))
+    os.rename(path + ".tmp", path)
+
+
+class ObjectIndex:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.seed, self.num_objects, uid_bytes = HEADER.unpack_from(
+            self.buffer, 0
+        )
+        if magic != MAGIC or uid_bytes != UID_BYTES:
+            raise ValueError(f"{path} is not an object index")
+        n = self.num_objects
+        self.uids_start = HEADER.size
+        self.offsets_start = self.uids_start + n * UID_BYTES
+        self.sorted_start = self.offsets_start + (n + 1) * 8
+        self.paths_start = self.sorted_start + n * 4
+
+    def __len__(self) -> int:
+        return self.num_objects
+
+    def uid(self, i: int) -> str:
+        start = self.uids_start + i * UID_BYTES
+        return self.buffer[start : start + UID_BYTES].decode()
+
+    def path(self, i: int) -> str:
+        start, end = struct.unpack_from("<2Q", self.buffer, self.offsets_start + i * 8)
+        return self.buffer[self.paths_start + start : self.paths_start + end].decode()
+
+    def slice(self, start: int, end: int) -> List[Tuple[str, str]]:
+        """Returns the uids and paths of the shuffled objects start to end."""
+        start, end, _ = slice(start, end).indices(self.num_objects)
+        return [(self.uid(i), self.path(i)) for i in range(start, end)]
+
+    def lookup(self, uid: str) -> Optional[str]:
+        """Returns the path of a uid, or None if it is not in the index."""
+        lo, hi = 0, self.num_objects
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (i,) = struct.unpack_from("<I", self.buffer, self.sorted_start + mid * 4)
+            mid_uid = self.uid(i)
+            if mid_uid == uid:
+                return self.path(i)
+            if mid_uid < uid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
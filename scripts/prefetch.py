@@ -0,0 +1,245 @@
+"""Downloads objects ahead of the render workers.
+
+The render workers only ever see local paths. A pool of download threads fetches
+remote objects into the download directory and puts their local paths on the
+render queue. Since the render queue is bounded, the downloads can only get
+`maxsize` objects ahead of the renders, and downloads also wait while the download
+directory is over its disk budget. Workers delete the downloaded files once they
+have rendered them, which frees up the budget again.
+
+With a dedup index, every object is claimed in the index before it is handed on,
+and objects whose contents were already claimed by another uid are handed to
+on_duplicate as aliases instead, so they never take up a render worker.
+"""
+
+import os
+import queue
+import shutil
+import threading
+import time
+import urllib.request
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Tuple
+
+from object_cache import ObjectCache
+from spans import SpanWriter
+
+if TYPE_CHECKING:
+    from dedup import Alias, DedupIndex
+    from ledger import Ledger
+    from metrics import MetricsRegistry
+
+
+def get_uid(object_path: str) -> str:
+    """Returns the uid of an object from its url or local path."""
+    return os.path.basename(object_path).split(".")[0]
+
+
+def directory_size(path: str) -> int:
+    """Returns the total size in bytes of the files directly inside a directory."""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+                except FileNotFoundError:
+                    # deleted by a worker while we were scanning
+                    pass
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def download_url(url: str, local_path: str, timeout: float = 60) -> None:
+    """Downloads a url to a temporary file and renames it to local_path."""
+    tmp_local_path = local_path + ".tmp"
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            with open(tmp_local_path, "wb") as f:
+                shutil.copyfileobj(response, f)
+    except Exception:
+        if os.path.exists(tmp_local_path):
+            os.remove(tmp_local_path)
+        raise
+    os.rename(tmp_local_path, local_path)
+
+
+def download_object(
+    object_url: str, download_dir: str, cache: Optional[ObjectCache] = None
+) -> Tuple[str, Optional[bool]]:
+    """Download the object, going through the cache if given.
+
+    Returns the path and whether the object was in the cache.
+    """
+    uid = get_uid(object_url)
+    extension = os.path.splitext(object_url.split("?")[0])[1] or ".glb"
+    local_path = os.path.join(download_dir, f"{uid}{extension}")
+    os.makedirs(download_dir, exist_ok=True)
+    cache_hit = None
+    if cache is None:
+        download_url(object_url, local_path)
+    else:
+        cache_hit = cache.fetch(
+            uid, extension, lambda path: download_url(object_url, path), local_path
+        )
+    return os.path.abspath(local_path), cache_hit
+
+
+def fetch_object(
+    item: str,
+    download_dir: str,
+    cache: Optional[ObjectCache] = None,
+    ledger: Optional["Ledger"] = None,
+    spans: Optional[SpanWriter] = None,
+    metrics: Optional["MetricsRegistry"] = None,
+) -> str:
+    """Returns a local path of the object, downloading it if it is remote.
+
+    The download and its failures are recorded in the ledger, spans and metrics
+    the same way for the prefetcher and for objects fetched outside of it.
+    """
+    if not item.startswith("http"):
+        return item
+    uid = get_uid(item)
+    if ledger is not None:
+        ledger.set_state(uid, "downloading")
+    start = time.time()
+    try:
+        local_path, cache_hit = download_object(item, download_dir, cache)
+    except Exception as e:
+        if ledger is not None:
+            ledger.set_state(uid, "failed", error=repr(e))
+        if metrics is not None:
+            metrics.inc("download_failures_total")
+        raise
+    if ledger is not None:
+        ledger.set_state(uid, "downloading", download_seconds=time.time() - start)
+    if metrics is not None:
+        metrics.observe("download_seconds", time.time() - start)
+    if spans is not None:
+        span = {
+            "uid": uid,
+            "stage": "download",
+            "start": start,
+            "duration": time.time() - start,
+            "size_bytes": os.path.getsize(local_path),
+            "cache_hit": cache_hit,
+        }
+        spans.write([span])
+    return local_path
+
+
+class Prefetcher:
+    """Downloads objects with a pool of threads and hands their local paths on."""
+
+    def __init__(
+        self,
+        render_queue,
+        download_dir: str = "tmp-objects",
+        num_workers: int = 8,
+        max_disk_bytes: Optional[int] = None,
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+        cache: Optional[ObjectCache] = None,
+        ledger: Optional["Ledger"] = None,
+        spans: Optional[SpanWriter] = None,
+        dedup: Optional["DedupIndex"] = None,
+        on_duplicate: Optional[Callable[["Alias"], None]] = None,
+        metrics: Optional["MetricsRegistry"] = None,
+    ) -> None:
+        self.render_queue = render_queue
+        self.download_dir = download_dir
+        self.num_workers = num_workers
+        self.max_disk_bytes = max_disk_bytes
+        self.on_error = on_error
+        self.cache = cache
+        self.ledger = ledger
+        self.spans = spans
+        self.dedup = dedup
+        self.on_duplicate = on_duplicate
+        self.pending: queue.Queue = queue.Queue(maxsize=num_workers)
+        self.threads: List[threading.Thread] = []
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.histogram("download_seconds", "Time to download an object")
+            metrics.counter(
+                "download_failures_total", "Objects that failed to download"
+            )
+            metrics.counter("duplicates_total", "Objects skipped as duplicates")
+            metrics.gauge(
+                "queue_depth",
+                "Objects waiting for each stage",
+                self.pending.qsize,
+                stage="download",
+            )
+
+    def start(self, items: Iterable[str]) -> None:
+        """Starts downloading the items in the background."""
+        feeder = threading.Thread(target=self._feed, args=(items,), daemon=True)
+        self.threads.append(feeder)
+        for _ in range(self.num_workers):
+            thread = threading.Thread(target=self._download_loop, daemon=True)
+            self.threads.append(thread)
+        for thread in self.threads:
+            thread.start()
+
+    def join(self) -> None:
+        """Waits until every item has been handed to the render queue."""
+        for thread in self.threads:
+            thread.join()
+
+    def _feed(self, items: Iterable[str]) -> None:
+        for item in items:
+            self.pending.put(item)
+        for _ in range(self.num_workers):
+            self.pending.put(None)
+
+    def _wait_for_disk_budget(self) -> None:
+        # the budget is soft since downloads that have already started may still
+        # push the directory over it
+        if self.max_disk_bytes is None:
+            return
+        while directory_size(self.download_dir) >= self.max_disk_bytes:
+            time.sleep(0.5)
+
+    def _download_loop(self) -> None:
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            if item.startswith("http"):
+                self._wait_for_disk_budget()
+            try:
+                local_path = fetch_object(
+                    item,
+                    self.download_dir,
+                    self.cache,
+                    self.ledger,
+                    self.spans,
+                    self.metrics,
+                )
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(item, e)
+                continue
+            self._hand_on(item, local_path)
+
+    def _hand_on(self, item: str, local_path: str) -> None:
+        """Puts an object on the render queue, unless it is a duplicate."""
+        if self.dedup is not None:
+            uid = get_uid(item)
+            try:
+                alias = self.dedup.claim(uid, local_path, item)
+            except Exception as e:
+                # an unreadable object is left for the renderer to fail on
+                print(f"Could not check {uid} for duplicates: {e!r}")
+                alias = None
+            if alias is not None:
+                if local_path != item:
+                    os.remove(local_path)
+                if self.metrics is not None:
+                    self.metrics.inc("duplicates_total")
+                if self.on_duplicate is not None:
+                    self.on_duplicate(alias)
+                return
+        self.render_queue.put(local_path)
@@ -0,0 +1,327 @@
+"""Long-lived render processes that take object paths over a local socket.
+
+Starting Blender, initializing its Python interpreter and building the default
+scene costs about as much as rendering a small Objaverse object. Instead of
+launching Blender once per object, each worker keeps one Blender process alive
+that imports blender_script.py once and then renders objects on request.
+
+The child process listens on a Unix socket passed with --server_address and the
+parent connects to it with the authkey from the RENDER_SERVER_AUTHKEY
+environment variable. Each request is a dict with an "object_path" key and each
+response is a dict with "object_path", "success", "error", "duration" and "info",
+whatever the render function returned. A None request shuts the child down.
+
+Each render can be given a wall-clock and a memory limit. A render that goes over
+either has the whole process group of the child killed and is reported as a
+failure, and the next render starts a fresh process.
+
+Running this file directly starts a fake renderer that speaks the same protocol
+without Blender, which is useful for testing the orchestration. Besides failing
+at random, it can be told to hang or crash on a fixed fraction of the objects:
+
+    python scripts/render_server.py --server_address /tmp/render.sock --latency 0.5
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+from shards import pack_record
+from spans import SpanRecorder
+
+AUTHKEY_ENV = "RENDER_SERVER_AUTHKEY"
+
+
+def serve(address: str, render_fn: Callable[[str], Any]) -> None:
+    """Renders objects sent by the parent until a None request is received."""
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        with listener.accept() as conn:
+            while True:
+                request = conn.recv()
+                if request is None:
+                    break
+                start = time.time()
+                try:
+                    info = render_fn(request["object_path"])
+                    result = {"success": True, "error": None, "info": info}
+                except Exception as e:
+                    traceback.print_exc()
+                    result = {
+                        "success": False,
+                        "error": f"{type(e).__name__}: {e}",
+                        "info": None,
+                    }
+                result["object_path"] = request["object_path"]
+                result["duration"] = time.time() - start
+                conn.send(result)
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """Returns the resident set size of a process in MB, if it can be read."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RenderServer:
+    """Parent-side handle to a persistent render process.
+
+    The process is started lazily on the first render and recycled after
+    `max_objects` renders or once its resident memory exceeds `max_memory_mb`.
+    It is killed if a single render takes longer than `timeout` seconds or its
+    resident memory exceeds `kill_memory_mb`.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        env: Optional[Dict[str, str]] = None,
+        max_objects: int = 100,
+        max_memory_mb: Optional[float] = None,
+        startup_timeout: float = 120,
+        timeout: Optional[float] = None,
+        kill_memory_mb: Optional[float] = None,
+    ) -> None:
+        self.command = command
+        self.env = env
+        self.max_objects = max_objects
+        self.max_memory_mb = max_memory_mb
+        self.startup_timeout = startup_timeout
+        self.timeout = timeout
+        self.kill_memory_mb = kill_memory_mb
+        self.process: Optional[subprocess.Popen] = None
+        self.conn = None
+        self.num_rendered = 0
+        self.tmp_dir: Optional[str] = None
+
+    def start(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(prefix="render-server-")
+        address = os.path.join(self.tmp_dir, "render.sock")
+        authkey = os.urandom(32)
+        env = dict(os.environ if self.env is None else self.env)
+        env[AUTHKEY_ENV] = authkey.hex()
+        # start a new session so that the whole process group can be killed
+        try:
+            self.process = subprocess.Popen(
+                self.command + ["--server_address", address],
+                env=env,
+                start_new_session=True,
+            )
+        except OSError:
+            self.close()
+            raise
+        # wait for the child to finish starting up and listen on the socket
+        deadline = time.time() + self.startup_timeout
+        while not os.path.exists(address):
+            returncode = self.process.poll()
+            if returncode is not None:
+                self.close()
+                raise RuntimeError(
+                    f"Render server exited with code {returncode}"
+                    " before it started listening"
+                )
+            if time.time() > deadline:
+                self.kill()
+                raise RuntimeError("Timed out waiting for the render server to start")
+            time.sleep(0.1)
+        try:
+            self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        except (OSError, EOFError, AuthenticationError):
+            self.kill()
+            raise
+        self.num_rendered = 0
+
+    def render(self, object_path: str) -> Dict[str, Any]:
+        """Renders a single object, starting or recycling the process as needed.
+
+        Failing to start the process or to send it the object is reported as a
+        failed render like any other, so that the caller can retry it.
+        """
+        start = time.time()
+        try:
+            if self.process is None:
+                self.start()
+            self.conn.send({"object_path": object_path})
+        except (OSError, EOFError, RuntimeError, AuthenticationError) as e:
+            self.kill()
+            return {
+                "object_path": object_path,
+                "success": False,
+                "error": f"Failed to start the render server: {e}",
+                "duration": time.time() - start,
+                "info": None,
+            }
+        while True:
+            error = None
+            try:
+                if self.conn.poll(1.0):
+                    result = self.conn.recv()
+                    break
+            except (EOFError, OSError):
+                # the process closed the socket on its way out
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    pass
+            rss = process_rss_mb(self.process.pid)
+            if self.process.poll() is not None:
+                error = f"Render server exited with code {self.process.poll()}"
+            elif self.timeout is not None and time.time() - start > self.timeout:
+                error = f"Timed out after {self.timeout} seconds"
+            elif self.kill_memory_mb is not None and rss is not None:
+                if rss > self.kill_memory_mb:
+                    error = f"Exceeded {self.kill_memory_mb} MB with {rss:.0f} MB"
+            if error is not None:
+                self.kill()
+                return {
+                    "object_path": object_path,
+                    "success": False,
+                    "error": error,
+                    "duration": time.time() - start,
+                    "info": None,
+                }
+        self.num_rendered += 1
+        if self.should_recycle():
+            self.close()
+        return result
+
+    def should_recycle(self) -> bool:
+        if self.num_rendered >= self.max_objects:
+            return True
+        if self.max_memory_mb is not None:
+            rss = process_rss_mb(self.process.pid)
+            if rss is not None and rss > self.max_memory_mb:
+                return True
+        return False
+
+    def close(self) -> None:
+        """Asks the process to exit, killing it if it does not."""
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.kill()
+            self.process = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+    def kill(self) -> None:
+        """Kills the process group of the process without waiting for it."""
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+            self.process = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.close()
+
+
+def fake_render(
+    object_path: str,
+    output_dir: str,
+    num_images: int,
+    latency: float,
+    failure_rate: float,
+    output_format: str = "png",
+    hang_rate: float = 0.0,
+    crash_rate: float = 0.0,
+    latency_sigma: float = 0.0,
+    seconds_per_mb: float = 0.0,
+) -> Dict[str, Any]:
+    """Stands in for Blender by sleeping and writing empty views.
+
+    The render time is log-normally distributed around `latency` with a spread of
+    `latency_sigma`, plus `seconds_per_mb` for every MB of the object. Failures
+    happen at random, while hangs and crashes always hit the same objects, like
+    poison objects would.
+    """
+    object_uid = os.path.basename(object_path).split(".")[0]
+    size_mb = os.path.getsize(object_path) / 1024**2
+    recorder = SpanRecorder(uid=object_uid)
+    with recorder.span("render"):
+        # keep the mean at latency whatever the spread
+        spread = random.lognormvariate(-(latency_sigma**2) / 2, latency_sigma)
+        time.sleep(latency * spread + seconds_per_mb * size_mb)
+    if random.random() < failure_rate:
+        raise RuntimeError(f"Fake render failure for {object_path}")
+    poison = random.Random(object_path).random()
+    if poison < hang_rate:
+        while True:
+            time.sleep(60)
+    if poison < hang_rate + crash_rate:
+        os._exit(1)
+    views_dir = os.path.join(output_dir, object_uid)
+    os.makedirs(views_dir, exist_ok=True)
+    for i in range(num_images):
+        with open(os.path.join(views_dir, f"{i:03d}.png"), "wb") as f:
+            f.write(b"")
+    if output_format == "tar":
+        with open(os.path.join(views_dir, "cameras.json"), "w") as f:
+            json.dump({"uid": object_uid, "views": []}, f)
+        pack_record(views_dir)
+    return {"spans": recorder.spans, "size_bytes": os.path.getsize(object_path)}
+
+
+def add_fake_render_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--output_dir", type=str, default="./views")
+    parser.add_argument("--num_images", type=int, default=12)
+    parser.add_argument("--output_format", type=str, default="png")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency_sigma", type=float, default=0.0)
+    parser.add_argument("--seconds_per_mb", type=float, default=0.0)
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--hang_rate", type=float, default=0.0)
+    parser.add_argument("--crash_rate", type=float, default=0.0)
+
+
+def fake_render_fn(args: argparse.Namespace) -> Callable[[str], Dict[str, Any]]:
+    """Returns a fake render function configured by the parsed arguments."""
+    return lambda object_path: fake_render(
+        object_path,
+        output_dir=args.output_dir,
+        num_images=args.num_images,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        output_format=args.output_format,
+        hang_rate=args.hang_rate,
+        crash_rate=args.crash_rate,
+        latency_sigma=args.latency_sigma,
+        seconds_per_mb=args.seconds_per_mb,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server_address", type=str, required=True)
+    add_fake_render_arguments(parser)
+    args = parser.parse_args()
+
+    serve(args.server_address, fake_render_fn(args))
@@ -0,0 +1,99 @@
+"""Cache of imported and normalized Blender scenes.
+
+Importing a large glTF is often the most expensive stage of rendering an object,
+and it is repeated every time an object is rendered again with a different
+camera, engine or number of views. blender_script.py can instead save the
+objects of the scene after import, simplification and normalization to
+`{key}.blend`, and later renders append them from there.
+
+The key is the sha256 of the object file and of the settings that change the
+imported scene (the Blender version, import options, simplification limits, ...),
+so changing any of them is a miss rather than a stale hit. `{key}.json` keeps
+the statistics recorded while the scene was built. Entries are written to a
+temporary name and renamed into place, and once the cache grows past max_bytes
+the least recently used entries are evicted under an exclusive flock.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from object_cache import file_sha256
+
+
+class SceneCache:
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        with open(os.path.join(self.cache_dir, "cache.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def key(self, object_path: str, settings: Dict[str, Any]) -> str:
+        """Returns the key of the scene of an object imported with settings."""
+        sha256 = hashlib.sha256(file_sha256(object_path).encode())
+        sha256.update(json.dumps(settings, sort_keys=True).encode())
+        return sha256.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Returns the path of the cached scene and its statistics, if any."""
+        blend_path = os.path.join(self.cache_dir, f"{key}.blend")
+        with self._lock():
+            try:
+                with open(os.path.join(self.cache_dir, f"{key}.json"), "r") as f:
+                    stats = json.load(f)
+                # mark the entry as recently used
+                os.utime(blend_path)
+            except FileNotFoundError:
+                return None
+        return blend_path, stats
+
+    def put(
+        self, key: str, write_blend: Callable[[str], None], stats: Dict[str, Any]
+    ) -> None:
+        """Adds a scene, written by write_blend to the path it is called with."""
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp.blend")
+        try:
+            write_blend(tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock():
+            os.rename(tmp_path, os.path.join(self.cache_dir, f"{key}.blend"))
+            # the statistics are written last, since they mark the entry complete
+            stats_path = os.path.join(self.cache_dir, f"{key}.json")
+            with open(stats_path + ".tmp", "w") as f:
+                json.dump(stats, f)
+            os.rename(stats_path + ".tmp", stats_path)
+            self._evict(keep=key)
+
+    def _evict(self, keep: str) -> None:
+        # must be called with the lock held
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".blend") or ".tmp" in entry.name:
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.name[: -len(".blend")]))
+            total += stat.st_size
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.cache_dir, f"{key}.json"))
+            os.remove(os.path.join(self.cache_dir, f"{key}.blend"))
+            total -= size
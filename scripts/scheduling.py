@@ -0,0 +1,135 @@
+"""Cost-aware ordering of the objects of a render run.
+
+The manifest is a random shuffle, so the most expensive objects land anywhere in
+the queue. One that starts near the end of a run keeps its GPU busy long after
+every other worker has run out of work. Ordering the objects longest first
+(the LPT rule) starts the expensive ones while there is still plenty of other
+work to balance them against.
+
+The cost of an object is estimated, in order of preference, from:
+
+- the render time recorded for it by an earlier run, in the spans file or the
+  ledger,
+- its size, using a linear fit of render time against size over the objects
+  that have both,
+- the median recorded render time, or 1 when nothing has been recorded.
+
+Objects sorted longest first already end with the cheapest ones, but an object
+whose cost is only guessed can be far more expensive than its guess, and must
+not start last. The cheapest objects whose cost is known are kept as a known
+tail after every object of unknown cost, so that they keep the other workers
+busy while a misestimated object finishes.
+"""
+
+import heapq
+import os
+import statistics
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prefetch import get_uid
+from spans import read_spans
+
+
+def recorded_costs(
+    spans_path: Optional[str] = None, ledger=None
+) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """Returns the recorded render seconds and sizes in bytes of objects by uid."""
+    seconds: Dict[str, List[float]] = defaultdict(list)
+    sizes: Dict[str, int] = {}
+    if spans_path is not None and os.path.exists(spans_path):
+        for span in read_spans(spans_path):
+            if "uid" not in span:
+                continue
+            if "size_bytes" in span:
+                sizes[span["uid"]] = span["size_bytes"]
+            if span["stage"] == "render_object" and span.get("success"):
+                seconds[span["uid"]].append(span["duration"])
+    costs = {uid: statistics.mean(d) for uid, d in seconds.items()}
+    if ledger is not None:
+        for uid, render_seconds in ledger.render_seconds().items():
+            costs.setdefault(uid, render_seconds)
+    return costs, sizes
+
+
+def fit_size_model(
+    costs: Dict[str, float], sizes: Dict[str, int]
+) -> Optional[Tuple[float, float]]:
+    """Fits render seconds = intercept + slope * bytes by least squares.
+
+    Returns None if fewer than two objects have both a cost and a size.
+    """
+    points = [(sizes[uid], cost) for uid, cost in costs.items() if uid in sizes]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.mean(x for x, _ in points)
+    mean_y = statistics.mean(y for _, y in points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    slope = max(slope, 0.0)
+    return mean_y - slope * mean_x, slope
+
+
+def estimate_costs(
+    object_paths: List[str], spans_path: Optional[str] = None, ledger=None
+) -> Tuple[List[float], List[bool]]:
+    """Returns the estimated render seconds of each object, and whether each
+    estimate is based on a recorded render time or a size rather than a guess."""
+    costs, sizes = recorded_costs(spans_path, ledger)
+    size_model = fit_size_model(costs, sizes)
+    default = statistics.median(costs.values()) if costs else 1.0
+
+    estimates = []
+    known = []
+    for path in object_paths:
+        uid = get_uid(path)
+        size = sizes.get(uid)
+        if size is None and os.path.exists(path):
+            size = os.path.getsize(path)
+        if uid in costs:
+            estimates.append(costs[uid])
+            known.append(True)
+        elif size is not None and size_model is not None:
+            intercept, slope = size_model
+            estimates.append(max(intercept + slope * size, 0.0))
+            known.append(True)
+        else:
+            estimates.append(default)
+            known.append(False)
+    return estimates, known
+
+
+def longest_first(
+    costs: List[float], known: List[bool], num_workers: int, known_tail: float = 1.0
+) -> List[int]:
+    """Returns the indices of the objects ordered longest first.
+
+    The cheapest known objects, adding up to known_tail times the cost of the
+    most expensive object per worker, are moved after every object of unknown
+    cost. At most half of the estimated work is moved.
+    """
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    if not order or known_tail <= 0:
+        return order
+    tail_cost = min(known_tail * num_workers * costs[order[0]], sum(costs) / 2)
+    tail = []
+    for i in reversed(order):
+        if not known[i]:
+            continue
+        if costs[i] > tail_cost:
+            break
+        tail_cost -= costs[i]
+        tail.append(i)
+    in_tail = set(tail)
+    return [i for i in order if i not in in_tail] + tail[::-1]
+
+
+def makespan(costs: Iterable[float], num_workers: int) -> float:
+    """Returns when the last object finishes if each object in turn is given to
+    the first worker to become free."""
+    workers = [0.0] * max(num_workers, 1)
+    for cost in costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return max(workers)
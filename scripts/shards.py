@@ -0,0 +1,107 @@
+"""Packs rendered objects into WebDataset-style tar shards.
+
+Uploading every view as its own file means one S3 PUT per image, and training
+readers then have to open millions of small files. Instead, an object's views and
+camera metadata can be packed into a single record, `{uid}.tar`, whose members
+are named `{uid}.000.png`, ..., `{uid}.json` following the WebDataset convention
+that files sharing a key belong to the same sample. The ShardWriter then appends
+records to size-bounded shards that can be uploaded with one PUT each and read
+back sequentially.
+"""
+
+import os
+import shutil
+import tarfile
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+def pack_record(views_dir: str) -> str:
+    """Packs the files of a `{output_dir}/{uid}` directory into `{uid}.tar`.
+
+    The directory is removed and the path of the record is returned.
+    """
+    views_dir = os.path.normpath(views_dir)
+    uid = os.path.basename(views_dir)
+    record_path = views_dir + ".tar"
+    with tarfile.open(record_path + ".tmp", "w") as tar:
+        for name in sorted(os.listdir(views_dir)):
+            arcname = f"{uid}.{name}"
+            if name == "cameras.json":
+                arcname = f"{uid}.json"
+            tar.add(os.path.join(views_dir, name), arcname=arcname)
+    os.rename(record_path + ".tmp", record_path)
+    shutil.rmtree(views_dir)
+    return record_path
+
+
+class ShardWriter:
+    """Appends object records to shards of roughly `max_shard_bytes` each.
+
+    `on_shard` is called with the path of every finished shard and the uids it
+    contains.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        max_shard_bytes: int,
+        on_shard: Optional[Callable[[str, List[str]], None]] = None,
+    ) -> None:
+        self.shard_dir = shard_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.on_shard = on_shard
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.num_shards = 0
+        self.tar: Optional[tarfile.TarFile] = None
+        self.shard_path: Optional[str] = None
+        self.uids: List[str] = []
+        self.thread: Optional[threading.Thread] = None
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def start(self, pack_queue) -> None:
+        """Starts adding the records put on the queue until None is put."""
+        self.thread = threading.Thread(
+            target=self._write_loop, args=(pack_queue,), daemon=True
+        )
+        self.thread.start()
+
+    def join(self) -> None:
+        """Waits for the queued records and closes the last shard."""
+        self.thread.join()
+
+    def _write_loop(self, pack_queue) -> None:
+        while True:
+            record_path = pack_queue.get()
+            if record_path is None:
+                break
+            self.add(record_path)
+        self.close()
+
+    def add(self, record_path: str) -> None:
+        """Appends the members of a record to the current shard."""
+        if self.tar is None:
+            self.shard_path = os.path.join(
+                self.shard_dir, f"{self.run_id}-{self.num_shards:06d}.tar"
+            )
+            self.tar = tarfile.open(self.shard_path + ".tmp", "w")
+            self.uids = []
+        with tarfile.open(record_path, "r") as record:
+            for member in record.getmembers():
+                self.tar.addfile(member, record.extractfile(member))
+        self.uids.append(os.path.basename(record_path)[: -len(".tar")])
+        os.remove(record_path)
+        if self.tar.fileobj.tell() >= self.max_shard_bytes:
+            self.close()
+
+    def close(self) -> None:
+        """Finishes the current shard, if any."""
+        if self.tar is None:
+            return
+        self.tar.close()
+        os.rename(self.shard_path + ".tmp", self.shard_path)
+        self.tar = None
+        self.num_shards += 1
+        if self.on_shard is not None:
+            self.on_shard(self.shard_path, self.uids)
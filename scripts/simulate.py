@@ -0,0 +1,543 @@
+"""Capacity planner for distributed.py, as a discrete-event simulation.
+
+Sizing a render farm by trial runs is slow and costs GPU hours. This script
+replays a manifest through a model of the pipeline of distributed.py instead,
+for every combination of the swept layouts, in seconds rather than GPU hours:
+
+- download_workers threads download objects in manifest order, and block while
+  the render queue already holds prefetch_lookahead objects,
+- workers_per_gpu render workers per GPU each start Blender, take objects from
+  the render queue and put failed renders back on it after an exponential
+  backoff, which they do not wait out themselves. Like the render server, a
+  worker starts a new Blender for its next object after max_objects_per_blender
+  renders, or after a failed render that killed Blender,
+- upload_workers threads upload the rendered objects.
+
+A render is modeled as a CPU phase (import, normalization, scene setup) that
+overlaps freely with the other workers, followed by a GPU phase that shares the
+GPU with the other workers of the GPU: with n renders in their GPU phase, each
+progresses at min(1, gpu_parallelism / n) of its speed. Recorded render times
+are assumed to have been measured with the GPU to themselves.
+
+The timing of every object comes from the spans file and ledger of earlier runs
+when they have recorded it, and otherwise from a recorded object drawn at random,
+or from log-normal distributions when nothing has been recorded. The makespan,
+throughput, utilization of each stage and of the GPUs, and the bottleneck stage
+(the busiest one) of each layout are printed and appended to a JSON lines file.
+
+Example usage:
+    python scripts/simulate.py \
+        --input_models_path input_model_paths.json \
+        --spans_path spans.jsonl \
+        --num_gpus 4 8 \
+        --workers_per_gpu 1 2 4 \
+        --upload_workers 8 16
+"""
+
+import heapq
+import itertools
+import json
+import os
+import random
+import statistics
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Deque, Dict, List, Literal, Optional, Tuple
+
+import tyro
+
+from ledger import Ledger
+from manifest import iter_manifest
+from prefetch import get_uid
+from scheduling import longest_first
+from spans import read_spans
+
+
+@dataclass
+class Args:
+    input_models_path: Optional[str] = None
+    """manifest of the objects to simulate. Without it, num_objects objects are
+    drawn from the recorded timings"""
+
+    num_objects: int = 10_000
+    """number of objects to simulate without a manifest"""
+
+    spans_path: Optional[str] = "spans.jsonl"
+    """spans file of earlier runs to take the timings of objects from"""
+
+    ledger_path: Optional[str] = None
+    """ledger of an earlier run to take the render times of objects from"""
+
+    num_gpus: Tuple[int, ...] = (1,)
+    """numbers of gpus to sweep"""
+
+    workers_per_gpu: Tuple[int, ...] = (1, 2, 4)
+    """numbers of workers per gpu to sweep"""
+
+    download_workers: Tuple[int, ...] = (8,)
+    """numbers of concurrent downloads to sweep"""
+
+    upload_workers: Tuple[int, ...] = (16,)
+    """numbers of concurrent uploads to sweep. 0 means no uploads"""
+
+    prefetch_lookahead: int = 32
+    """maximum number of downloaded objects waiting to be rendered"""
+
+    order: Literal["manifest", "longest_first"] = "manifest"
+    """render in manifest order or longest first, like distributed.py"""
+
+    known_tail: float = 1.0
+    """known tail of longest_first. Objects without recorded timings count as
+    objects of unknown cost"""
+
+    render_cpu_fraction: float = 0.3
+    """fraction of the render time of an object spent on the CPU before the GPU"""
+
+    gpu_parallelism: float = 1.0
+    """number of GPU phases a GPU runs at full speed at the same time"""
+
+    blender_startup: float = 10.0
+    """seconds Blender takes to start in each worker"""
+
+    max_objects_per_blender: int = 100
+    """renders after which a worker restarts Blender, like distributed.py"""
+
+    failure_restart_fraction: float = 1.0
+    """fraction of the failed renders that kill Blender, as timeouts and crashes
+    do, so that the next render of the worker starts a new one"""
+
+    failure_rate: Optional[float] = None
+    """fraction of render attempts that fail. Defaults to the recorded fraction"""
+
+    max_attempts: int = 3
+    """number of times to try rendering an object before quarantining it"""
+
+    retry_backoff: float = 5
+    """seconds to wait before the first retry, doubling with every retry"""
+
+    download_seconds: float = 2.0
+    """mean download time when none has been recorded"""
+
+    render_seconds: float = 20.0
+    """mean render time when none has been recorded"""
+
+    upload_seconds: float = 1.0
+    """mean upload time when none has been recorded"""
+
+    timing_sigma: float = 0.8
+    """spread of the log-normal timings when none have been recorded"""
+
+    gpu_hour_cost: Optional[float] = None
+    """price of one GPU hour, to estimate the cost of each layout"""
+
+    output_path: str = "simulation.jsonl"
+    """JSON lines file the results of each layout are appended to"""
+
+    seed: int = 0
+    """random seed of the drawn timings and failures"""
+
+
+@dataclass
+class Layout:
+    num_gpus: int
+    workers_per_gpu: int
+    download_workers: int
+    upload_workers: int
+
+
+@dataclass
+class ObjectTimings:
+    download: float
+    render: float
+    upload: float
+
+
+STAGES = ("download", "render", "upload")
+
+
+def recorded_timings(
+    spans_path: Optional[str] = None, ledger: Optional[Ledger] = None
+) -> Tuple[Dict[str, Dict[str, float]], Optional[float]]:
+    """Returns the mean recorded seconds of each stage of each object by uid,
+    and the fraction of render attempts that failed if any were recorded."""
+    seconds: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    attempts = failures = 0
+    if spans_path is not None and os.path.exists(spans_path):
+        for span in read_spans(spans_path):
+            if "uid" not in span:
+                continue
+            if span["stage"] == "render_object":
+                attempts += 1
+                if not span.get("success"):
+                    failures += 1
+                    continue
+                seconds[span["uid"]]["render"].append(span["duration"])
+            elif span["stage"] in ("download", "upload"):
+                seconds[span["uid"]][span["stage"]].append(span["duration"])
+    timings = {
+        uid: {stage: statistics.mean(d) for stage, d in stages.items()}
+        for uid, stages in seconds.items()
+    }
+    if ledger is not None:
+        for uid, render_seconds in ledger.render_seconds().items():
+            timings.setdefault(uid, {}).setdefault("render", render_seconds)
+    failure_rate = failures / attempts if attempts else None
+    return timings, failure_rate
+
+
+def lognormal(mean: float, sigma: float, rng: random.Random) -> float:
+    # keep the mean at mean whatever the spread
+    return mean * rng.lognormvariate(-(sigma**2) / 2, sigma)
+
+
+def object_timings(
+    uids: List[str],
+    recorded: Dict[str, Dict[str, float]],
+    args: Args,
+    rng: random.Random,
+) -> List[ObjectTimings]:
+    """Returns the timings of each object: recorded, drawn from the recorded
+    objects, or log-normal."""
+    pools = {
+        stage: [t[stage] for t in recorded.values() if stage in t] for stage in STAGES
+    }
+    means = {
+        "download": args.download_seconds,
+        "render": args.render_seconds,
+        "upload": args.upload_seconds,
+    }
+    timings = []
+    for uid in uids:
+        record = recorded.get(uid, {})
+        values = {}
+        for stage in STAGES:
+            if stage in record:
+                values[stage] = record[stage]
+            elif pools[stage]:
+                values[stage] = rng.choice(pools[stage])
+            else:
+                values[stage] = lognormal(means[stage], args.timing_sigma, rng)
+        timings.append(ObjectTimings(**values))
+    return timings
+
+
+class Simulation:
+    """Simulates one layout of the pipeline over the timings of the objects."""
+
+    def __init__(
+        self,
+        objects: List[ObjectTimings],
+        layout: Layout,
+        args: Args,
+        failure_rate: float,
+        seed: int = 0,
+    ) -> None:
+        self.objects = objects
+        self.layout = layout
+        self.args = args
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events: List[Tuple[float, int, Callable[..., None], tuple]] = []
+        self.sequence = itertools.count()
+        self.next_object = 0
+
+        # objects waiting for a worker, with their attempt number
+        self.render_queue: Deque[Tuple[int, int]] = deque()
+        self.blocked_downloads: Deque[int] = deque()
+        self.idle_workers: Deque[int] = deque()
+        num_workers = layout.num_gpus * layout.workers_per_gpu
+        self.blender_renders = [0] * num_workers
+        self.restart_blender = [False] * num_workers
+        self.upload_queue: Deque[int] = deque()
+        self.idle_uploaders = layout.upload_workers
+
+        # renders in their GPU phase, with their remaining seconds of work
+        self.gpu_jobs: List[Dict[int, float]] = [{} for _ in range(layout.num_gpus)]
+        self.gpu_done: List[Dict[int, Callable[[], None]]] = [
+            {} for _ in range(layout.num_gpus)
+        ]
+        self.gpu_updated = [0.0] * layout.num_gpus
+        self.gpu_version = [0] * layout.num_gpus
+
+        self.busy = defaultdict(float)
+        self.render_queue_area = 0.0
+        self.render_queue_updated = 0.0
+        self.max_upload_queue = 0
+        self.rendered = 0
+        self.quarantined = 0
+        self.blender_restarts = 0
+        self.finished_at = 0.0
+
+    def schedule(self, delay: float, callback: Callable[..., None], *args) -> None:
+        heapq.heappush(
+            self.events, (self.now + delay, next(self.sequence), callback, args)
+        )
+
+    def run(self) -> Dict[str, Any]:
+        layout = self.layout
+        for _ in range(layout.download_workers):
+            self.start_download()
+        num_workers = layout.num_gpus * layout.workers_per_gpu
+        for worker in range(num_workers):
+            self.schedule(self.args.blender_startup, self.take_render, worker)
+        while self.events:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+        makespan = self.finished_at
+
+        def utilization(stage: str, slots: int) -> float:
+            return self.busy[stage] / (makespan * slots) if makespan and slots else 0
+
+        stage_utilization = {
+            "download": utilization("download", layout.download_workers),
+            "render": utilization("render", num_workers),
+            "upload": utilization("upload", layout.upload_workers),
+        }
+        result = {
+            **asdict(layout),
+            "makespan": makespan,
+            "objects": self.rendered,
+            "quarantined": self.quarantined,
+            "blender_restarts": self.blender_restarts,
+            "objects_per_second": self.rendered / makespan if makespan else 0,
+            **{f"{k}_utilization": v for k, v in stage_utilization.items()},
+            "gpu_utilization": utilization("gpu", layout.num_gpus),
+            "mean_render_queue": self.render_queue_area / makespan if makespan else 0,
+            "max_upload_queue": self.max_upload_queue,
+            "bottleneck": max(stage_utilization, key=stage_utilization.get),
+        }
+        if self.args.gpu_hour_cost is not None:
+            gpu_hours = makespan / 3600 * layout.num_gpus
+            result["cost"] = gpu_hours * self.args.gpu_hour_cost
+        return result
+
+    def finish(self) -> None:
+        self.finished_at = max(self.finished_at, self.now)
+
+    # downloads
+
+    def start_download(self) -> None:
+        if self.next_object == len(self.objects):
+            return
+        i = self.next_object
+        self.next_object += 1
+        seconds = self.objects[i].download
+        self.busy["download"] += seconds
+        self.schedule(seconds, self.downloaded, i)
+
+    def downloaded(self, i: int) -> None:
+        if len(self.render_queue) >= self.args.prefetch_lookahead:
+            # the download thread blocks on the full render queue
+            self.blocked_downloads.append(i)
+            return
+        self.enqueue_render(i)
+        self.start_download()
+
+    def enqueue_render(self, i: int, attempt: int = 0) -> None:
+        self.update_render_queue_area()
+        if self.idle_workers:
+            self.start_render(self.idle_workers.popleft(), i, attempt)
+        else:
+            self.render_queue.append((i, attempt))
+
+    def update_render_queue_area(self) -> None:
+        self.render_queue_area += len(self.render_queue) * (
+            self.now - self.render_queue_updated
+        )
+        self.render_queue_updated = self.now
+
+    # renders
+
+    def take_render(self, worker: int) -> None:
+        if not self.render_queue:
+            self.idle_workers.append(worker)
+            return
+        self.update_render_queue_area()
+        i, attempt = self.render_queue.popleft()
+        if self.blocked_downloads:
+            self.render_queue.append((self.blocked_downloads.popleft(), 0))
+            self.start_download()
+        self.start_render(worker, i, attempt)
+
+    def start_render(self, worker: int, i: int, attempt: int) -> None:
+        startup = 0.0
+        if self.restart_blender[worker]:
+            # the render server starts Blender again for the next object
+            self.restart_blender[worker] = False
+            self.blender_restarts += 1
+            startup = self.args.blender_startup
+        seconds = self.objects[i].render
+        cpu_seconds = seconds * self.args.render_cpu_fraction
+        self.busy["render"] += cpu_seconds
+        gpu = worker // self.layout.workers_per_gpu
+        self.schedule(
+            startup + cpu_seconds,
+            self.start_gpu_phase,
+            gpu,
+            worker,
+            i,
+            attempt,
+            self.now + startup,
+        )
+
+    def start_gpu_phase(
+        self, gpu: int, worker: int, i: int, attempt: int, started: float
+    ) -> None:
+        work = self.objects[i].render * (1 - self.args.render_cpu_fraction)
+        self.advance_gpu(gpu)
+        self.gpu_jobs[gpu][worker] = work
+        self.gpu_done[gpu][worker] = lambda: self.rendered_attempt(
+            worker, i, attempt, started
+        )
+        self.reschedule_gpu(gpu)
+
+    def rendered_attempt(
+        self, worker: int, i: int, attempt: int, started: float
+    ) -> None:
+        self.busy["render"] += self.now - started - (
+            self.objects[i].render * self.args.render_cpu_fraction
+        )
+        failed = self.rng.random() < self.failure_rate
+        if not failed:
+            self.rendered += 1
+            self.enqueue_upload(i)
+        elif attempt + 1 < self.args.max_attempts:
+            # a timer puts the object back on the queue once the backoff is
+            # over, while the worker goes on with the next object
+            backoff = self.args.retry_backoff * 2**attempt
+            self.schedule(backoff, self.enqueue_render, i, attempt + 1)
+        else:
+            self.quarantined += 1
+            self.finish()
+        self.blender_renders[worker] += 1
+        if self.blender_renders[worker] >= self.args.max_objects_per_blender or (
+            failed and self.rng.random() < self.args.failure_restart_fraction
+        ):
+            self.blender_renders[worker] = 0
+            self.restart_blender[worker] = True
+        self.take_render(worker)
+
+    def gpu_rate(self, gpu: int) -> float:
+        return min(1.0, self.args.gpu_parallelism / max(len(self.gpu_jobs[gpu]), 1))
+
+    def advance_gpu(self, gpu: int) -> None:
+        """Progresses the GPU phases of a GPU up to now."""
+        elapsed = self.now - self.gpu_updated[gpu]
+        jobs = self.gpu_jobs[gpu]
+        if jobs:
+            self.busy["gpu"] += elapsed
+            progress = elapsed * self.gpu_rate(gpu)
+            for worker in jobs:
+                jobs[worker] -= progress
+        self.gpu_updated[gpu] = self.now
+
+    def reschedule_gpu(self, gpu: int) -> None:
+        """Schedules the end of the next GPU phase to finish on a GPU, since the
+        speed of every phase changes when one starts or ends."""
+        self.gpu_version[gpu] += 1
+        jobs = self.gpu_jobs[gpu]
+        if jobs:
+            delay = max(min(jobs.values()), 0.0) / self.gpu_rate(gpu)
+            self.schedule(delay, self.gpu_phase_done, gpu, self.gpu_version[gpu])
+
+    def gpu_phase_done(self, gpu: int, version: int) -> None:
+        if version != self.gpu_version[gpu]:
+            return
+        self.advance_gpu(gpu)
+        jobs = self.gpu_jobs[gpu]
+        done = [worker for worker, work in jobs.items() if work <= 1e-9]
+        callbacks = []
+        for worker in done:
+            del jobs[worker]
+            callbacks.append(self.gpu_done[gpu].pop(worker))
+        self.reschedule_gpu(gpu)
+        for callback in callbacks:
+            callback()
+
+    # uploads
+
+    def enqueue_upload(self, i: int) -> None:
+        if self.layout.upload_workers == 0:
+            self.finish()
+            return
+        if self.idle_uploaders > 0:
+            self.idle_uploaders -= 1
+            self.start_upload(i)
+        else:
+            self.upload_queue.append(i)
+            self.max_upload_queue = max(self.max_upload_queue, len(self.upload_queue))
+
+    def start_upload(self, i: int) -> None:
+        seconds = self.objects[i].upload
+        self.busy["upload"] += seconds
+        self.schedule(seconds, self.uploaded)
+
+    def uploaded(self) -> None:
+        self.finish()
+        if self.upload_queue:
+            self.start_upload(self.upload_queue.popleft())
+        else:
+            self.idle_uploaders += 1
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    rng = random.Random(args.seed)
+
+    ledger = None if args.ledger_path is None else Ledger(args.ledger_path)
+    recorded, recorded_failure_rate = recorded_timings(args.spans_path, ledger)
+    if args.input_models_path is not None:
+        uids = [get_uid(path) for path in iter_manifest(args.input_models_path)]
+    elif recorded:
+        recorded_uids = sorted(recorded)
+        uids = [rng.choice(recorded_uids) for _ in range(args.num_objects)]
+    else:
+        uids = [f"synthetic-{i}" for i in range(args.num_objects)]
+    objects = object_timings(uids, recorded, args, rng)
+    known = [uid in recorded for uid in uids]
+    num_recorded = sum(uid in recorded for uid in uids)
+    print(f"Simulating {len(objects)} objects, {num_recorded} with recorded timings")
+    failure_rate = args.failure_rate
+    if failure_rate is None:
+        failure_rate = recorded_failure_rate or 0.0
+    print(f"Render failure rate: {failure_rate:.3f}")
+
+    columns = [
+        "num_gpus",
+        "workers_per_gpu",
+        "download_workers",
+        "upload_workers",
+        "makespan",
+        "objects_per_second",
+        "download_utilization",
+        "render_utilization",
+        "gpu_utilization",
+        "upload_utilization",
+    ]
+    if args.gpu_hour_cost is not None:
+        columns.append("cost")
+    widths = [max(len(c), 8) + 2 for c in columns]
+    print("".join(f"{c:>{w}}" for c, w in zip(columns, widths)) + "  bottleneck")
+    for values in itertools.product(
+        args.num_gpus, args.workers_per_gpu, args.download_workers, args.upload_workers
+    ):
+        layout = Layout(*values)
+        layout_objects = objects
+        if args.order == "longest_first":
+            costs = [o.render for o in objects]
+            num_workers = layout.num_gpus * layout.workers_per_gpu
+            order = longest_first(costs, known, num_workers, args.known_tail)
+            layout_objects = [objects[i] for i in order]
+        result = Simulation(
+            layout_objects, layout, args, failure_rate, seed=args.seed
+        ).run()
+        with open(args.output_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        row = "".join(
+            f"{result[c]:>{w}.3f}"
+            if isinstance(result[c], float)
+            else f"{result[c]:>{w}}"
+            for c, w in zip(columns, widths)
+        )
+        print(f"{row}  {result['bottleneck']}")
@@ -0,0 +1,141 @@
+"""Per-object timing spans for every stage of the rendering pipeline.
+
+Each stage an object goes through (download, import, normalize_scene, each
+render, upload, ...) is recorded as a span: a JSON object with the stage name,
+its start time and duration, and attributes such as the uid, the GPU or the
+object size. Blender returns the spans of the stages it ran with its render
+result, and distributed.py appends every span to a JSON lines file.
+
+Running this file summarizes a spans file by stage and by GPU, optionally for a
+single run:
+
+    python scripts/spans.py spans.jsonl --run 20230101-120000
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+class SpanRecorder:
+    """Collects the spans of the stages run for one object."""
+
+    def __init__(self, **attrs: Any) -> None:
+        self.attrs = attrs
+        self.spans: List[Dict[str, Any]] = []
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Times the body of the with statement as a span of the given stage.
+
+        The yielded dict can be used to add attributes that are only known at
+        the end of the stage.
+        """
+        extra_attrs: Dict[str, Any] = {}
+        start = time.time()
+        try:
+            yield extra_attrs
+        finally:
+            self.spans.append(
+                {
+                    **self.attrs,
+                    "stage": stage,
+                    "start": start,
+                    "duration": time.time() - start,
+                    **attrs,
+                    **extra_attrs,
+                }
+            )
+
+
+class SpanWriter:
+    """Appends spans to a JSON lines file that many processes can share.
+
+    The attributes given to the writer, such as a run id, are added to every span.
+    """
+
+    def __init__(self, path: str, **attrs: Any) -> None:
+        self.path = path
+        self.attrs = attrs
+
+    def write(self, spans: Iterable[Dict[str, Any]], **attrs: Any) -> None:
+        lines = "".join(
+            json.dumps({**span, **self.attrs, **attrs}) + "\n" for span in spans
+        )
+        # a single append is not interleaved with the appends of other processes
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+
+def read_spans(path: str, run: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reads the spans of a file, keeping only those of one run if given."""
+    with open(path, "r") as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+    if run is not None:
+        spans = [span for span in spans if span.get("run") == run]
+    return spans
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Returns the q-th percentile of the values, using the nearest rank."""
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(durations),
+        "total": sum(durations),
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+        "p99": percentile(durations, 99),
+    }
+
+
+def summarize_spans(spans: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Returns duration percentiles of every stage, overall and for each GPU."""
+    by_stage = defaultdict(list)
+    by_gpu = defaultdict(lambda: defaultdict(list))
+    for span in spans:
+        by_stage[span["stage"]].append(span["duration"])
+        if "gpu" in span:
+            by_gpu[span["gpu"]][span["stage"]].append(span["duration"])
+    return {
+        "stages": {stage: summarize(d) for stage, d in by_stage.items()},
+        "gpus": {
+            gpu: {stage: summarize(d) for stage, d in stages.items()}
+            for gpu, stages in sorted(by_gpu.items())
+        },
+    }
+
+
+def format_summary(summary: Dict[str, Dict[str, Any]]) -> str:
+    lines = []
+    header = (
+        f"{'stage':<24}{'count':>8}{'total':>12}{'p50':>10}{'p95':>10}{'p99':>10}"
+    )
+    groups = [("all", summary["stages"])] + [
+        (f"gpu {gpu}", stages) for gpu, stages in summary["gpus"].items()
+    ]
+    for name, stages in groups:
+        lines.append(f"[{name}]")
+        lines.append(header)
+        for stage, s in sorted(stages.items()):
+            lines.append(
+                f"{stage:<24}{s['count']:>8}{s['total']:>12.1f}"
+                f"{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spans_path", type=str)
+    parser.add_argument("--run", type=str, default=None)
+    args = parser.parse_args()
+
+    print(format_summary(summarize_spans(read_spans(args.spans_path, args.run))))
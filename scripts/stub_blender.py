@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Stand-in for the Blender executable, for benchmarking without Blender.
+
+Takes the same command line as Blender running blender_script.py:
+
+    stub_blender.py -b -P scripts/blender_script.py -- --server_address ... [...]
+
+and serves fake renders from render_server.py instead. The arguments meant for
+blender_script.py that only affect the rendering are ignored. The startup time
+and the render latency and failure distributions are read from environment
+variables, since distributed.py passes the same arguments as it would to Blender:
+
+    STUB_BLENDER_STARTUP         seconds to sleep before serving
+    STUB_BLENDER_LATENCY         mean render time in seconds
+    STUB_BLENDER_LATENCY_SIGMA   spread of the log-normal render time
+    STUB_BLENDER_SECONDS_PER_MB  extra render time per MB of object
+    STUB_BLENDER_FAILURE_RATE    fraction of renders that fail
+    STUB_BLENDER_HANG_RATE       fraction of objects that always hang
+    STUB_BLENDER_CRASH_RATE      fraction of objects that always crash
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from render_server import add_fake_render_arguments, fake_render_fn, serve
+
+ENV_DEFAULTS = {
+    "latency": "STUB_BLENDER_LATENCY",
+    "latency_sigma": "STUB_BLENDER_LATENCY_SIGMA",
+    "seconds_per_mb": "STUB_BLENDER_SECONDS_PER_MB",
+    "failure_rate": "STUB_BLENDER_FAILURE_RATE",
+    "hang_rate": "STUB_BLENDER_HANG_RATE",
+    "crash_rate": "STUB_BLENDER_CRASH_RATE",
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--object_path", type=str)
+    parser.add_argument("--server_address", type=str)
+    add_fake_render_arguments(parser)
+    parser.set_defaults(
+        **{
+            dest: float(os.environ[env])
+            for dest, env in ENV_DEFAULTS.items()
+            if env in os.environ
+        }
+    )
+    argv = sys.argv[sys.argv.index("--") + 1 :]
+    args, _ = parser.parse_known_args(argv)
+
+    time.sleep(float(os.environ.get("STUB_BLENDER_STARTUP", 0)))
+    render_fn = fake_render_fn(args)
+    if args.server_address is not None:
+        serve(args.server_address, render_fn)
+    else:
+        try:
+            render_fn(args.object_path)
+        except Exception as e:
+            print("Failed to render", args.object_path)
+            print(e)
+            sys.exit(1)
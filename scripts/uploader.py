@@ -0,0 +1,229 @@
+"""Uploads rendered views to S3 in the background.
+
+Render workers put finished `views/{uid}` directories on the upload queue and
+move straight on to the next object. Shards of packed objects (see shards.py) are
+queued with `upload_shard` and uploaded under `shards/`. A dispatcher thread
+hands the directories and shards to a pool of upload threads that share one S3
+client. At most `max_in_flight_bytes` are uploaded at once, failed uploads are
+retried with exponential backoff, and a directory is only deleted once every file
+in it has been uploaded. A directory or shard that cannot be read fails like an
+upload that ran out of retries. `on_upload` is called with every uid once its
+views or shard have been uploaded or have failed to.
+
+Any object with boto3's `upload_file(Filename, Bucket, Key)` method works as the
+client, and `make_s3_client` can point boto3 at a local S3 stand-in such as MinIO
+or moto with `endpoint_url`.
+"""
+
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import boto3
+from botocore.config import Config
+
+from spans import SpanWriter
+
+if TYPE_CHECKING:
+    from ledger import Ledger
+    from metrics import MetricsRegistry
+
+
+def make_s3_client(num_connections: int, endpoint_url: Optional[str] = None) -> Any:
+    """Returns an S3 client whose connection pool fits the upload threads."""
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=num_connections),
+    )
+
+
+class Uploader:
+    def __init__(
+        self,
+        s3: Any,
+        bucket: str,
+        num_workers: int = 16,
+        max_in_flight_bytes: int = 256 * 1024**2,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        ledger: Optional["Ledger"] = None,
+        spans: Optional[SpanWriter] = None,
+        metrics: Optional["MetricsRegistry"] = None,
+        on_upload: Optional[Callable[[str, bool], None]] = None,
+    ) -> None:
+        self.s3 = s3
+        self.bucket = bucket
+        self.num_workers = num_workers
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.ledger = ledger
+        self.spans = spans
+        self.in_flight_bytes = 0
+        self.in_flight = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.dispatcher: Optional[threading.Thread] = None
+        self.upload_queue = None
+        self.shard_uids: Dict[str, List[str]] = {}
+        self.num_uploaded = 0
+        self.failed: List[str] = []
+        self.metrics = metrics
+        self.on_upload = on_upload
+        if metrics is not None:
+            metrics.histogram("upload_seconds", "Time to upload an object or shard")
+            metrics.counter("upload_retries_total", "Retried uploads of a file")
+            metrics.counter("upload_failures_total", "Objects and shards not uploaded")
+            metrics.gauge(
+                "upload_in_flight_bytes",
+                "Bytes being uploaded",
+                lambda: self.in_flight_bytes,
+            )
+
+    def start(self, upload_queue) -> None:
+        """Starts uploading the directories put on the queue until None is put."""
+        self.upload_queue = upload_queue
+        self.dispatcher = threading.Thread(
+            target=self._dispatch, args=(upload_queue,), daemon=True
+        )
+        self.dispatcher.start()
+
+    def upload_shard(self, shard_path: str, uids: List[str]) -> None:
+        """Queues a shard for upload, along with the objects it contains."""
+        with self.in_flight:
+            self.shard_uids[shard_path] = uids
+        self.upload_queue.put(shard_path)
+
+    def join(self) -> None:
+        """Waits for the queued directories to finish uploading."""
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True)
+
+    def _dispatch(self, upload_queue) -> None:
+        while True:
+            path = upload_queue.get()
+            if path is None:
+                break
+            with self.in_flight:
+                shard_uids = self.shard_uids.pop(path, None)
+            if shard_uids is None:
+                uids = [os.path.basename(os.path.normpath(path))]
+            else:
+                uids = shard_uids
+            try:
+                self._submit(path, uids, is_shard=shard_uids is not None)
+            except Exception as e:
+                # one unreadable directory or shard must not stop the others
+                self._finish(path, uids, False, e)
+
+    def _submit(self, path: str, uids: List[str], is_shard: bool) -> None:
+        if is_shard:
+            files = {path: f"shards/{os.path.basename(path)}"}
+        else:
+            files = {
+                os.path.join(path, f): f"{uids[0]}/{f}"
+                for f in sorted(os.listdir(path))
+            }
+        size = sum(os.path.getsize(f) for f in files)
+        # a directory larger than the budget is uploaded on its own
+        with self.in_flight:
+            self.in_flight.wait_for(
+                lambda: self.in_flight_bytes == 0
+                or self.in_flight_bytes + size <= self.max_in_flight_bytes
+            )
+            self.in_flight_bytes += size
+        try:
+            self.executor.submit(self._upload, path, files, uids, size)
+        except Exception:
+            with self.in_flight:
+                self.in_flight_bytes -= size
+                self.in_flight.notify_all()
+            raise
+
+    def upload_files(self, files: Dict[str, str]) -> None:
+        """Uploads small files by key right away, from the calling thread."""
+        for path, key in files.items():
+            self._upload_file(path, key)
+
+    def _upload_file(self, path: str, key: str) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.s3.upload_file(path, self.bucket, key)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2**attempt * (1 + random.random())
+                if self.metrics is not None:
+                    self.metrics.inc("upload_retries_total")
+                print(f"Retrying upload of {path} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _upload(
+        self, path: str, files: Dict[str, str], uids: List[str], size: int
+    ) -> None:
+        success = False
+        error = None
+        start = time.time()
+        try:
+            for f, key in files.items():
+                self._upload_file(f, key)
+            success = True
+            if self.metrics is not None:
+                self.metrics.observe("upload_seconds", time.time() - start)
+            if self.spans is not None:
+                span = {
+                    "stage": "upload",
+                    "start": start,
+                    "duration": time.time() - start,
+                    "size_bytes": size,
+                    "num_files": len(files),
+                    "num_objects": len(uids),
+                }
+                if len(uids) == 1:
+                    span["uid"] = uids[0]
+                self.spans.write([span])
+            if self.ledger is not None:
+                for uid in uids:
+                    self.ledger.set_state(
+                        uid, "uploaded", upload_seconds=time.time() - start
+                    )
+            # remove the views/uid directory or the shard
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except Exception as e:
+            error = e
+        finally:
+            with self.in_flight:
+                self.in_flight_bytes -= size
+                self.in_flight.notify_all()
+        self._finish(path, uids, success, error)
+
+    def _finish(
+        self, path: str, uids: List[str], success: bool, error: Optional[Exception]
+    ) -> None:
+        """Records the outcome of a directory or shard and reports its uids."""
+        if not success:
+            print("Failed to upload", path, error)
+            if self.metrics is not None:
+                self.metrics.inc("upload_failures_total")
+            if self.ledger is not None:
+                for uid in uids:
+                    self.ledger.set_state(uid, "failed", error=repr(error))
+        with self.in_flight:
+            if success:
+                self.num_uploaded += len(uids)
+            else:
+                self.failed.append(path)
+        if self.on_upload is not None:
+            for uid in uids:
+                try:
+                    self.on_upload(uid, success)
+                except Exception as e:
+                    print("Failed to handle the upload of", uid, e)
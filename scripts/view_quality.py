@@ -0,0 +1,118 @@
+"""Checks of the alpha channel of rendered views, to catch broken framing.
+
+When an object is normalized or framed badly, its views come out transparent,
+clipped by the image border or with the object as a speck in the middle, and
+they would otherwise be uploaded like any other views. blender_script.py reads
+the alpha channel of every view of a render configuration, and the functions
+here compute for all the views at once
+
+- coverage, the fraction of pixels the object covers,
+- edge_coverage, the fraction of border pixels the object covers, which is
+  above zero when the object is clipped,
+- fill, the larger side of the object's bounding box over the side of the image,
+
+turn them into problems, and pick the camera distance to render again with.
+They do not depend on bpy, so they can be tested on any array of alpha values.
+"""
+
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+
+def view_stats(alphas: Sequence[np.ndarray], threshold: float = 0.5) -> List[dict]:
+    """Returns the coverage, edge coverage and fill of views given their alpha
+    channels as (height, width) arrays.
+
+    Views of the same size are stacked and checked together.
+    """
+    stats: List[Dict[str, float]] = [{} for _ in alphas]
+    shapes: Dict[tuple, List[int]] = {}
+    for i, alpha in enumerate(alphas):
+        shapes.setdefault(alpha.shape, []).append(i)
+    for (height, width), indices in shapes.items():
+        opaque = np.stack([alphas[i] for i in indices]) > threshold
+        coverage = opaque.mean(axis=(1, 2))
+        border = np.concatenate(
+            [
+                opaque[:, 0, :],
+                opaque[:, -1, :],
+                opaque[:, 1:-1, 0],
+                opaque[:, 1:-1, -1],
+            ],
+            axis=1,
+        )
+        edge_coverage = border.mean(axis=1)
+        rows = opaque.any(axis=2)
+        cols = opaque.any(axis=1)
+        # extent of the opaque rows and columns, 0 for empty views
+        row_extent = np.where(
+            rows.any(axis=1),
+            height - rows[:, ::-1].argmax(axis=1) - rows.argmax(axis=1),
+            0,
+        )
+        col_extent = np.where(
+            cols.any(axis=1),
+            width - cols[:, ::-1].argmax(axis=1) - cols.argmax(axis=1),
+            0,
+        )
+        fill = np.maximum(row_extent / height, col_extent / width)
+        for j, i in enumerate(indices):
+            stats[i] = {
+                "coverage": float(coverage[j]),
+                "edge_coverage": float(edge_coverage[j]),
+                "fill": float(fill[j]),
+            }
+    return stats
+
+
+def view_problems(
+    stats: List[dict],
+    min_coverage: float,
+    max_edge_coverage: float,
+    min_fill: float,
+) -> List[List[str]]:
+    """Returns the problems of each view: empty, clipped or small."""
+    problems = []
+    for view in stats:
+        found = []
+        if view["coverage"] < min_coverage:
+            found.append("empty")
+        else:
+            if view["edge_coverage"] > max_edge_coverage:
+                found.append("clipped")
+            if view["fill"] < min_fill:
+                found.append("small")
+        problems.append(found)
+    return problems
+
+
+def adjusted_camera_dist(
+    stats: List[dict],
+    problems: List[List[str]],
+    camera_dist: float,
+    target_fill: float,
+    clipped_factor: float = 1.3,
+) -> float:
+    """Returns the camera distance to render the views again with.
+
+    Clipped views move the camera back. Otherwise, small views move it closer,
+    so that the largest view fills target_fill of the image, since the apparent
+    size of the object is inversely proportional to the distance. The distance
+    is returned unchanged when no move would help.
+    """
+    if any("clipped" in found for found in problems):
+        return camera_dist * clipped_factor
+    max_fill = max((view["fill"] for view in stats), default=0.0)
+    if max_fill == 0:
+        return camera_dist
+    return camera_dist * min(max(max_fill / target_fill, 0.25), 1.0)
+
+
+def summarize_problems(problems: List[List[str]]) -> Dict[str, Any]:
+    """Returns the number of views with each problem."""
+    counts: Dict[str, Any] = {}
+    for found in problems:
+        for problem in found:
+            counts[problem] = counts.get(problem, 0) + 1
+    return counts
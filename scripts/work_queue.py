@@ -0,0 +1,347 @@
+"""Work queue shared by the render nodes of a multi-node run.
+
+Every node leases a batch of objects from the queue when it runs out of work,
+so fast nodes simply take more batches than slow ones. A lease expires unless
+the node that holds it keeps sending heartbeats, and the objects of an expired
+lease, e.g. of a node that crashed or was preempted, go back to the front of the
+queue for another node to take. An object whose lease has expired max_leases
+times is marked as failed instead, so that an object that kills its node does
+not take down the whole fleet.
+
+Two backends are available, chosen by the URL of the queue:
+
+- `sqlite:///path/to/queue.db`: a SQLite database, for a single machine or a
+  shared filesystem with working locks.
+- `redis://host:6379/0`: a Redis-compatible server, using Lua scripts so that
+  every operation is atomic. Requires the redis package.
+
+One node seeds the queue with the manifest (`add` ignores objects that are
+already in the queue) and then marks the queue as seeded, and every node leases
+from it. Nodes that start before the queue is seeded wait for it instead of
+finding it empty and exiting. A node can only complete the objects it still
+holds the lease of, so a node that was presumed dead and comes back does not
+overwrite the result of the node that took over.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List
+
+from prefetch import get_uid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL UNIQUE,
+    object_path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    expires_at REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, id);
+CREATE INDEX IF NOT EXISTS items_owner ON items (owner);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class SqliteWorkQueue:
+    def __init__(self, path: str, max_leases: int = 3) -> None:
+        self.path = path
+        self.max_leases = max_leases
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared across threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def add(self, object_paths: Iterable[str]) -> None:
+        """Appends objects to the queue, ignoring those it already has."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (uid, object_path, state, updated_at)"
+                " VALUES (?, ?, 'queued', ?)",
+                ((get_uid(p), p, now) for p in object_paths),
+            )
+
+    def mark_seeded(self) -> None:
+        """Records that every object of the run has been added."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', ?)",
+            (str(time.time()),),
+        )
+
+    def is_seeded(self) -> bool:
+        row = self._connection().execute("SELECT 1 FROM meta WHERE key = 'seeded'")
+        return row.fetchone() is not None
+
+    def lease(self, node: str, n: int, lease_seconds: float) -> List[str]:
+        """Leases up to n objects to the node, after requeueing expired leases."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE items SET owner = NULL, updated_at = ?,"
+                " state = CASE WHEN leases >= ? THEN 'failed' ELSE 'queued' END"
+                " WHERE state = 'leased' AND expires_at < ?",
+                (now, self.max_leases, now),
+            )
+            rows = conn.execute(
+                "SELECT id, object_path FROM items WHERE state = 'queued'"
+                " ORDER BY id LIMIT ?",
+                (n,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE items SET state = 'leased', owner = ?, expires_at = ?,"
+                " leases = leases + 1, updated_at = ? WHERE id = ?",
+                ((node, now + lease_seconds, now, id_) for id_, _ in rows),
+            )
+        return [object_path for _, object_path in rows]
+
+    def heartbeat(self, node: str, lease_seconds: float) -> None:
+        """Extends every lease held by the node."""
+        self._connection().execute(
+            "UPDATE items SET expires_at = ? WHERE owner = ? AND state = 'leased'",
+            (time.time() + lease_seconds, node),
+        )
+
+    def complete(self, uid: str, node: str, success: bool = True) -> bool:
+        """Marks an object as done or failed, releasing its lease.
+
+        Returns False without changing anything if the node does not hold the
+        lease of the object anymore.
+        """
+        cursor = self._connection().execute(
+            "UPDATE items SET state = ?, owner = NULL, updated_at = ?"
+            " WHERE uid = ? AND owner = ? AND state = 'leased'",
+            ("done" if success else "failed", time.time(), uid, node),
+        )
+        return cursor.rowcount > 0
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of objects in each state."""
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM items GROUP BY state"
+        )
+        return dict(rows.fetchall())
+
+
+# KEYS: queued, leases, owners, lease_counts, failed
+# ARGV: now, expires_at, n, node, max_leases
+LEASE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for i = #expired, 1, -1 do
+    local item = expired[i]
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('HDEL', KEYS[3], item)
+    if tonumber(redis.call('HGET', KEYS[4], item) or 0) >= tonumber(ARGV[5]) then
+        redis.call('SADD', KEYS[5], item)
+    else
+        redis.call('LPUSH', KEYS[1], item)
+    end
+end
+local items = {}
+for i = 1, tonumber(ARGV[3]) do
+    local item = redis.call('LPOP', KEYS[1])
+    if not item then break end
+    redis.call('ZADD', KEYS[2], ARGV[2], item)
+    redis.call('HSET', KEYS[3], item, ARGV[4])
+    redis.call('HINCRBY', KEYS[4], item, 1)
+    items[#items + 1] = item
+end
+return items
+"""
+
+# KEYS: leases, owners. ARGV: node, expires_at
+HEARTBEAT_SCRIPT = """
+local owners = redis.call('HGETALL', KEYS[2])
+for i = 1, #owners, 2 do
+    if owners[i + 1] == ARGV[1] then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[2], owners[i])
+    end
+end
+"""
+
+# KEYS: items, queued, paths. ARGV: uid1, path1, uid2, path2, ...
+ADD_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+        redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+    end
+end
+"""
+
+# KEYS: paths, queued, leases, owners, done or failed, the other one of them
+# ARGV: uid, node
+COMPLETE_SCRIPT = """
+local item = redis.call('HGET', KEYS[1], ARGV[1])
+if not item or redis.call('HGET', KEYS[4], item) ~= ARGV[2] then
+    return 0
+end
+redis.call('LREM', KEYS[2], 0, item)
+redis.call('ZREM', KEYS[3], item)
+redis.call('HDEL', KEYS[4], item)
+redis.call('SREM', KEYS[6], item)
+redis.call('SADD', KEYS[5], item)
+return 1
+"""
+
+
+class RedisWorkQueue:
+    def __init__(self, url: str, name: str = "objaverse", max_leases: int = 3) -> None:
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.max_leases = max_leases
+        self.keys = {
+            key: f"{name}:{key}"
+            for key in [
+                "items",
+                "paths",
+                "queued",
+                "leases",
+                "owners",
+                "lease_counts",
+                "done",
+                "failed",
+                "seeded",
+            ]
+        }
+        self._add = self.client.register_script(ADD_SCRIPT)
+        self._lease = self.client.register_script(LEASE_SCRIPT)
+        self._heartbeat = self.client.register_script(HEARTBEAT_SCRIPT)
+        self._complete = self.client.register_script(COMPLETE_SCRIPT)
+
+    def add(self, object_paths: Iterable[str], batch_size: int = 1000) -> None:
+        keys = [self.keys["items"], self.keys["queued"], self.keys["paths"]]
+        batch: List[str] = []
+        for object_path in object_paths:
+            batch += [get_uid(object_path), object_path]
+            if len(batch) >= 2 * batch_size:
+                self._add(keys=keys, args=batch)
+                batch = []
+        if batch:
+            self._add(keys=keys, args=batch)
+
+    def mark_seeded(self) -> None:
+        self.client.set(self.keys["seeded"], time.time())
+
+    def is_seeded(self) -> bool:
+        return bool(self.client.exists(self.keys["seeded"]))
+
+    def lease(self, node: str, n: int, lease_seconds: float) -> List[str]:
+        now = time.time()
+        return self._lease(
+            keys=[
+                self.keys["queued"],
+                self.keys["leases"],
+                self.keys["owners"],
+                self.keys["lease_counts"],
+                self.keys["failed"],
+            ],
+            args=[now, now + lease_seconds, n, node, self.max_leases],
+        )
+
+    def heartbeat(self, node: str, lease_seconds: float) -> None:
+        self._heartbeat(
+            keys=[self.keys["leases"], self.keys["owners"]],
+            args=[node, time.time() + lease_seconds],
+        )
+
+    def complete(self, uid: str, node: str, success: bool = True) -> bool:
+        completed = self._complete(
+            keys=[
+                self.keys["paths"],
+                self.keys["queued"],
+                self.keys["leases"],
+                self.keys["owners"],
+                self.keys["done" if success else "failed"],
+                self.keys["failed" if success else "done"],
+            ],
+            args=[uid, node],
+        )
+        return bool(completed)
+
+    def counts(self) -> Dict[str, int]:
+        pipeline = self.client.pipeline()
+        pipeline.llen(self.keys["queued"])
+        pipeline.zcard(self.keys["leases"])
+        pipeline.scard(self.keys["done"])
+        pipeline.scard(self.keys["failed"])
+        states = ["queued", "leased", "done", "failed"]
+        return {s: c for s, c in zip(states, pipeline.execute()) if c}
+
+
+def open_work_queue(url: str, max_leases: int = 3):
+    """Opens the work queue at a `sqlite:///path` or `redis://` URL."""
+    if url.startswith("sqlite://"):
+        return SqliteWorkQueue(url[len("sqlite://") :], max_leases=max_leases)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url, max_leases=max_leases)
+    raise ValueError(f"Unsupported work queue URL: {url}")
+
+
+def leased_items(
+    work_queue, node: str, batch_size: int, lease_seconds: float, poll_interval=10
+) -> Iterator[str]:
+    """Yields the objects leased to the node, one batch at a time.
+
+    Waits for the queue to be seeded if it is not yet. Once the queue is empty,
+    waits for the leases of the other nodes to either finish or expire, and stops
+    when no object is queued or leased anymore.
+    """
+    waiting = False
+    while True:
+        items = work_queue.lease(node, batch_size, lease_seconds)
+        if items:
+            yield from items
+            continue
+        # checked before the counts, so that objects added since the lease are
+        # counted once the queue is seeded
+        seeded = work_queue.is_seeded()
+        counts = work_queue.counts()
+        if seeded and not counts.get("queued") and not counts.get("leased"):
+            return
+        if not seeded and not waiting:
+            print("Waiting for the coordinator to seed the work queue")
+            waiting = True
+        time.sleep(poll_interval)
+
+
+class Heartbeat:
+    """Keeps extending the leases of a node from a background thread."""
+
+    def __init__(self, work_queue, node: str, lease_seconds: float) -> None:
+        self.work_queue = work_queue
+        self.node = node
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.thread.join()
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.work_queue.heartbeat(self.node, self.lease_seconds)
+            except Exception as e:
+                print("Failed to send a heartbeat:", e)
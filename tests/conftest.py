@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the scripts import each other as top-level modules
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts")
+sys.path.insert(0, os.path.abspath(SCRIPTS_DIR))
@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+
+from bbox import corners_bounds, points_bounds
+
+
+def random_matrices(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Returns n random world matrices of rotations, scales and translations."""
+    matrices = np.tile(np.eye(4), (n, 1, 1))
+    for matrix in matrices:
+        rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        matrix[:3, :3] = rotation * rng.uniform(0.1, 10, size=3)
+        matrix[:3, 3] = rng.uniform(-100, 100, size=3)
+    return matrices
+
+
+def loop_bounds(points, matrices):
+    """The per-corner loop blender_script.py used before, without mathutils."""
+    bbox_min = (math.inf,) * 3
+    bbox_max = (-math.inf,) * 3
+    for object_points, matrix in zip(points, matrices):
+        for coord in object_points:
+            coord = tuple(
+                sum(matrix[i][j] * coord[j] for j in range(3)) + matrix[i][3]
+                for i in range(3)
+            )
+            bbox_min = tuple(min(x, y) for x, y in zip(bbox_min, coord))
+            bbox_max = tuple(max(x, y) for x, y in zip(bbox_max, coord))
+    return bbox_min, bbox_max
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_corners_bounds_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    num_objects = int(rng.integers(1, 50))
+    low = rng.uniform(-5, 0, size=(num_objects, 3))
+    high = low + rng.uniform(0, 5, size=(num_objects, 3))
+    # the 8 corners of each local bounding box
+    corners = np.array(
+        [
+            [[(l, h)[(i >> k) & 1][k] for k in range(3)] for i in range(8)]
+            for l, h in zip(low, high)
+        ]
+    )
+    matrices = random_matrices(rng, num_objects)
+    bbox_min, bbox_max = corners_bounds(corners, matrices)
+    expected_min, expected_max = loop_bounds(corners, matrices)
+    np.testing.assert_allclose(bbox_min, expected_min, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(bbox_max, expected_max, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_points_bounds_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    num_objects = int(rng.integers(1, 20))
+    points = [
+        rng.normal(size=(int(rng.integers(0, 100)), 3)) for _ in range(num_objects)
+    ]
+    points.append(rng.normal(size=(1, 3)))
+    matrices = random_matrices(rng, len(points))
+    bbox_min, bbox_max = points_bounds(points, matrices)
+    expected_min, expected_max = loop_bounds(points, matrices)
+    np.testing.assert_allclose(bbox_min, expected_min, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(bbox_max, expected_max, rtol=1e-9, atol=1e-9)
+
+
+def test_points_bounds_without_points_is_empty():
+    bbox_min, bbox_max = points_bounds([np.empty((0, 3))], np.eye(4)[None])
+    assert not np.isfinite(bbox_min).any()
+    assert not np.isfinite(bbox_max).any()
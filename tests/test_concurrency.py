@@ -0,0 +1,125 @@
+import time
+
+from concurrency import ConcurrencyController, FakeProbe
+
+
+class FakeGpus:
+    """Render counts of the GPUs that the test advances between steps."""
+
+    def __init__(self, num_gpus):
+        self.succeeded = [0] * num_gpus
+        self.failed = [0] * num_gpus
+        self.scaled = []
+
+    def get_counts(self):
+        return list(self.succeeded), list(self.failed)
+
+    def set_workers(self, gpu, n):
+        self.scaled.append((gpu, n))
+
+
+def make_controller(gpus, probe, **kwargs):
+    controller = ConcurrencyController(
+        num_gpus=probe.num_gpus,
+        initial_workers=2,
+        get_counts=gpus.get_counts,
+        set_workers=gpus.set_workers,
+        probe=probe,
+        interval=1,
+        **kwargs,
+    )
+    controller.counts = gpus.get_counts()
+    return controller
+
+
+def test_adds_workers_until_utilized():
+    gpus = FakeGpus(2)
+    probe = FakeProbe(2, utilization=50)
+    controller = make_controller(gpus, probe, max_workers=4)
+    for renders in [10, 20, 30]:
+        gpus.succeeded = [gpus.succeeded[0] + renders] * 2
+        controller.step(probe())
+    assert controller.workers == [4, 4]
+    probe.stats.utilization = 99
+    gpus.succeeded = [s + 40 for s in gpus.succeeded]
+    controller.step(probe())
+    assert controller.workers == [4, 4]
+    assert gpus.scaled == [(0, 3), (1, 3), (0, 4), (1, 4)]
+
+
+def test_removes_a_worker_when_memory_is_full():
+    gpus = FakeGpus(1)
+    probe = FakeProbe(1, utilization=50, memory_used_mb=23_000)
+    controller = make_controller(gpus, probe, cooldown=2)
+    gpus.succeeded = [10]
+    controller.step(probe())
+    assert controller.workers == [1]
+    # the cooldown holds off adding a worker again
+    probe.stats.memory_used_mb = 0
+    for renders in [20, 30]:
+        gpus.succeeded = [renders]
+        controller.step(probe())
+    assert controller.workers == [1]
+    gpus.succeeded = [40]
+    controller.step(probe())
+    assert controller.workers == [2]
+
+
+def test_removes_a_worker_when_renders_fail():
+    gpus = FakeGpus(1)
+    probe = FakeProbe(1)
+    controller = make_controller(gpus, probe)
+    gpus.succeeded, gpus.failed = [5], [5]
+    controller.step(probe())
+    assert controller.workers == [1]
+
+
+def test_undoes_a_worker_that_lowered_the_throughput():
+    gpus = FakeGpus(1)
+    probe = FakeProbe(1)
+    controller = make_controller(gpus, probe)
+    gpus.succeeded = [10]
+    controller.step(probe())
+    assert controller.workers == [3]
+    gpus.succeeded = [15]
+    controller.step(probe())
+    assert controller.workers == [2]
+
+
+def test_control_loop_probes_in_the_background():
+    calls = []
+
+    def get_counts():
+        # a throughput that keeps growing
+        calls.append(None)
+        return [10 * len(calls) ** 2], [0]
+
+    controller = ConcurrencyController(
+        1, 1, get_counts, lambda gpu, n: None, FakeProbe(1), max_workers=3
+    )
+    controller.interval = 1e-3
+    controller.start()
+    deadline = time.time() + 5
+    while controller.workers != [3] and time.time() < deadline:
+        time.sleep(0.01)
+    controller.stop()
+    assert controller.workers == [3]
+
+
+def test_holds_workers_without_gpu_stats():
+    gpus = FakeGpus(2)
+    probe = FakeProbe(2)
+    controller = make_controller(gpus, probe)
+    gpus.succeeded = [10, 10]
+    # a failed probe
+    controller.step({})
+    assert controller.workers == [2, 2]
+    # a probe that misses a GPU
+    gpus.succeeded = [20, 20]
+    controller.step({1: probe.stats})
+    assert controller.workers == [2, 3]
+    # renders failing still remove a worker
+    gpus.failed = [10, 0]
+    gpus.succeeded = [21, 30]
+    controller.step({})
+    assert controller.workers == [1, 3]
@@ -0,0 +1,109 @@
+import json
+import struct
+
+import pytest
+
+from dedup import ALIAS_FILE, DedupIndex, glb_fingerprint, write_alias_record
+
+
+def write_glb(path, count=8, bbox_max=(1, 2, 3), generator="test") -> str:
+    """Writes a GLB with only the JSON chunk, which is all fingerprints read."""
+    gltf = {
+        "asset": {"version": "2.0", "generator": generator},
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}}]}],
+        "accessors": [{"count": count, "min": [0, 0, 0], "max": list(bbox_max)}],
+    }
+    chunk = json.dumps(gltf).encode()
+    chunk += b" " * (-len(chunk) % 4)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, 20 + len(chunk)))
+        f.write(struct.pack("<II", len(chunk), 0x4E4F534A))
+        f.write(chunk)
+    return str(path)
+
+
+@pytest.fixture
+def objects(tmp_path):
+    """Returns a function that writes an object with the given uid."""
+    return lambda uid, **kwargs: write_glb(tmp_path / f"{uid}.glb", **kwargs)
+
+
+def test_glb_fingerprint(tmp_path, objects):
+    fingerprint = glb_fingerprint(objects("a"))
+    assert fingerprint == "8:0.333,0.667,1.000"
+    # scaled copies match, other vertex counts or proportions do not
+    assert glb_fingerprint(objects("b", bbox_max=(2, 4, 6))) == fingerprint
+    assert glb_fingerprint(objects("c", count=9)) != fingerprint
+    assert glb_fingerprint(objects("d", bbox_max=(1, 1, 1))) != fingerprint
+    (tmp_path / "e.obj").write_text("v 0 0 0\n" * 10)
+    assert glb_fingerprint(str(tmp_path / "e.obj")) is None
+
+
+def test_duplicates_wait_for_their_canonical_object(tmp_path, objects):
+    dedup = DedupIndex(str(tmp_path / "dedup.db"))
+    assert dedup.claim("a", objects("a")) is None
+    # claiming again, e.g. on resume, still renders the object
+    assert dedup.claim("a", objects("a")) is None
+    alias = dedup.claim("b", objects("b"), "https://example.com/b.glb")
+    assert alias.canonical_uid == "a"
+    assert alias.object_path == "https://example.com/b.glb"
+    assert alias.pending
+    assert dedup.stats()["pending_aliases"] == 1
+
+    dedup.record_render("a", 10.0)
+    (done,) = dedup.complete("a")
+    assert (done.uid, done.canonical_uid, done.pending) == ("b", "a", False)
+    assert dedup.complete("a") == []
+    # duplicates of a done object are done right away
+    assert not dedup.claim("c", objects("c")).pending
+    assert dedup.stats() == {
+        "aliases": 2,
+        "pending_aliases": 0,
+        "saved_render_seconds": 20.0,
+    }
+
+
+def test_forget_promotes_the_first_pending_alias(tmp_path, objects):
+    dedup = DedupIndex(str(tmp_path / "dedup.db"))
+    dedup.claim("a", objects("a"))
+    dedup.claim("b", objects("b"))
+    dedup.claim("c", objects("c"))
+    promoted = dedup.forget("a")
+    assert promoted.uid == "b"
+    # b renders in place of a, and the other duplicates now wait for b
+    assert dedup.claim("b", objects("b")) is None
+    assert dedup.claim("d", objects("d")).canonical_uid == "b"
+    assert [alias.uid for alias in dedup.complete("b")] == ["c", "d"]
+    assert dedup.complete("a") == []
+
+
+def test_forget_without_aliases_releases_the_contents(tmp_path, objects):
+    dedup = DedupIndex(str(tmp_path / "dedup.db"))
+    dedup.claim("a", objects("a"))
+    assert dedup.forget("a") is None
+    assert dedup.claim("b", objects("b")) is None
+
+
+def test_geometry_keys(tmp_path, objects):
+    dedup = DedupIndex(str(tmp_path / "dedup.db"), use_geometry=True)
+    dedup.claim("a", objects("a"))
+    # the bytes differ, but not the geometry
+    alias = dedup.claim("b", objects("b", generator="other"))
+    assert alias.canonical_uid == "a"
+    assert alias.key.startswith("geometry:")
+    plain = DedupIndex(str(tmp_path / "plain.db"))
+    plain.claim("a", objects("a"))
+    assert plain.claim("b", objects("b", generator="other")) is None
+
+
+def test_write_alias_record(tmp_path, objects):
+    dedup = DedupIndex(str(tmp_path / "dedup.db"))
+    dedup.claim("a", objects("a"))
+    alias = dedup.claim("b", objects("b"))
+    path = write_alias_record(str(tmp_path / "views"), alias)
+    assert path == str(tmp_path / "views" / "b" / ALIAS_FILE)
+    with open(path) as f:
+        record = json.load(f)
+    assert record["uid"] == "b"
+    assert record["canonical_uid"] == "a"
+    assert record["key"].startswith("sha256:")
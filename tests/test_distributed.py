@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from benchmark import AssetHandler, start_server
+from spans import read_spans
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts")
+
+# uids by contents, with byte-identical duplicates
+GROUPS = {b"first": ["a1", "a2", "a3"], b"second": ["b1", "b2"], b"third": ["c1"]}
+
+
+def test_end_to_end_with_stub_blender(tmp_path):
+    object_paths = []
+    for contents, uids in GROUPS.items():
+        for uid in uids:
+            path = tmp_path / "objects" / f"{uid}.glb"
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(contents)
+            object_paths.append(str(path))
+    (tmp_path / "manifest.json").write_text(json.dumps(object_paths))
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "distributed.py"),
+            "--input_models_path",
+            "manifest.json",
+            "--num_gpus",
+            "1",
+            "--workers_per_gpu",
+            "2",
+            "--blender_path",
+            os.path.join(SCRIPTS_DIR, "stub_blender.py"),
+            "--ledger_path",
+            "ledger.db",
+            "--dedup_path",
+            "dedup.db",
+        ],
+        cwd=tmp_path,
+        env={**os.environ, "STUB_BLENDER_LATENCY": "0.01"},
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+
+    states = dict(
+        sqlite3.connect(tmp_path / "ledger.db").execute("SELECT uid, state FROM jobs")
+    )
+    views_dir = tmp_path / "views"
+    for uids in GROUPS.values():
+        (canonical,) = [uid for uid in uids if states[uid] == "rendered"]
+        assert len(os.listdir(views_dir / canonical)) == 12
+        for uid in uids:
+            if uid == canonical:
+                continue
+            assert states[uid] == "duplicate"
+            alias = json.loads((views_dir / uid / "alias.json").read_text())
+            assert alias["canonical_uid"] == canonical
+
+    spans = read_spans(str(tmp_path / "spans.jsonl"))
+    rendered = {s["uid"] for s in spans if s["stage"] == "render_object"}
+    assert rendered == {uid for uid, state in states.items() if state == "rendered"}
+
+
+@pytest.mark.parametrize(
+    "env, error",
+    [
+        ({"STUB_BLENDER_HANG_RATE": "1"}, "Timed out after 1.0 seconds"),
+        ({"STUB_BLENDER_CRASH_RATE": "1"}, "Render server exited with code 1"),
+    ],
+)
+def test_poison_objects_are_quarantined(tmp_path, env, error):
+    object_paths = []
+    for uid in ["p1", "p2"]:
+        path = tmp_path / f"{uid}.glb"
+        path.write_bytes(uid.encode())
+        object_paths.append(str(path))
+    (tmp_path / "manifest.json").write_text(json.dumps(object_paths))
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "distributed.py"),
+            "--input_models_path",
+            "manifest.json",
+            "--num_gpus",
+            "1",
+            "--workers_per_gpu",
+            "2",
+            "--blender_path",
+            os.path.join(SCRIPTS_DIR, "stub_blender.py"),
+            "--ledger_path",
+            "ledger.db",
+            "--render_timeout",
+            "1",
+            "--max_attempts",
+            "2",
+            "--retry_backoff",
+            "0",
+        ],
+        cwd=tmp_path,
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+
+    rows = sqlite3.connect(tmp_path / "ledger.db").execute(
+        "SELECT uid, state, attempts, error FROM jobs"
+    )
+    assert sorted(rows) == [
+        ("p1", "quarantined", 2, error),
+        ("p2", "quarantined", 2, error),
+    ]
+    with open(tmp_path / "quarantine.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(r["uid"] for r in records) == ["p1", "p2"]
+    assert {r["error"] for r in records} == {error}
+    # no views are left of the failed attempts
+    assert not list(tmp_path.glob("views/*"))
+
+
+def test_duplicates_of_a_failed_object_are_downloaded_again(tmp_path):
+    asset_dir = tmp_path / "assets"
+    asset_dir.mkdir()
+    for uid in ["d1", "d2", "d3"]:
+        (asset_dir / f"{uid}.glb").write_bytes(b"same")
+    server = start_server(AssetHandler, 0.0, str(asset_dir))
+    host, port = server.server_address
+    urls = [f"http://{host}:{port}/{uid}.glb" for uid in ["d1", "d2", "d3"]]
+    (tmp_path / "manifest.json").write_text(json.dumps(urls))
+    try:
+        result = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(SCRIPTS_DIR, "distributed.py"),
+                "--input_models_path",
+                "manifest.json",
+                "--num_gpus",
+                "1",
+                "--workers_per_gpu",
+                "2",
+                "--blender_path",
+                os.path.join(SCRIPTS_DIR, "stub_blender.py"),
+                "--ledger_path",
+                "ledger.db",
+                "--dedup_path",
+                "dedup.db",
+                "--max_attempts",
+                "1",
+            ],
+            cwd=tmp_path,
+            env={**os.environ, "STUB_BLENDER_FAILURE_RATE": "1"},
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert result.returncode == 0, result.stderr
+
+    # each duplicate took the place of the one before it, from its own download
+    rows = sqlite3.connect(tmp_path / "ledger.db").execute(
+        "SELECT uid, state, attempts, error FROM jobs"
+    )
+    for uid, state, attempts, error in rows:
+        assert (state, attempts) == ("quarantined", 1), uid
+        assert error.startswith("RuntimeError: Fake render failure"), error
+    spans = read_spans(str(tmp_path / "spans.jsonl"))
+    downloads = sorted(s["uid"] for s in spans if s["stage"] == "download")
+    # once by the prefetcher, and again when promoted in place of the first one
+    assert len(downloads) == 5
+    assert len({uid for uid in downloads if downloads.count(uid) == 1}) == 1
+    assert not os.listdir(tmp_path / "tmp-objects")
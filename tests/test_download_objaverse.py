@@ -0,0 +1,96 @@
+import json
+
+import boto3
+import pytest
+from download_objaverse import ALIASED, get_completed_uids, refresh_prefix
+from moto import mock_aws
+
+BUCKET = "objaverse-images"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+def upload_views(s3, uid, num_views):
+    for i in range(num_views):
+        s3.put_object(Bucket=BUCKET, Key=f"{uid}/{i:03d}.png", Body=b"")
+
+
+def test_completed_uids_and_snapshot(tmp_path, s3):
+    upload_views(s3, "aa01", 3)
+    upload_views(s3, "aa02", 2)
+    upload_views(s3, "f003", 3)
+    s3.put_object(Bucket=BUCKET, Key="f004/alias.json", Body=b"{}")
+    snapshot_path = str(tmp_path / "snapshot.json")
+
+    completed = get_completed_uids(
+        num_views=3, bucket=BUCKET, snapshot_path=snapshot_path, num_workers=4
+    )
+    assert completed == {"aa01", "f003", "f004"}
+    with open(snapshot_path) as f:
+        assert json.load(f) == {"aa01": 3, "aa02": 2, "f003": 3, "f004": ALIASED}
+
+    # finishing one directory and adding new ones shows up in the next refresh
+    upload_views(s3, "aa02", 3)
+    upload_views(s3, "aa05", 3)
+    upload_views(s3, "b006", 1)
+    completed = get_completed_uids(
+        num_views=3, bucket=BUCKET, snapshot_path=snapshot_path, num_workers=4
+    )
+    assert completed == {"aa01", "aa02", "aa05", "f003", "f004"}
+    with open(snapshot_path) as f:
+        assert json.load(f)["b006"] == 1
+
+
+def test_without_snapshot(s3):
+    upload_views(s3, "0a01", 12)
+    upload_views(s3, "0a02", 11)
+    assert get_completed_uids(bucket=BUCKET, num_workers=4) == {"0a01"}
+
+
+class CountingClient:
+    """Counts the listings made through the paginator."""
+
+    def __init__(self, s3):
+        self.s3 = s3
+        self.listed = []
+
+    def get_paginator(self, name):
+        paginator = self.s3.get_paginator(name)
+        client = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                client.listed.append(kwargs["Prefix"])
+                return paginator.paginate(**kwargs)
+
+        return Paginator()
+
+
+def test_refresh_lists_only_incomplete_directories(s3):
+    # directories the snapshot has as complete are trusted without listing them
+    for uid, num_files in [("ab00", 1), ("ab01", 1), ("ab02", 2), ("ab03", 1)]:
+        upload_views(s3, uid, num_files)
+    client = CountingClient(s3)
+    known = {"ab00": 600, "ab01": 600, "ab02": 1}
+    counts = refresh_prefix(client, BUCKET, "ab", known, num_views=600)
+    assert counts == {"ab00": 600, "ab01": 600, "ab02": 2, "ab03": 1}
+    assert sorted(client.listed) == ["ab", "ab02/", "ab03/"]
+
+
+def test_refresh_lists_the_whole_prefix_when_most_directories_are_new(s3):
+    for i in range(10):
+        upload_views(s3, f"ab{i:02d}", 3)
+    client = CountingClient(s3)
+    counts = refresh_prefix(client, BUCKET, "ab", {"ab00": 3}, num_views=3)
+    assert counts == {f"ab{i:02d}": 3 for i in range(10)}
+    # one listing of the directories and one of every file under the prefix
+    assert client.listed == ["ab", "ab"]
@@ -0,0 +1,46 @@
+import json
+import sqlite3
+
+from ledger import Ledger
+
+
+def test_add_is_idempotent(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    assert ledger.is_empty()
+    ledger.add(["/objects/a.glb", "/objects/b.glb"])
+    ledger.set_state("a", "rendered")
+    ledger.add(["/objects/a.glb", "/objects/c.glb"])
+    assert not ledger.is_empty()
+    assert ledger.counts() == {"queued": 2, "rendered": 1}
+
+
+def test_pending_depends_on_the_finished_state(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    paths = [f"/objects/{uid}.glb" for uid in "abcdef"]
+    ledger.add(paths)
+    ledger.set_state("b", "rendering")
+    ledger.set_state("c", "rendered")
+    ledger.set_state("d", "uploaded")
+    ledger.set_state("e", "failed", error="boom")
+    ledger.set_state("f", "quarantined", error="boom")
+    assert sorted(ledger.pending("uploaded")) == paths[:3] + [paths[4]]
+    assert sorted(ledger.pending("rendered")) == paths[:2] + [paths[4]]
+
+
+def test_set_state_records_attempts_timings_and_info(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    ledger = Ledger(path)
+    ledger.add(["/objects/a.glb"])
+    ledger.set_state("a", "rendering")
+    ledger.set_state("a", "rendering")
+    ledger.set_state(
+        "a", "rendered", render_info={"num_meshes": 3}, render_seconds=1.5
+    )
+    assert ledger.render_seconds() == {"a": 1.5}
+    row = (
+        sqlite3.connect(path)
+        .execute("SELECT attempts, render_info FROM jobs WHERE uid = 'a'")
+        .fetchone()
+    )
+    assert row[0] == 2
+    assert json.loads(row[1]) == {"num_meshes": 3}
@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+from manifest import CountingIterator, iter_json_array, iter_manifest, write_manifest
+
+PATHS = [f"https://example.com/objects/{i:032x}.glb" for i in range(100)]
+
+
+@pytest.mark.parametrize(
+    "name", ["manifest.json", "manifest.jsonl", "manifest.json.gz", "manifest.jsonl.gz"]
+)
+def test_write_and_iter_manifest(tmp_path, name):
+    path = str(tmp_path / name)
+    write_manifest(path, iter(PATHS))
+    assert list(iter_manifest(path)) == PATHS
+
+
+def test_iter_manifest_reads_bare_lines(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text("a.glb\n\n" + json.dumps("b.glb") + "\n")
+    assert list(iter_manifest(str(path))) == ["a.glb", "b.glb"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 16])
+def test_iter_json_array_across_chunks(chunk_size):
+    values = ["a", 'quote " and ]', "comma, bracket [", {"nested": [1, 2]}, 3]
+    f = io.StringIO(json.dumps(values, indent=2))
+    assert list(iter_json_array(f, chunk_size=chunk_size)) == values
+
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_iter_json_array_numbers_across_chunks(chunk_size):
+    # every chunk size splits some of the numbers
+    values = [123456789, -2.5e-3, 0, 42, True, None]
+    f = io.StringIO(json.dumps(values, separators=(",", ":")))
+    assert list(iter_json_array(f, chunk_size=chunk_size)) == values
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+@pytest.mark.parametrize("text", ["", "[1, 2", "[1 2]", "[1,]", "[,1]", '{"a": 1}'])
+def test_iter_json_array_rejects_invalid_arrays(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+
+def test_counting_iterator():
+    items = CountingIterator(iter(range(3)))
+    assert items.count == 0
+    assert next(iter(items)) == 0
+    assert items.count == 1 and not items.exhausted
+    items = CountingIterator(range(3))
+    assert list(items) == [0, 1, 2]
+    assert items.count == 3 and items.exhausted
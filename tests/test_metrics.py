@@ -0,0 +1,95 @@
+import multiprocessing
+import sys
+import types
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry, MetricsServer, WandbExporter
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    registry.counter("renders_total", "Renders")
+    registry.gauge("depth", "Queue depth", lambda: 7, stage="render")
+    registry.histogram("seconds", "Render time", buckets=(1, 10))
+    registry.start()
+    yield registry
+    registry.stop()
+
+
+def test_exposition(registry):
+    registry.inc("renders_total", gpu=0)
+    registry.inc("renders_total", 2, gpu=0)
+    registry.inc("renders_total", status='say "hi"')
+    registry.set("depth", 3, stage="upload")
+    for value in [0.5, 5, 50]:
+        registry.observe("seconds", value)
+    lines = registry.exposition().splitlines()
+    assert "# TYPE renders_total counter" in lines
+    assert 'renders_total{gpu="0"} 3.0' in lines
+    assert 'renders_total{status="say \\"hi\\""} 1.0' in lines
+    assert 'depth{stage="render"} 7.0' in lines
+    assert 'depth{stage="upload"} 3.0' in lines
+    assert 'seconds_bucket{le="1.0"} 1' in lines
+    assert 'seconds_bucket{le="10.0"} 2' in lines
+    assert 'seconds_bucket{le="+Inf"} 3' in lines
+    assert "seconds_sum 55.5" in lines
+    assert "seconds_count 3" in lines
+
+
+def test_collect(registry):
+    registry.inc("renders_total", gpu=1)
+    registry.observe("seconds", 2)
+    samples = registry.collect()
+    assert samples["renders_total"] == {'{gpu="1"}': 1}
+    assert samples["depth"] == {'{stage="render"}': 7}
+    assert samples["seconds_count"] == {"": 1}
+    assert samples["seconds_sum"] == {"": 2}
+
+
+def increment(registry: MetricsRegistry) -> None:
+    registry.inc("renders_total", gpu=1)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork"
+)
+def test_updates_from_forked_processes():
+    registry = MetricsRegistry()
+    registry.counter("renders_total", "Renders")
+    registry.start()
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=increment, args=(registry,)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    registry.stop()
+    assert registry.collect()["renders_total"] == {'{gpu="1"}': 3}
+
+
+def test_metrics_server(registry):
+    registry.inc("renders_total")
+    server = MetricsServer(registry, 0, host="127.0.0.1")
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode()
+    finally:
+        server.stop()
+    assert "renders_total 1.0" in body.splitlines()
+
+
+def test_wandb_exporter_logs_rates(registry, monkeypatch):
+    logged = []
+    monkeypatch.setitem(sys.modules, "wandb", types.SimpleNamespace(log=logged.append))
+    exporter = WandbExporter(registry)
+    registry.inc("renders_total", 4, gpu=0)
+    exporter.previous_time -= 2
+    exporter.log()
+    assert logged[0]["renders_total/gpu=0"] == 4
+    assert logged[0]["renders_total/gpu=0/rate"] == pytest.approx(2, rel=0.01)
+    assert logged[0]["depth/stage=render"] == 7
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+from object_cache import ObjectCache, file_sha256
+
+
+def writer(contents, calls=None):
+    def download(path):
+        if calls is not None:
+            calls.append(path)
+        with open(path, "wb") as f:
+            f.write(contents)
+
+    return download
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ObjectCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    calls = []
+    dst = str(tmp_path / "a.glb")
+    assert cache.fetch("a", ".glb", writer(b"aaa", calls), dst) is False
+    os.remove(dst)
+    assert cache.fetch("a", ".glb", writer(b"aaa", calls), dst) is True
+    assert len(calls) == 1
+    with open(dst, "rb") as f:
+        assert f.read() == b"aaa"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_identical_contents_share_a_blob(tmp_path):
+    cache = ObjectCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    cache.fetch("a", ".glb", writer(b"same"), str(tmp_path / "a.glb"))
+    cache.fetch("b", ".glb", writer(b"same"), str(tmp_path / "b.glb"))
+    blobs = os.listdir(tmp_path / "cache" / "blobs")
+    assert blobs == [file_sha256(str(tmp_path / "a.glb")) + ".glb"]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ObjectCache(str(tmp_path / "cache"), max_bytes=25)
+    for uid in "abc":
+        cache.fetch(uid, ".glb", writer(uid.encode() * 10), str(tmp_path / uid))
+        # mtimes have to differ for the eviction order
+        time.sleep(0.01)
+    assert cache.stats()["evictions"] == 1
+    calls = []
+    assert cache.fetch("c", ".glb", writer(b"c" * 10, calls), str(tmp_path / "c"))
+    assert not cache.fetch("a", ".glb", writer(b"a" * 10, calls), str(tmp_path / "a"))
+    assert len(calls) == 1
+    # b was used least recently once c was hit
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["evicted_bytes"] == 20
+    # the hard link handed out before the eviction is still intact
+    with open(tmp_path / "b", "rb") as f:
+        assert f.read() == b"b" * 10
+
+
+def test_failed_download_leaves_nothing_behind(tmp_path):
+    cache = ObjectCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+
+    def fail(path):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise OSError("connection reset")
+
+    try:
+        cache.fetch("a", ".glb", fail, str(tmp_path / "a.glb"))
+    except OSError:
+        pass
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+    assert os.listdir(tmp_path / "cache" / "blobs") == []
+    assert not os.path.exists(tmp_path / "a.glb")
+
+
+def test_concurrent_fetches_download_once(tmp_path):
+    cache = ObjectCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    calls = []
+
+    def slow_download(path):
+        calls.append(path)
+        time.sleep(0.2)
+        writer(b"slow")(path)
+
+    threads = [
+        threading.Thread(
+            target=cache.fetch,
+            args=("a", ".glb", slow_download, str(tmp_path / f"a{i}.glb")),
+        )
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    for i in range(4):
+        with open(tmp_path / f"a{i}.glb", "rb") as f:
+            assert f.read() == b"slow"
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+from object_index import ObjectIndex, build_index
+
+OBJECT_PATHS = {
+    f"{i:032x}": f"glbs/000-{i % 160:03d}/{i:032x}.glb" for i in range(1000)
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "object-index.bin")
+    build_index(path, OBJECT_PATHS, seed=42)
+    return ObjectIndex(path)
+
+
+def test_order_matches_the_seeded_shuffle(index):
+    # the way download_objaverse.py used to pick the objects
+    random.seed(42)
+    uids = list(OBJECT_PATHS)
+    random.shuffle(uids)
+    assert len(index) == len(uids)
+    assert [index.uid(i) for i in range(len(index))] == uids
+    assert index.slice(100, 110) == [(uid, OBJECT_PATHS[uid]) for uid in uids[100:110]]
+    assert index.slice(990, 2000) == [(uid, OBJECT_PATHS[uid]) for uid in uids[990:]]
+
+
+def test_lookup(index):
+    for uid in random.Random(0).sample(list(OBJECT_PATHS), 50):
+        assert index.lookup(uid) == OBJECT_PATHS[uid]
+    assert index.lookup("f" * 32) is None
+    assert index.lookup("") is None
+
+
+def test_rejects_other_files(tmp_path):
+    with pytest.raises(ValueError):
+        build_index(str(tmp_path / "index.bin"), {"short": "glbs/short.glb"})
+    path = tmp_path / "not-an-index.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        ObjectIndex(str(path))
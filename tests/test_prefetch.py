@@ -0,0 +1,74 @@
+import os
+import queue
+import time
+
+import pytest
+from benchmark import AssetHandler, start_server
+from prefetch import Prefetcher, get_uid
+
+
+@pytest.fixture
+def asset_server(tmp_path):
+    asset_dir = tmp_path / "assets"
+    asset_dir.mkdir()
+    for i in range(6):
+        (asset_dir / f"obj{i}.glb").write_bytes(b"glb" * (i + 1))
+    server = start_server(AssetHandler, 0.0, str(asset_dir))
+    host, port = server.server_address
+    yield asset_dir, f"http://{host}:{port}"
+    server.shutdown()
+    server.server_close()
+
+
+def drain(render_queue):
+    items = []
+    while True:
+        try:
+            items.append(render_queue.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def test_downloads_urls_and_hands_on_local_paths(tmp_path, asset_server):
+    asset_dir, base_url = asset_server
+    local_object = tmp_path / "local.glb"
+    local_object.write_bytes(b"local")
+    urls = [f"{base_url}/obj{i}.glb" for i in range(6)]
+    errors = []
+    render_queue = queue.Queue()
+    prefetcher = Prefetcher(
+        render_queue,
+        download_dir=str(tmp_path / "downloads"),
+        num_workers=3,
+        on_error=lambda item, e: errors.append(item),
+    )
+    prefetcher.start(urls + [f"{base_url}/missing.glb", str(local_object)])
+    prefetcher.join()
+
+    paths = drain(render_queue)
+    assert sorted(map(get_uid, paths)) == ["local"] + [f"obj{i}" for i in range(6)]
+    assert str(local_object) in paths
+    for path in paths:
+        assert os.path.isabs(path)
+        if path != str(local_object):
+            with open(path, "rb") as f:
+                assert f.read() == (asset_dir / os.path.basename(path)).read_bytes()
+    assert errors == [f"{base_url}/missing.glb"]
+    # no partial downloads are left behind
+    assert not [f for f in os.listdir(tmp_path / "downloads") if f.endswith(".tmp")]
+
+
+def test_downloads_stay_bounded_by_the_render_queue(tmp_path, asset_server):
+    _, base_url = asset_server
+    download_dir = tmp_path / "downloads"
+    render_queue = queue.Queue(maxsize=2)
+    prefetcher = Prefetcher(render_queue, download_dir=str(download_dir), num_workers=1)
+    prefetcher.start([f"{base_url}/obj{i}.glb" for i in range(6)])
+    time.sleep(0.5)
+    # two objects on the queue and one waiting to be put on it
+    assert len(os.listdir(download_dir)) == 3
+    paths = []
+    while len(paths) < 6:
+        paths.append(render_queue.get(timeout=5))
+    prefetcher.join()
+    assert len(set(paths)) == 6
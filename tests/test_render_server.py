@@ -0,0 +1,92 @@
+import os
+import sys
+
+from conftest import SCRIPTS_DIR
+from render_server import RenderServer
+
+
+def fake_server(output_dir, *args, **kwargs):
+    command = [
+        sys.executable,
+        os.path.join(SCRIPTS_DIR, "render_server.py"),
+        "--output_dir",
+        str(output_dir),
+        "--num_images",
+        "2",
+        *args,
+    ]
+    return RenderServer(command, **kwargs)
+
+
+def write_object(tmp_path, name, contents=b"glb"):
+    path = tmp_path / name
+    path.write_bytes(contents)
+    return str(path)
+
+
+def test_render_protocol(tmp_path):
+    server = fake_server(tmp_path / "views")
+    try:
+        object_path = write_object(tmp_path, "abc.glb", b"1234")
+        result = server.render(object_path)
+        assert result["success"] and result["error"] is None
+        assert result["object_path"] == object_path
+        assert result["duration"] >= 0
+        assert result["info"]["size_bytes"] == 4
+        assert sorted(os.listdir(tmp_path / "views" / "abc")) == ["000.png", "001.png"]
+
+        result = server.render(str(tmp_path / "missing.glb"))
+        assert not result["success"]
+        assert result["error"].startswith("FileNotFoundError")
+        # a failed render leaves the process running for the next object
+        assert server.render(object_path)["success"]
+    finally:
+        server.close()
+    assert server.process is None and server.tmp_dir is None
+
+
+def test_recycles_after_max_objects(tmp_path):
+    server = fake_server(tmp_path / "views", max_objects=2)
+    try:
+        pids = []
+        for i in range(5):
+            object_path = write_object(tmp_path, f"{i}.glb")
+            assert server.render(object_path)["success"]
+            pids.append(None if server.process is None else server.process.pid)
+        # closed after every second render and started again by the next one
+        assert pids[1] is None and pids[3] is None
+        assert len({pids[0], pids[2], pids[4]}) == 3
+    finally:
+        server.close()
+
+
+def test_startup_failure_is_a_failed_render(tmp_path):
+    server = RenderServer([sys.executable, "-c", "import sys; sys.exit(3)"])
+    result = server.render(write_object(tmp_path, "abc.glb"))
+    assert not result["success"]
+    assert "exited with code 3" in result["error"]
+    assert server.process is None
+
+
+def test_hanging_render_is_killed_on_timeout(tmp_path):
+    server = fake_server(tmp_path / "views", "--hang_rate", "1", timeout=1)
+    try:
+        result = server.render(write_object(tmp_path, "abc.glb"))
+        assert not result["success"]
+        assert result["error"] == "Timed out after 1 seconds"
+        assert 1 <= result["duration"] < 10
+        assert server.process is None
+    finally:
+        server.close()
+
+
+def test_crashing_render_is_reported(tmp_path):
+    server = fake_server(tmp_path / "views", "--crash_rate", "1")
+    try:
+        result = server.render(write_object(tmp_path, "abc.glb"))
+        assert not result["success"]
+        assert result["error"] == "Render server exited with code 1"
+        # the next render starts a fresh process, which crashes again
+        assert not server.render(write_object(tmp_path, "def.glb"))["success"]
+    finally:
+        server.close()
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from ledger import Ledger
+from scheduling import estimate_costs, fit_size_model, longest_first, makespan
+
+
+def test_makespan():
+    assert makespan([], 4) == 0
+    assert makespan([3, 3, 3, 3], 2) == 6
+    # each object goes to the first free worker, in order
+    assert makespan([1, 1, 4], 2) == 5
+    assert makespan([4, 1, 1], 2) == 4
+
+
+def test_longest_first_without_tail():
+    costs = [1.0, 5.0, 3.0, 2.0]
+    assert longest_first(costs, [True] * 4, 2, known_tail=0) == [1, 2, 3, 0]
+
+
+def test_longest_first_keeps_known_tail_after_unknown_objects():
+    costs = [10.0, 1.0, 1.0, 2.0, 2.0, 5.0]
+    known = [True, True, True, False, False, True]
+    order = longest_first(costs, known, num_workers=1, known_tail=0.2)
+    # the cheapest known objects adding up to 0.2 * 10 come last
+    assert order[-2:] == [1, 2]
+    assert sorted(order) == list(range(len(costs)))
+    assert set(order[:-2]) == {0, 3, 4, 5}
+
+
+def test_longest_first_moves_at_most_half_of_the_work():
+    costs = [1.0] * 10
+    known = [True] * 8 + [False] * 2
+    order = longest_first(costs, known, num_workers=100, known_tail=10)
+    # a tail of 10 * 100 is capped at half of the 10 seconds of work
+    assert order == [0, 1, 2, 8, 9, 3, 4, 5, 6, 7]
+
+
+def test_fit_size_model():
+    costs = {"a": 1.0, "b": 3.0, "c": 5.0}
+    sizes = {"a": 0, "b": 100, "c": 200}
+    intercept, slope = fit_size_model(costs, sizes)
+    assert intercept == pytest.approx(1.0)
+    assert slope == pytest.approx(0.02)
+    assert fit_size_model({"a": 1.0}, {"a": 10}) is None
+
+
+def test_estimate_costs(tmp_path):
+    spans_path = tmp_path / "spans.jsonl"
+    spans = [
+        {"uid": "a", "stage": "render_object", "duration": 2.0, "success": True},
+        {"uid": "a", "stage": "render_object", "duration": 4.0, "success": True},
+        {"uid": "a", "stage": "download", "duration": 1.0, "size_bytes": 100},
+        {"uid": "b", "stage": "render_object", "duration": 9.0, "success": False},
+    ]
+    spans_path.write_text("".join(json.dumps(span) + "\n" for span in spans))
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.add(["/objects/c.glb"])
+    ledger.set_state("c", "rendered", render_seconds=7.0)
+
+    costs, known = estimate_costs(
+        ["/objects/a.glb", "/objects/c.glb", "/objects/d.glb"],
+        str(spans_path),
+        ledger,
+    )
+    # a: mean of its successful renders, c: from the ledger, d: the median
+    assert costs == [3.0, 7.0, 5.0]
+    assert known == [True, True, False]
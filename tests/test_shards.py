@@ -0,0 +1,56 @@
+import json
+import queue
+import tarfile
+
+from shards import ShardWriter, pack_record
+
+
+def write_views(views_dir, uid, view_bytes=100):
+    path = views_dir / uid
+    path.mkdir(parents=True)
+    for i in range(2):
+        (path / f"{i:03d}.png").write_bytes(b"x" * view_bytes)
+    (path / "cameras.json").write_text(json.dumps({"uid": uid}))
+    return str(path)
+
+
+def test_pack_record(tmp_path):
+    record_path = pack_record(write_views(tmp_path, "abc"))
+    assert record_path == str(tmp_path / "abc.tar")
+    assert not (tmp_path / "abc").exists()
+    with tarfile.open(record_path) as tar:
+        assert tar.getnames() == ["abc.000.png", "abc.001.png", "abc.json"]
+        assert json.load(tar.extractfile("abc.json")) == {"uid": "abc"}
+
+
+def test_shard_writer_splits_by_size(tmp_path):
+    shards = []
+    writer = ShardWriter(
+        str(tmp_path / "shards"),
+        max_shard_bytes=10_000,
+        on_shard=lambda path, uids: shards.append((path, list(uids))),
+    )
+    pack_queue = queue.Queue()
+    writer.start(pack_queue)
+    uids = [f"uid{i}" for i in range(5)]
+    for uid in uids:
+        pack_queue.put(pack_record(write_views(tmp_path / "views", uid, 2000)))
+    pack_queue.put(None)
+    writer.join()
+
+    # every record takes about 9 kB with its headers, so a shard closes after two
+    assert [shard_uids for _, shard_uids in shards] == [
+        ["uid0", "uid1"],
+        ["uid2", "uid3"],
+        ["uid4"],
+    ]
+    names = []
+    for path, _ in shards:
+        assert path.endswith(".tar")
+        with tarfile.open(path) as tar:
+            names.extend(tar.getnames())
+    members = ["000.png", "001.png", "json"]
+    assert names == [f"{uid}.{member}" for uid in uids for member in members]
+    # the records are removed once they are in a shard
+    assert list((tmp_path / "views").iterdir()) == []
+    assert not [p for p in (tmp_path / "shards").iterdir() if p.suffix == ".tmp"]
@@ -0,0 +1,40 @@
+from simulate import Args, Layout, ObjectTimings, Simulation
+
+
+def simulate(num_objects, failure_rate, **kwargs):
+    args = Args(**{"blender_startup": 0, "render_cpu_fraction": 0, **kwargs})
+    objects = [ObjectTimings(download=0, render=1, upload=0)] * num_objects
+    layout = Layout(num_gpus=1, workers_per_gpu=1, download_workers=1, upload_workers=0)
+    return Simulation(objects, layout, args, failure_rate).run()
+
+
+def test_retries_do_not_hold_the_worker():
+    result = simulate(
+        2,
+        failure_rate=1.0,
+        max_attempts=2,
+        retry_backoff=100,
+        failure_restart_fraction=0,
+    )
+    # both objects fail once, then both retries start 100 seconds later, one
+    # after the other, instead of the worker sleeping through each backoff
+    assert result["makespan"] == 103
+    assert result["quarantined"] == 2
+    assert result["render_utilization"] == 4 / 103
+
+
+def test_blender_is_recycled():
+    result = simulate(
+        4, failure_rate=0.0, blender_startup=10, max_objects_per_blender=2
+    )
+    # started once up front, and again before the third object
+    assert result["makespan"] == 24
+    assert result["blender_restarts"] == 1
+    assert result["objects"] == 4
+
+
+def test_failed_renders_restart_blender():
+    result = simulate(2, failure_rate=1.0, blender_startup=10, max_attempts=1)
+    # the first failure killed Blender, so the second object starts a new one
+    assert result["blender_restarts"] == 1
+    assert result["makespan"] == 22
@@ -0,0 +1,134 @@
+import queue
+
+import boto3
+import pytest
+from moto import mock_aws
+from uploader import Uploader, make_s3_client
+
+BUCKET = "renders"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield make_s3_client(4)
+
+
+def bucket_contents(s3):
+    objects = s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    return {
+        o["Key"]: s3.get_object(Bucket=BUCKET, Key=o["Key"])["Body"].read()
+        for o in objects
+    }
+
+
+def write_views(views_dir, uid, num_views=3):
+    path = views_dir / uid
+    path.mkdir(parents=True)
+    for i in range(num_views):
+        (path / f"{i:03d}.png").write_bytes(f"{uid}-{i}".encode())
+    return str(path)
+
+
+class FlakyClient:
+    """Fails the first `failures` uploads of every key."""
+
+    def __init__(self, s3, failures):
+        self.s3 = s3
+        self.failures = failures
+        self.attempts = {}
+
+    def upload_file(self, path, bucket, key):
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        if self.attempts[key] <= self.failures:
+            raise ConnectionError("connection reset")
+        self.s3.upload_file(path, bucket, key)
+
+
+def run(uploader, paths):
+    upload_queue = queue.Queue()
+    uploader.start(upload_queue)
+    for path in paths:
+        upload_queue.put(path)
+    upload_queue.put(None)
+    uploader.join()
+
+
+def test_uploads_views_and_removes_them(tmp_path, s3):
+    uploaded = []
+    uploader = Uploader(
+        s3,
+        BUCKET,
+        num_workers=2,
+        max_in_flight_bytes=8,
+        on_upload=lambda uid, success: uploaded.append((uid, success)),
+    )
+    paths = [write_views(tmp_path / "views", uid) for uid in ["a", "b", "c"]]
+    run(uploader, paths)
+
+    contents = bucket_contents(s3)
+    assert len(contents) == 9
+    assert contents["b/001.png"] == b"b-1"
+    assert sorted(uploaded) == [("a", True), ("b", True), ("c", True)]
+    assert uploader.num_uploaded == 3 and uploader.failed == []
+    assert list((tmp_path / "views").iterdir()) == []
+    assert uploader.in_flight_bytes == 0
+
+
+def test_uploads_shards_with_their_uids(tmp_path, s3):
+    uploaded = []
+    uploader = Uploader(
+        s3, BUCKET, on_upload=lambda uid, success: uploaded.append((uid, success))
+    )
+    shard_path = tmp_path / "shard-000000.tar"
+    shard_path.write_bytes(b"tar")
+    upload_queue = queue.Queue()
+    uploader.start(upload_queue)
+    uploader.upload_shard(str(shard_path), ["a", "b"])
+    upload_queue.put(None)
+    uploader.join()
+
+    assert bucket_contents(s3) == {"shards/shard-000000.tar": b"tar"}
+    assert uploaded == [("a", True), ("b", True)]
+    assert not shard_path.exists()
+
+
+def test_retries_failed_uploads(tmp_path, s3):
+    client = FlakyClient(s3, failures=2)
+    uploader = Uploader(client, BUCKET, max_retries=2, backoff=0)
+    run(uploader, [write_views(tmp_path / "views", "a", num_views=2)])
+    assert set(bucket_contents(s3)) == {"a/000.png", "a/001.png"}
+    assert client.attempts == {"a/000.png": 3, "a/001.png": 3}
+
+
+def test_keeps_views_that_failed_to_upload(tmp_path, s3):
+    uploaded = []
+    uploader = Uploader(
+        FlakyClient(s3, failures=3),
+        BUCKET,
+        max_retries=2,
+        backoff=0,
+        on_upload=lambda uid, success: uploaded.append((uid, success)),
+    )
+    path = write_views(tmp_path / "views", "a")
+    run(uploader, [path])
+    assert uploaded == [("a", False)]
+    assert uploader.failed == [path]
+    assert len(list((tmp_path / "views" / "a").iterdir())) == 3
+
+
+def test_keeps_dispatching_after_an_unreadable_directory(tmp_path, s3):
+    uploaded = []
+    uploader = Uploader(
+        s3, BUCKET, on_upload=lambda uid, success: uploaded.append((uid, success))
+    )
+    missing = str(tmp_path / "views" / "gone")
+    paths = [missing, write_views(tmp_path / "views", "a")]
+    run(uploader, paths)
+    assert uploaded == [("gone", False), ("a", True)]
+    assert uploader.failed == [missing]
+    assert set(bucket_contents(s3)) == {"a/000.png", "a/001.png", "a/002.png"}
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from view_quality import (
+    adjusted_camera_dist,
+    summarize_problems,
+    view_problems,
+    view_stats,
+)
+
+
+def square(size: int, low: int, high: int) -> np.ndarray:
+    """Returns the alpha of a view with an opaque square from low to high."""
+    alpha = np.zeros((size, size), dtype=np.float32)
+    alpha[low:high, low:high] = 1
+    return alpha
+
+
+def problems_of(alphas):
+    return view_problems(
+        view_stats(alphas), min_coverage=0.001, max_edge_coverage=0.01, min_fill=0.2
+    )
+
+
+def test_view_stats():
+    stats = view_stats([square(100, 25, 75), np.zeros((10, 20)), np.ones((4, 4))])
+    assert stats[0] == {"coverage": 0.25, "edge_coverage": 0, "fill": 0.5}
+    assert stats[1] == {"coverage": 0, "edge_coverage": 0, "fill": 0}
+    assert stats[2] == {"coverage": 1, "edge_coverage": 1, "fill": 1}
+
+
+def test_view_stats_of_a_wide_object():
+    alpha = np.zeros((50, 100))
+    alpha[20:30, 10:90] = 1
+    (stats,) = view_stats([alpha])
+    assert stats["fill"] == pytest.approx(0.8)
+
+
+def test_view_problems():
+    good = square(100, 20, 80)
+    clipped = square(100, 0, 60)
+    small = square(100, 48, 52)
+    empty = np.zeros((100, 100))
+    assert problems_of([good, clipped, small, empty]) == [
+        [],
+        ["clipped"],
+        ["small"],
+        ["empty"],
+    ]
+    assert summarize_problems(problems_of([good, small, small, empty])) == {
+        "small": 2,
+        "empty": 1,
+    }
+
+
+def test_adjusted_camera_dist():
+    views = [square(100, 45, 55), square(100, 40, 60)]
+    stats = view_stats(views)
+    # the largest view fills 0.2 and should fill 0.7
+    dist = adjusted_camera_dist(stats, problems_of(views), 2.0, 0.7)
+    assert dist == pytest.approx(2.0 * 0.2 / 0.7)
+    # but the camera moves at most 4 times closer
+    views = [square(100, 48, 52)]
+    stats = view_stats(views)
+    dist = adjusted_camera_dist(stats, problems_of(views), 2.0, 0.7)
+    assert dist == pytest.approx(0.5)
+    stats = view_stats([square(100, 30, 70)])
+    assert adjusted_camera_dist(stats, [["small"]], 2.0, 0.8) == pytest.approx(1.0)
+    # clipped views move the camera back
+    stats = view_stats([square(100, 0, 50)])
+    assert adjusted_camera_dist(stats, [["clipped"]], 2.0, 0.7) == pytest.approx(2.6)
+    # nothing to go by in empty views
+    stats = view_stats([np.zeros((10, 10))])
+    assert adjusted_camera_dist(stats, [["empty"]], 2.0, 0.7) == 2.0
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from work_queue import SqliteWorkQueue, leased_items, open_work_queue
+
+PATHS = [f"/objects/{uid}.glb" for uid in "abcd"]
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    work_queue = SqliteWorkQueue(str(tmp_path / "queue.db"), max_leases=2)
+    work_queue.add(PATHS)
+    work_queue.mark_seeded()
+    return work_queue
+
+
+def test_add_ignores_known_objects(work_queue):
+    work_queue.add(PATHS[:2])
+    assert work_queue.counts() == {"queued": 4}
+
+
+def test_lease_in_order(work_queue):
+    assert work_queue.lease("n1", 3, 60) == PATHS[:3]
+    assert work_queue.lease("n2", 3, 60) == PATHS[3:]
+    assert work_queue.lease("n2", 3, 60) == []
+    assert work_queue.counts() == {"leased": 4}
+
+
+def test_complete_checks_the_owner(work_queue):
+    work_queue.lease("n1", 2, 60)
+    assert not work_queue.complete("a", "n2")
+    assert work_queue.complete("a", "n1")
+    assert work_queue.complete("b", "n1", success=False)
+    # only once
+    assert not work_queue.complete("a", "n1")
+    assert work_queue.counts() == {"done": 1, "failed": 1, "queued": 2}
+
+
+def test_expired_leases_are_requeued_then_failed(work_queue):
+    assert work_queue.lease("n1", 1, 0) == PATHS[:1]
+    time.sleep(0.01)
+    # the expired object goes back to the front of the queue
+    assert work_queue.lease("n2", 1, 0) == PATHS[:1]
+    time.sleep(0.01)
+    # n1 lost its lease, and n2 did too once it expired
+    assert not work_queue.complete("a", "n1")
+    assert work_queue.lease("n3", 1, 60) == PATHS[1:2]
+    assert not work_queue.complete("a", "n2")
+    assert work_queue.counts() == {"failed": 1, "leased": 1, "queued": 2}
+
+
+def test_heartbeat_extends_leases(work_queue):
+    work_queue.lease("n1", 1, 0.05)
+    work_queue.heartbeat("n1", 60)
+    time.sleep(0.1)
+    assert work_queue.lease("n2", 4, 60) == PATHS[1:]
+    assert work_queue.complete("a", "n1")
+
+
+def test_leased_items_stops_once_everything_is_done(work_queue):
+    items = []
+    for item in leased_items(work_queue, "n1", 3, 60, poll_interval=0):
+        items.append(item)
+        assert work_queue.complete(item.split("/")[-1][:-4], "n1")
+    assert items == PATHS
+    assert work_queue.counts() == {"done": 4}
+
+
+def test_leased_items_waits_for_the_queue_to_be_seeded(tmp_path):
+    work_queue = SqliteWorkQueue(str(tmp_path / "queue.db"))
+    assert not work_queue.is_seeded()
+
+    def seed():
+        time.sleep(0.1)
+        work_queue.add(PATHS)
+        work_queue.mark_seeded()
+
+    thread = threading.Thread(target=seed)
+    thread.start()
+    items = []
+    for item in leased_items(work_queue, "n1", 3, 60, poll_interval=0.01):
+        items.append(item)
+        work_queue.complete(item.split("/")[-1][:-4], "n1")
+    thread.join()
+    assert items == PATHS
+
+
+def test_open_work_queue(tmp_path):
+    work_queue = open_work_queue(f"sqlite://{tmp_path / 'queue.db'}", max_leases=5)
+    assert isinstance(work_queue, SqliteWorkQueue)
+    assert work_queue.max_leases == 5
+    with pytest.raises(ValueError):
+        open_work_queue("s3://bucket/queue")